@@ -0,0 +1,360 @@
+## Analysis.py
+## Author: Aparna Rajpurkar
+
+# switching and epigenetic memory of ensembles of replicas
+# every frame of a replica is "off" when at least a fraction thresh_M of the
+# nucleosomes is M (the convention of process_sims.pl), "on" when at least
+# thresh_A is A, and otherwise keeps the last of the two it was in
+# (hysteresis, so noise around one threshold is not counted as switching).
+# frames before the first crossing are undetermined.
+#
+# from these we collect, in one streaming pass over each trajectory:
+#   dwell times: time between entering a state and switching to the other one
+#       (log2 histogram). Dwells cut by the start or end of a trajectory are
+#       censored: they count as time spent in the state, not as dwells
+#   switching rates: switches out of a state per timestep spent in it,
+#       with a confidence interval for a poisson count
+#   first passage: first timestep a replica is off, and first it is on
+#   autocorrelation of the gap score up to max_lag, pooled over replicas
+# trajectories are read CHUNK frames at a time; the state kept between chunks
+# is the last max_lag gap scores, so memory does not grow with trajectory length
+
+# imports
+import numpy as np
+import Constants
+import Trajectory
+from MyEnum import States
+
+# frames read at once
+CHUNK = 1 << 14
+
+# longest lag of the autocorrelation
+MAX_LAG = 1000
+
+# log2 bins of dwell times: bin k holds dwells of 2^k to 2^(k+1) - 1 timesteps
+DWELL_BINS = 48
+
+# z value of the confidence intervals
+CI_Z = 1.96
+
+# macrostates of a replica
+UNDETERMINED, OFF, ON = range(3)
+MACRO_NAMES = ("undetermined", "off", "on")
+
+def gap_score(m, a):
+    '''
+    gap_score(M_totals, A_totals)
+    (M - A) / (M + A), 0 without M or A, as in Ensemble.replica_stats()
+    '''
+    m = np.asarray(m, dtype=float)
+    a = np.asarray(a, dtype=float)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(m + a > 0, (m - a) / (m + a), 0)
+
+def poisson_ci(count, exposure):
+    '''
+    poisson_ci(count, exposure)
+    (rate, low, high) of count events in exposure time
+    score interval, which stays sensible for a count of 0
+    '''
+    if exposure <= 0:
+        return np.nan, np.nan, np.nan
+    z2 = CI_Z ** 2
+    half = CI_Z * np.sqrt(count + z2 / 4)
+    return count / exposure, max(count + z2 / 2 - half, 0) / exposure, (count + z2 / 2 + half) / exposure
+
+class ReplicaPass:
+    '''
+    ReplicaPass class
+    streaming state of one replica, fed chunk by chunk with add()
+    '''
+
+    def __init__(self, analysis, n):
+        '''
+        initialization function
+        '''
+        self.analysis = analysis
+        self.n = n
+        self.t = 0
+
+        # current macrostate, when it started, and whether its start was seen
+        self.state = UNDETERMINED
+        self.start = 0
+        self.complete = False
+
+        self.first = [ None, None, None ]
+
+        # autocorrelation: products per lag, the first and last max_lag gap scores
+        lags = analysis.max_lag + 1
+        self.products = np.zeros(shape=(lags))
+        self.total = 0.0
+        self.head = np.zeros(shape=(0))
+        self.context = np.zeros(shape=(0))
+
+    def add(self, trace_M, trace_A):
+        '''
+        add(M_totals, A_totals)
+        the next frames of the replica
+        '''
+        frames = len(trace_M)
+        if frames == 0:
+            return
+
+        analysis = self.analysis
+        m = np.asarray(trace_M, dtype=float) / self.n
+        a = np.asarray(trace_A, dtype=float) / self.n
+
+        # threshold crossings, carried forward over frames between the thresholds
+        macro = np.where(m >= analysis.thresh_M, OFF, np.where(a >= analysis.thresh_A, ON, UNDETERMINED))
+        known = np.where(macro != UNDETERMINED, np.arange(frames), -1)
+        np.maximum.accumulate(known, out=known)
+        filled = np.where(known >= 0, macro[np.maximum(known, 0)], self.state)
+
+        # runs: every change of macrostate ends the run before it
+        before = np.r_[self.state, filled[:-1]]
+        changes = np.flatnonzero(filled != before)
+        if len(changes) > 0:
+            times = self.t + changes
+            new = filled[changes]
+
+            # runs that end here: (state, start, complete)
+            run_state = np.r_[self.state, new[:-1]]
+            run_start = np.r_[self.start, times[:-1]]
+            run_complete = np.r_[self.complete, times[:-1] > 0]
+            dwell = times - run_start
+
+            ended = run_state != UNDETERMINED
+            # runs that end at a change always end in a switch: after the first
+            # crossing the macrostate is never undetermined again
+            analysis.add_runs(run_state[ended], dwell[ended], run_complete[ended], True)
+
+            for state in (OFF, ON):
+                if self.first[state] is None and np.any(new == state):
+                    self.first[state] = int(times[np.argmax(new == state)])
+
+            self.state = int(new[-1])
+            self.start = int(times[-1])
+            # a state already reached at frame 0 was entered before we saw it
+            self.complete = bool(times[-1] > 0)
+
+        # autocorrelation products with the last max_lag gap scores before the chunk
+        gap = gap_score(trace_M, trace_A)
+        lags = analysis.max_lag + 1
+        z = np.r_[self.context, gap]
+        b = np.r_[np.zeros(len(self.context)), gap]
+        size = len(z) + lags
+        corr = np.fft.irfft(np.fft.rfft(b, size) * np.conj(np.fft.rfft(z, size)), size)
+        self.products += corr[:lags]
+
+        self.total += gap.sum()
+        if len(self.head) < lags:
+            self.head = np.r_[self.head, gap[:lags - len(self.head)]]
+        self.context = z[-analysis.max_lag:] if analysis.max_lag > 0 else z[:0]
+
+        self.t += frames
+
+    def finish(self):
+        '''
+        finish()
+        close the last run and hand the replica to the analysis
+        '''
+        if self.state != UNDETERMINED:
+            self.analysis.add_runs(np.array([ self.state ]), np.array([ self.t - self.start ]), np.array([ False ]), False)
+
+        # lagged sums: N_k pairs, sums of the first and of the second members
+        T = self.t
+        lags = min(self.analysis.max_lag + 1, T)
+        k = np.arange(lags)
+        pairs = T - k
+        head_sums = np.r_[0, np.cumsum(self.head)][:lags]
+        tail_sums = np.r_[0, np.cumsum(self.context[::-1])][:lags] if len(self.context) > 0 else np.zeros(lags)
+        first = self.total - tail_sums
+        second = self.total - head_sums
+
+        # centered products of every lag
+        cov = self.products[:lags] - first * second / pairs
+        self.analysis.add_autocorrelation(cov, pairs)
+        self.analysis.add_passage(self.first[OFF], self.first[ON], T)
+
+class Analysis:
+    '''
+    Analysis class
+    switching statistics over any number of replicas
+    '''
+
+    def __init__(self, thresh_M=Constants.PERCENT_M_THRESH, thresh_A=Constants.PERCENT_M_THRESH, max_lag=MAX_LAG):
+        '''
+        initialization function
+        '''
+        self.thresh_M = thresh_M
+        self.thresh_A = thresh_A
+        self.max_lag = max_lag
+
+        self.replicas = 0
+
+        # per macrostate: complete dwell histogram, switches out, timesteps spent
+        self.dwell_hist = np.zeros(shape=(3, DWELL_BINS), dtype=np.int64)
+        self.dwell_sum = np.zeros(shape=(3))
+        self.switches = np.zeros(shape=(3), dtype=np.int64)
+        self.censored = np.zeros(shape=(3), dtype=np.int64)
+        self.exposure = np.zeros(shape=(3))
+
+        # first passage times of every replica, None if never reached
+        self.first_off = []
+        self.first_on = []
+        self.lengths = []
+
+        self.cov = np.zeros(shape=(max_lag + 1))
+        self.pairs = np.zeros(shape=(max_lag + 1))
+
+    def replica(self, n):
+        '''
+        replica(N_nucs)
+        start a new replica
+        '''
+        return ReplicaPass(self, n)
+
+    def add_runs(self, states, dwells, complete, switched):
+        '''
+        add_runs(states, dwell_times, complete, switched)
+        runs of macrostates that ended, in a switch or at the end of a trajectory
+        complete runs ended in a switch and their start was seen
+        '''
+        np.add.at(self.exposure, states, dwells)
+        if switched:
+            np.add.at(self.switches, states, 1)
+
+        # censored runs count as time in the state only
+        np.add.at(self.censored, states[~complete], 1)
+        states = states[complete]
+        dwells = dwells[complete]
+
+        bins = np.minimum(np.floor(np.log2(np.maximum(dwells, 1))).astype(np.intp), DWELL_BINS - 1)
+        np.add.at(self.dwell_hist, (states, bins), 1)
+        np.add.at(self.dwell_sum, states, dwells)
+
+    def add_passage(self, first_off, first_on, length):
+        '''
+        add_passage(first_off_timestep, first_on_timestep, frames)
+        '''
+        self.replicas += 1
+        self.first_off.append(first_off)
+        self.first_on.append(first_on)
+        self.lengths.append(length)
+
+    def add_autocorrelation(self, cov, pairs):
+        '''
+        add_autocorrelation(centered_products, pairs)
+        '''
+        self.cov[:len(cov)] += cov
+        self.pairs[:len(pairs)] += pairs
+
+    def add_traces(self, trace_M, trace_A, n):
+        '''
+        add_traces(M_totals, A_totals, N_nucs)
+        a replica from totals in memory, e.g. a SimResult
+        '''
+        replica = self.replica(n)
+        for t0 in range(0, len(trace_M), CHUNK):
+            replica.add(trace_M[t0:t0 + CHUNK], trace_A[t0:t0 + CHUNK])
+        replica.finish()
+
+    def add_trajectory(self, filename):
+        '''
+        add_trajectory(filename)
+        a replica from a trajectory file, text or event log, read CHUNK frames at a time
+        '''
+        traj = Trajectory.open_trajectory(filename)
+        replica = self.replica(traj.n)
+
+        if isinstance(traj, Trajectory.TextReader):
+            for t0 in range(0, traj.num_frames, CHUNK):
+                self.add_frames(replica, traj.window(t0, t0 + CHUNK))
+        else:
+            # event logs replay from the start, so stream them in a single pass
+            frames = np.zeros(shape=(min(CHUNK, traj.num_frames), traj.n), dtype=np.uint8)
+            t = 0
+            for frame in traj.iter_frames():
+                frames[t] = frame
+                t += 1
+                if t == len(frames):
+                    self.add_frames(replica, frames)
+                    t = 0
+            self.add_frames(replica, frames[:t])
+
+        traj.close()
+        replica.finish()
+
+    def add_frames(self, replica, frames):
+        '''
+        add_frames(replica, frames)
+        the totals of a (frames, n) block of states
+        '''
+        replica.add((frames == States.M_STATE).sum(axis=1), (frames == States.A_STATE).sum(axis=1))
+
+    def switching(self):
+        '''
+        switching()
+        per state (off, on): switches out, timesteps spent, rate, its
+        confidence interval, complete dwells, their mean and censored runs
+        '''
+        rows = []
+        for state in (OFF, ON):
+            rate, low, high = poisson_ci(self.switches[state], self.exposure[state])
+            dwells = self.dwell_hist[state].sum()
+            mean = self.dwell_sum[state] / dwells if dwells > 0 else np.nan
+            rows.append((MACRO_NAMES[state], int(self.switches[state]), self.exposure[state], rate, low, high,
+                dwells, mean, self.censored[state]))
+        return rows
+
+    def passage(self):
+        '''
+        passage()
+        per target state: replicas that reached it, mean and median first passage time
+        '''
+        rows = []
+        for name, times in (("off", self.first_off), ("on", self.first_on)):
+            reached = np.array([ x for x in times if x is not None ], dtype=float)
+            rows.append((name, len(reached), self.replicas,
+                reached.mean() if len(reached) > 0 else np.nan,
+                np.median(reached) if len(reached) > 0 else np.nan))
+        return rows
+
+    def autocorrelation(self):
+        '''
+        autocorrelation()
+        autocorrelation of the gap score per lag, pooled over replicas
+        '''
+        with np.errstate(divide='ignore', invalid='ignore'):
+            c = np.where(self.pairs > 0, self.cov / self.pairs, np.nan)
+            return c / c[0]
+
+    def write(self, outfile):
+        '''
+        write(outfile)
+        <outfile>_switching.txt, _dwell.txt, _passage.txt and _acf.txt
+        '''
+        with open(outfile + "_switching.txt", "w") as fp:
+            fp.write("State\tSwitches\tTimesteps\tRate\tRateLow\tRateHigh\tDwells\tMeanDwell\tCensored\n")
+            for row in self.switching():
+                fp.write("\t".join(str(x) for x in row) + "\n")
+
+        with open(outfile + "_dwell.txt", "w") as fp:
+            fp.write("DwellFrom\tDwellTo\tOff\tOn\n")
+            last = max(np.flatnonzero(self.dwell_hist.sum(axis=0)).max(initial=0) + 1, 1)
+            for k in range(last):
+                fp.write("\t".join(str(x) for x in (
+                    2 ** k, 2 ** (k + 1) - 1, self.dwell_hist[OFF, k], self.dwell_hist[ON, k]
+                    )) + "\n")
+
+        with open(outfile + "_passage.txt", "w") as fp:
+            fp.write("Target\tReached\tReplicas\tMeanFirstPassage\tMedianFirstPassage\n")
+            for row in self.passage():
+                fp.write("\t".join(str(x) for x in row) + "\n")
+
+        with open(outfile + "_acf.txt", "w") as fp:
+            fp.write("Lag\tAutocorrelation\tPairs\n")
+            acf = self.autocorrelation()
+            for k in range(len(acf)):
+                if self.pairs[k] > 0:
+                    fp.write(str(k) + "\t" + str(acf[k]) + "\t" + str(int(self.pairs[k])) + "\n")
@@ -10,8 +10,12 @@ import matplotlib.pyplot as plt
 import matplotlib.animation as animation
 import scipy.stats as stats
 import Constants
+import Trajectory
 from MyEnum import ProbSpread, States, Domain, DomainBleed, Divisions, ProbConv
 
+# color of every state enum, to color whole frames at once
+COLOR_TABLE = np.array([ Constants.state_to_color(s) or Constants.GRAY for s in States.get_enums() ])
+
 def animate_from_file(filename, n, f, t, outfile, div_count):
     '''
     animate_from_file(simulation_filename, N_nucs, F_val, T_timesteps, basefilename, num_divisions)
@@ -22,10 +26,10 @@ def animate_from_file(filename, n, f, t, outfile, div_count):
     # these will be used in the frame animation function--must be global
     global colors
     global totals
-    global file_sim
+    global frames
 
     # initialize globals 
-    colors = [Constants.GRAY]*n
+    colors = np.array([Constants.GRAY]*n)
     totals = {
         States.A_STATE : 0,
         States.M_STATE : 0,
@@ -91,43 +95,40 @@ def animate_from_file(filename, n, f, t, outfile, div_count):
     linex = []
     liney = [[], []]
 
-    # open the input file
-    file_sim = open(filename, "r")
+    # open the input file, text or event log
+    traj = Trajectory.open_trajectory(filename)
+    frames = traj.iter_frames()
 
     # initialize
     def init_an():
         '''initialize animation: this is needed'''
-        return scat, (*lines)
+        return (scat, *lines)
 
     # update function
     def update_an(i):
         '''update function for animation'''
         # check if this is first loop, if yes then go to next
         if i == 0:
-            return scat, (*lines)
-
-        # get a line from the file
-        line = file_sim.readline()
-
-        # initialize all totals to 0
-        totals[States.A_STATE] = 0
-        totals[States.U_STATE] = 0
-        totals[States.M_STATE] = 0
-        # init index
-        index = 0
-
-        for nuc in list(line.rstrip()):
-            # go through each nucleosome and set the color & update totals
-            totals[States.string_to_enum(nuc)] += 1
-            colors[index] = Constants.state_to_color(States.string_to_enum(nuc))
-            index += 1
-
-            # check if we're dividing in this frame
-            if div_count != 0 and i != 0:
-                if i % div_count == 0:
-                    # if we are dividing, add a vertical line to the plot to indicate division
-                    lines.append(ax2.plot([], [], lw = 1, ls = "dotted", color = "black")[0])
-                    lines[len(lines) - 1].set_data([i, i], [-5, 105])
+            return (scat, *lines)
+
+        # get the next frame from the file
+        frame = next(frames, None)
+        if frame is None:
+            return (scat, *lines)
+
+        # go through each nucleosome and set the color & update totals
+        counts = np.bincount(frame, minlength=len(States.get_enums()))
+        totals[States.A_STATE] = counts[States.A_STATE]
+        totals[States.U_STATE] = counts[States.U_STATE]
+        totals[States.M_STATE] = counts[States.M_STATE]
+        colors[:] = COLOR_TABLE[frame]
+
+        # check if we're dividing in this frame
+        if div_count != 0 and i != 0:
+            if i % div_count == 0:
+                # if we are dividing, add a vertical line to the plot to indicate division
+                lines.append(ax2.plot([], [], lw = 1, ls = "dotted", color = "black")[0])
+                lines[len(lines) - 1].set_data([i, i], [-5, 105])
 
         # append the new x,y coordinates of the plot
         linex.append(i)
@@ -142,7 +143,7 @@ def animate_from_file(filename, n, f, t, outfile, div_count):
         scat.set_facecolors(colors)
 
         # return updated data
-        return scat, (*lines)
+        return (scat, *lines)
 
     # run animation and store output in a variable
     anim = animation.FuncAnimation(fig, update_an, init_func = init_an, frames = t, interval = 1, repeat = False, blit=True)
@@ -153,5 +154,5 @@ def animate_from_file(filename, n, f, t, outfile, div_count):
     anim.save(outfile + ".mp4", writer = writer)
 
     # close the input file
-    file_sim.close()
+    traj.close()
 
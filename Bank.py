@@ -0,0 +1,283 @@
+## Bank.py
+## Author: Aparna Rajpurkar
+
+# burn-in snapshot bank for warm starts
+# the burn-in before recruitment does not depend on the recruitment settings,
+# so it is simulated once per setting (N, F, divisions, ..., see setting())
+# and kept as a bank of snapshots: the state at the end of the burn-in of
+# every replica.
+# a bank is a directory with one subdirectory per setting:
+#   <bank>/<key>/bank.json    setting, burn-in length and an index of the
+#                             snapshots (sim number, totals and gap score)
+#   <bank>/<key>/states.npy   states of every snapshot, 4 nucleosomes per byte
+#   <bank>/<key>/timers.npz   pending conversions of every snapshot
+# key is a hash of the setting.
+#
+# replica i of a warm started simulation starts at timestep 0 from snapshot i;
+# a bank must have a snapshot for every replica (Input.check_bank_size()
+# refuses ensembles larger than the bank). The stream number is not part
+# of the setting: replica i of every parameter point starts from the same
+# snapshot, but continues with random numbers of its own stream and sim number
+# (Chromatin.warm_start()). Only with --crn do replicas of different points
+# also continue the same numbers: the common streams carry on after the
+# burn-in, so replica i with burn-in B and recruitment at R follows a cold
+# --crn run of replica i with recruitment at B + R from timestep B on
+# (timestep 0 never divides, and the pool of nucleosomes without pending
+# conversions is rebuilt as in lineage mode)
+
+# imports
+import copy
+import hashlib
+import json
+import multiprocessing
+import os
+import numpy as np
+import Chromatin
+import Constants
+import MeanField
+import Trajectory
+from MyEnum import Divisions, Recruit, States
+
+# banks read by this process, by directory
+_banks = {}
+
+class Snapshot:
+    '''
+    Snapshot class
+    state of a replica at the end of its burn-in
+    '''
+
+    def __init__(self, states, timers, burn_in):
+        '''
+        initialization function
+        '''
+        self.states = states
+        self.timers = timers
+        self.burn_in = burn_in
+
+def setting(inputs):
+    '''
+    setting(inputs)
+    the inputs the burn-in depends on: everything but recruitment, output
+    and the simulation engine. Without divisions the cell cycle is the whole
+    simulation, so the number of timesteps is part of the setting
+    '''
+    adv = inputs['adv']
+    data = inputs['data']
+    return {
+            'n' : int(inputs['n']),
+            'f' : float(inputs['f']),
+            'initstate' : int(inputs['i']),
+            'divisions' : int(data['divisions']) if inputs['d'] != Divisions.NONE else None,
+            'cellcycle' : int(Constants.get_timesteps_per_cellcycle(inputs)),
+            'division_replace' : int(adv['division_replace']),
+            'prob_spread' : int(adv['prob_spread']),
+            'domain' : int(adv['domain']),
+            'domains' : int(data['domains']),
+            'domain_sizes' : data['domain_sizes'],
+            'domainbleed' : int(adv['domainbleed']),
+            'domainbleed_prob' : float(data['domainbleed']),
+            'rates' : [ Constants.CR_U_to_A, Constants.CR_A_to_U, Constants.CR_U_to_M, Constants.CR_M_to_U ],
+            'seed' : int(data['seed']),
+            'crn' : bool(data['crn'])
+            }
+
+def get_key(inputs):
+    '''
+    get_key(inputs)
+    name of the subdirectory of the setting of the inputs
+    '''
+    text = json.dumps(setting(inputs), sort_keys=True)
+    return hashlib.sha1(text.encode()).hexdigest()[:16]
+
+def get_dir(inputs):
+    '''
+    get_dir(inputs)
+    '''
+    return os.path.join(inputs['data']['bank'], get_key(inputs))
+
+def pack_states(states):
+    '''
+    pack_states(snapshots_by_nucleosomes_array)
+    4 states per byte
+    '''
+    per_byte = 8 // Trajectory.STATE_BITS
+    padded = np.zeros(shape=(states.shape[0], -(-states.shape[1] // per_byte) * per_byte), dtype=np.uint8)
+    padded[:, :states.shape[1]] = states
+    groups = padded.reshape(states.shape[0], -1, per_byte)
+
+    packed = np.zeros(shape=groups.shape[:2], dtype=np.uint8)
+    for k in range(per_byte):
+        packed |= groups[:, :, k] << (k * Trajectory.STATE_BITS)
+    return packed
+
+def unpack_states(packed, n):
+    '''
+    unpack_states(packed_states, N_nucs)
+    '''
+    per_byte = 8 // Trajectory.STATE_BITS
+    shifts = np.arange(per_byte, dtype=np.uint8) * Trajectory.STATE_BITS
+    states = (packed[..., None] >> shifts) & Trajectory.STATE_MASK
+    return states.reshape(packed.shape[:-1] + (-1,))[..., :n].astype(np.uint8)
+
+def run_burn_in(task):
+    '''
+    run_burn_in((inputs, sim_num, burn_in))
+    simulate the burn-in of a replica without recruitment and output
+    returns (states, timers)
+    '''
+    inputs, sim_num, burn_in = task
+    chromatin = Chromatin.Chromatin(inputs, sim_num)
+    chromatin.init_timesim(inputs['n'])
+
+    for t in range(burn_in):
+        chromatin.TIME = t
+        chromatin.step(t)
+
+    return chromatin.save_state()
+
+def create_bank(inputs, burn_in, replicas, procs=1):
+    '''
+    create_bank(inputs, burn_in_timesteps, replicas, processes)
+    simulate the burn-in of replicas 0 to replicas - 1 and write their snapshots
+    the burn-in is rounded up to whole cell cycles, so divisions of a warm
+    start fall on the same timesteps as in a cold run
+    returns the directory of the bank of the setting
+    '''
+    inputs = copy.deepcopy(inputs)
+    inputs['r'] = Recruit.NONE
+    if inputs['d'] != Divisions.NONE:
+        div = inputs['data']['divisions']
+        burn_in = -(-burn_in // div) * div
+
+    tasks = [ (inputs, sim_num, burn_in) for sim_num in range(replicas) ]
+    if procs > 1:
+        with multiprocessing.Pool(procs) as pool:
+            results = pool.map(run_burn_in, tasks)
+    else:
+        results = [ run_burn_in(task) for task in tasks ]
+
+    bank_dir = get_dir(inputs)
+    os.makedirs(bank_dir, exist_ok=True)
+
+    states = np.array([ result[0] for result in results ], dtype=np.uint8)
+    np.save(os.path.join(bank_dir, "states.npy"), pack_states(states))
+
+    # pending conversions of all snapshots, concatenated
+    timers = [ result[1] for result in results ]
+    np.savez(os.path.join(bank_dir, "timers.npz"),
+            counts=np.array([ len(t) for t in timers ], dtype=np.intp),
+            nucs=np.array([ i for t in timers for i in t ], dtype=np.intp),
+            timer=np.array([ x['timer'] for t in timers for x in t.values() ], dtype=np.intp),
+            old=np.array([ x['old'] for t in timers for x in t.values() ], dtype=np.intp),
+            new=np.array([ x['new'] for t in timers for x in t.values() ], dtype=np.intp))
+
+    index = []
+    for sim_num, (snapshot, timer) in enumerate(results):
+        totals = np.bincount(snapshot, minlength=len(States.get_enums()))
+        m = int(totals[States.M_STATE])
+        a = int(totals[States.A_STATE])
+        index.append({
+            'sim' : sim_num,
+            'M' : m,
+            'U' : int(totals[States.U_STATE]),
+            'A' : a,
+            'gap' : (m - a) / (m + a) if m + a > 0 else 0
+            })
+
+    bank = { 'setting':setting(inputs), 'burn_in':burn_in, 'snapshots':index }
+    tmp = os.path.join(bank_dir, ".bank.json.tmp")
+    with open(tmp, "w") as fp:
+        json.dump(bank, fp)
+    # the index is written last, so a bank is never read half written
+    os.rename(tmp, os.path.join(bank_dir, "bank.json"))
+
+    print("Bank:", bank_dir, "N =", inputs['n'], "F =", inputs['f'], "burn-in:", burn_in, "snapshots:", replicas)
+    return bank_dir
+
+def bank_configs(inputs):
+    '''
+    bank_configs(inputs)
+    inputs of every screened F value and division interval
+    (--screen-Fval, --screen-divisions) with a bank of its own
+    '''
+    grid = MeanField.make_grid(inputs)
+    settings = sorted(set(zip(grid['f'].tolist(), grid['divisions'].tolist())))
+
+    configs = []
+    dirs = []
+    for f, div in settings:
+        config = copy.deepcopy(inputs)
+        config['f'] = f
+        config['data']['divisions'] = div
+        # without divisions the interval is not part of the setting
+        if get_dir(config) in dirs:
+            continue
+        dirs.append(get_dir(config))
+        configs.append(config)
+    return configs
+
+def create_banks(inputs):
+    '''
+    create_banks(inputs)
+    one bank for every screened F value and division interval
+    (--screen-Fval, --screen-divisions) with --replicas snapshots each
+    '''
+    return [ create_bank(config, inputs['data']['burn_in'], inputs['data']['replicas'], inputs['data']['procs'])
+            for config in bank_configs(inputs) ]
+
+def bank_size(inputs):
+    '''
+    bank_size(inputs)
+    snapshots in the bank of the setting, 0 if there is none
+    '''
+    filename = os.path.join(get_dir(inputs), "bank.json")
+    if not os.path.exists(filename):
+        return 0
+    with open(filename, "r") as fp:
+        return len(json.load(fp)['snapshots'])
+
+def load_bank(bank_dir):
+    '''
+    load_bank(bank_directory)
+    index, packed states and timers of a bank
+    '''
+    if bank_dir not in _banks:
+        filename = os.path.join(bank_dir, "bank.json")
+        if not os.path.exists(filename):
+            raise FileNotFoundError("no snapshots of this setting in " + bank_dir + ", create them with MainBank.py")
+
+        with open(filename, "r") as fp:
+            bank = json.load(fp)
+        bank['states'] = np.load(os.path.join(bank_dir, "states.npy"), mmap_mode="r")
+        with np.load(os.path.join(bank_dir, "timers.npz")) as timers:
+            bank['timers'] = { name:timers[name] for name in timers.files }
+        bank['timer_offsets'] = np.r_[0, np.cumsum(bank['timers']['counts'])]
+
+        _banks[bank_dir] = bank
+
+    return _banks[bank_dir]
+
+def get_snapshot(inputs, sim_num):
+    '''
+    get_snapshot(inputs, sim_num)
+    snapshot that replica sim_num starts from
+    reusing snapshots would make the replicas of an ensemble dependent,
+    so replicas beyond the bank size are refused
+    '''
+    bank_dir = get_dir(inputs)
+    bank = load_bank(bank_dir)
+    size = len(bank['snapshots'])
+    if sim_num >= size:
+        raise ValueError("replica " + str(sim_num) + " needs a snapshot, but " + bank_dir + " has only " +
+                str(size) + ": create the bank with --replicas " + str(sim_num + 1) + " or more")
+    k = sim_num
+
+    states = unpack_states(np.asarray(bank['states'][k]), inputs['n'])
+
+    timers = {}
+    t = bank['timers']
+    for j in range(bank['timer_offsets'][k], bank['timer_offsets'][k + 1]):
+        timers[int(t['nucs'][j])] = { 'timer':int(t['timer'][j]), 'old':int(t['old'][j]), 'new':int(t['new'][j]) }
+
+    return Snapshot(states, timers, bank['burn_in'])
@@ -2,16 +2,65 @@
 ## Author: Aparna Rajpurkar
 
 # imports
-import sys
 import math
-import random
 import numpy as np
-import operator
-import matplotlib.pyplot as plt
-import matplotlib.animation as animation
-import scipy.stats as stats
 import Constants
-from MyEnum import ProbSpread, States, Domain, DomainBleed, Divisions, ProbConv, Recruit
+import Kernel
+import LiveView
+import Operators
+import Spreading
+import Stopping
+import Telemetry
+import Trajectory
+from MyEnum import ProbSpread, States, Domain, DomainBleed, Divisions, ProbConv, Recruit, TimeStep, Phase, Stop
+
+# number of ordinary timesteps to take before trying to leap again
+# when a leap would be too short to pay off
+LEAP_RETRY = 10
+
+# the fields of the whole string that leaps need are kept between tries and
+# updated with the kernel columns of the nucleosomes that changed since.
+# They are computed afresh when more than 1/FIELD_CHANGED_SHARE of the
+# string changed (after a division), and every FIELD_REFRESH updates
+FIELD_CHANGED_SHARE = 4
+FIELD_REFRESH = 100
+
+# coordinate after the sim number of the streams of warm starts from a bank,
+# apart from those of cold starts and of lineage cells (Lineage.CELL_STREAMS)
+WARM_STREAMS = 2
+
+## begin helper functions ##
+
+def expected_events(lam, a, lim):
+    '''
+    expected_events(poisson_mean, alpha, pool_size)
+    expected number of random and feedback events in one timestep of
+    step_events(): N ~ poisson(lam) events capped at lim, of which
+    R ~ poisson(lam * a) capped at N are random
+    uses E[min(X, Y)] = sum over k >= 1 of P(X >= k) P(Y >= k)
+    '''
+    if lam <= 0 or lim <= 0:
+        return 0, 0
+
+    # sum far enough into the tail of the larger poisson
+    k_max = min(lim, int(lam + 12 * math.sqrt(lam) + 12))
+    k = np.arange(k_max + 1)
+
+    def survival(mean):
+        # P(X >= k) for k = 1..k_max
+        if mean <= 0:
+            return np.zeros(k_max)
+        log_pmf = k * math.log(mean) - mean - np.array([ math.lgamma(x + 1) for x in k ])
+        cdf = np.cumsum(np.exp(log_pmf))
+        return np.clip(1 - cdf[:-1], 0, 1)
+
+    sf_events = survival(lam)
+    sf_rand = survival(lam * a)
+
+    num_events = np.sum(sf_events)
+    num_rand = np.sum(sf_events * sf_rand)
+
+    return num_rand, num_events - num_rand
 
 ## begin class definitions ##
 
@@ -22,11 +71,11 @@ class Nucleosome:
     and perform functions on that nucleosome
     '''
 
-    def __init__(self, init_state, left, right):
+    def __init__(self, init_state, left, right, rng):
         ''' initialization function '''
         # check if we initialize the state randomly
         if init_state == States.INIT_STATE:
-            self.state = int(random.choice(
+            self.state = int(rng.choice(
                 [States.U_STATE, States.M_STATE, States.A_STATE]
                 ))
         else:
@@ -55,12 +104,17 @@ class Chromatin:
     across the string of nucleosomes. Modify with caution.
     '''
 
-    def __init__(self, input_dat):
+    def __init__(self, input_dat, sim_num=0):
         '''
         initialization function
         '''
         # set the input data as a class variable
         self.dat = input_dat
+        self.timesteps_per_cellcycle = Constants.get_timesteps_per_cellcycle(input_dat)
+
+        # random number streams of this simulation only
+        self.sim_num = sim_num
+        self.set_streams(sim_num)
 
         # initialize class variables
         self.events = []
@@ -70,23 +124,68 @@ class Chromatin:
                 States.U_STATE:0
                 }
 
-        self.colors = []
         self.nucleosomes = []
 
         self.TIME = 0
         self.time_array = []
 
-        self.prob_mat = np.zeros(shape=(input_dat['n'],input_dat['n']))
-        self.M_mat = np.zeros(shape=(input_dat['n']))
-        self.A_mat = np.zeros(shape=(input_dat['n']))
+        # cached output line of the current state, see print_nucs()
+        self.line = None
+
+        # state of every nucleosome as a compact array of state enums
+        # the nucleosome objects only set the initial states; from then on
+        # this array is the state of the string
+        self.states = np.zeros(shape=(input_dat['n']), dtype=np.uint8)
+
+        # trajectory writer, set by timesim()
+        self.writer = None
+
+        # snapshot of a burn-in to start from, see Bank.py
+        self.snapshot = None
+
+        # masks of M and A nucleosomes
+        self.M_mat = np.zeros(shape=(input_dat['n']), dtype=np.uint8)
+        self.A_mat = np.zeros(shape=(input_dat['n']), dtype=np.uint8)
 
         # run initialization functions
-        self.init_nucs(input_dat['adv']['domain'], input_dat['n'], input_dat['i'], input_dat['data']['domains'])
+        self.init_nucs(input_dat['adv']['domain'], input_dat['n'], input_dat['i'], input_dat['data']['domains'], input_dat['data']['domain_sizes'])
 
         self.init_prob_mat(input_dat['n'], input_dat['adv']['domainbleed'], input_dat['data']['domainbleed'])
 
+        # partners of targeted spreading
+        self.spreader = None
+        if input_dat['adv']['prob_spread'] == ProbSpread.POWERLAW:
+            self.spreader = Spreading.PartnerSampler(input_dat['n'], self.domain_limits, Constants.POWER)
+
+        # cell cycle operators, see Operators.py
+        self.divider = Operators.DivisionOperator(input_dat, [ input_dat['n'] ])
+        self.recruiter = Operators.RecruitmentOperator(input_dat, [ input_dat['n'] ])
+
         self.init_colors_and_state_mats(input_dat['n'])
 
+    def set_streams(self, *coords):
+        '''
+        set_streams(coordinates...)
+        random number streams of the coordinates (sim number, ...)
+        with --crn, common streams that are synced at every phase, see sync()
+        '''
+        self.crn, self.rng, self.np_rng = Constants.make_streams(self.dat['data'], *coords)
+
+    def sync(self, t, phase):
+        '''
+        sync(timestep, phase)
+        with common random numbers, start the numbers of a phase of timestep t
+        '''
+        if self.crn is not None:
+            self.crn.sync(t, phase)
+
+    @property
+    def colors(self):
+        '''
+        color of every nucleosome
+        '''
+        return [ Constants.state_to_color(state) for state in self.states ]
+
 
     ## init functions ##
     def init_colors_and_state_mats(self, n):
@@ -97,10 +196,10 @@ class Chromatin:
         '''
         # iterate over all nucleosomes
         for i in range(n):
-            # handle colors and state totals
+            # handle state totals
             curr_state = self.nucleosomes[i].state
-            self.colors.append(Constants.state_to_color(curr_state))
             self.totals[curr_state] += 1
+            self.states[i] = curr_state
 
             # handle boolean arrays of states
             if curr_state == States.M_STATE:
@@ -111,120 +210,27 @@ class Chromatin:
     def init_prob_mat(self, n_nucs, db_enum, db_val):
         '''
         init_prob_mat()
-        initialize probability matrix based on input options
-        '''
-
-        # iterate over all nucs
-        for col in range(n_nucs):
-            # get the limit of each nuc
-            left = self.nucleosomes[col].left_limit
-            right = self.nucleosomes[col].right_limit
-            
-            # for every other nuc:
-            for row in range(n_nucs):
-                # if we are on the same index, skip
-                if col == row:
-                    continue
-                
-                # otherwise, calculate probability
-                prob = self.calc_prob(col, row, right, left, db_enum, db_val, n_nucs)
-
-                if prob == -1:
-                    continue
-                elif prob == -2:
-                    break
-
-                # add calculated probability to correct cell of matrix
-                self.prob_mat[col,row] = prob
+        initialize block-structured probability kernel based on input options
+        '''
+        self.kernel = Kernel.make_kernel(n_nucs, self.domain_limits, db_enum, db_val, self.dat['adv'], self.dat['data']['kernel_tol'])
 
-    def init_nucs(self, domain_enum, n, initstate, num_domains):
+    def init_nucs(self, domain_enum, n, initstate, num_domains, domain_sizes):
         '''
         init_nucs()
         initialize string of nucleosomes and set limits
         '''
+        # calculate the limits of each domain
+        # with no domains, the limits are the start and end of the string
+        self.domain_limits = Kernel.domain_limits(domain_enum, n, num_domains, domain_sizes)
 
-        # check domain option
-        if domain_enum == Domain.NONE:
-            # if no domains, just make the limits the start and end of the string
-            self.nucleosomes = [ 
-                    Nucleosome(initstate, 0, n) for x in range(n) 
-                    ]
-        elif domain_enum == Domain.EQUAL_DEFAULT:
-            # else, calculate limits
-            # NOTE: domain bleedthrough is NOT currently considered
-            domain_sizes = math.floor(n / num_domains)
-            num_d = num_domains
-
-            for i in range(n):
-                # calculate indicies for each nucleosome
-                low_index = math.floor(i / domain_sizes) * domain_sizes
-                high_index = low_index + domain_sizes - 1
-
-                if high_index >= n :
-                    high_index = n - 1
-
+        for left, right in self.domain_limits:
+            for i in range(left, min(right, n - 1) + 1):
                 self.nucleosomes.append(
-                        Nucleosome(initstate, low_index, high_index)
+                        Nucleosome(initstate, left, right, self.rng)
                         )
 
 
     ## helper functions ##
-    def calc_prob(self, col, row, right, left, domainbleed_enum, domainbleed_val, n):
-        '''
-        calc_prob()
-        calculate probability given domain options and indicies for a nucleosome
-        '''
-        # if no domain bleed
-        if domainbleed_enum == DomainBleed.NONE:
-            # hard limits on probability
-            if row < left:
-                return -1 # continue
-            elif row > right:
-                return -2 # break
-            
-            if row < col:
-                return stats.powerlaw.ppf( (col - row) / (col - left), Constants.POWER)
-            else:
-                return stats.powerlaw.ppf( (row - col) / (right - col), Constants.POWER)
-            
-        else:
-            # calculate probabilities if domain bleedthrough is possible
-            extreme_left = left
-            extreme_right = right
-
-            if left > 0:
-                extreme_left = self.nucleosomes[left - 1].left_limit
-
-            if right < n - 1:
-                extreme_right = self.nucleosomes[right + 1].right_limit
-
-            if row < extreme_left:
-                return -1 # continue
-
-            if row > extreme_right:
-                return -2 # break
-
-            prob = 0
-
-            if row < left:
-                prob = domainbleed_val * stats.powerlaw.ppf( 
-                        (col - row) / (col - extreme_left), Constants.POWER
-                        )
-            elif row > right:
-                prob = domainbleed_val * stats.powerlaw.ppf(
-                        (row - col) / (extreme_right - col), Constants.POWER
-                        )
-            elif row < col:
-                prob = stats.powerlaw.ppf( 
-                        (col - row) / (col - left), Constants.POWER
-                        )
-            elif row > col:
-                prob = stats.powerlaw.ppf( 
-                        (row - col) / (right - col), Constants.POWER
-                        )
-
-            return prob
-
     def handle_timers(self, index, old, new, timers, nuc_seq, map_seq, lim):
         '''
         handle_timers()
@@ -232,7 +238,7 @@ class Chromatin:
         '''
         # calculate t_next from an exponential distribution based on the 
         # rate of conversion
-        t_next = int(np.random.exponential(Constants.get_rate(old, new)))
+        t_next = int(self.np_rng.exponential(Constants.get_rate(old, new, self.timesteps_per_cellcycle)))
 
         if t_next > 0:
             # add new timer
@@ -298,12 +304,38 @@ class Chromatin:
         print_nucs()
         print out current state of all nucleosomes to a file
         '''
-        for n in self.nucleosomes:
-            fp.write(States.enum_to_string(n.state))
+        # the line is only rebuilt after a nucleosome changed state
+        if self.line is None:
+            self.line = Trajectory.TO_CHAR[self.states].tobytes().decode() + "\n"
 
-        fp.write("\n")
+        fp.write(self.line)
         
     ## Timestep simulation
+    def init_timesim(self, n_nucs):
+        '''
+        init_timesim()
+        initialize the number of events per timestep, timers and the
+        pool of nucleosomes that can have an event
+        '''
+        # calculate the number of events per timestep
+        self.EVENTS_PER_TIMESTEP = int(Constants.get_max_events(self.timesteps_per_cellcycle) * self.dat['n'])
+
+        # initialize data structures
+        self.timers = {}
+        self.map_to_seq = [ x for x in range(n_nucs) ]
+        self.nuc_index_seq = [ x for x in range(n_nucs) ]
+        self.lim = n_nucs
+
+        # fields of the whole string and expected events of every pool size
+        # for leaps, see propensities()
+        self.field_cache = None
+        self.pool_events = {}
+
+        # rate of moving towards M from every state, for recruitment
+        self.recruit_rates = np.zeros(shape=(len(States.get_enums())))
+        for state in (States.M_STATE, States.U_STATE, States.A_STATE):
+            self.recruit_rates[state] = Constants.get_rate(state, States.M_STATE, self.timesteps_per_cellcycle)
+
     def timesim(self, n_nucs, sim_num):
         '''
         timesim()
@@ -311,200 +343,666 @@ class Chromatin:
         using parallel event simulation
         '''
 
-        # calculate the number of events per timestep
-        EVENTS_PER_TIMESTEP = int(Constants.get_max_events() * self.dat['n'])
-        print("Events_per_timestep:", EVENTS_PER_TIMESTEP)
+        self.init_timesim(n_nucs)
+        print("Events_per_timestep:", self.EVENTS_PER_TIMESTEP)
+        if self.snapshot is not None:
+            self.warm_start(self.snapshot)
         TOT_TIMESTEPS = self.dat['t'] 
-        prob_event = EVENTS_PER_TIMESTEP / n_nucs
-    
-        # initialize data structures
-        timers = {}
-        map_to_seq = [ x for x in range(n_nucs) ]
-        nuc_index_seq = [ x for x in range(n_nucs) ]
-        lim = n_nucs
+
+        adaptive = self.dat['adv']['timestep'] == TimeStep.ADAPTIVE
+        num_leaps = 0
+        # timestep at which we next try to leap
+        next_leap_try = 0
+
+        # totals of M and A of every frame
+        self.trace_M = np.zeros(shape=(TOT_TIMESTEPS), dtype=np.int32)
+        self.trace_A = np.zeros(shape=(TOT_TIMESTEPS), dtype=np.int32)
+        self.num_frames = 0
+
+        # stopping rules
+        self.stop_rules = Stopping.StopRules(self.dat)
+        self.stop_time = None
+        self.stop_reason = None
 
         # open outfile
-        fp = open(self.dat['o'] + "_" + str(sim_num) + ".txt", "w")
+        self.writer = Trajectory.open_writer(self.dat, sim_num)
+        writer = self.writer
+
+        telemetry = Telemetry.get_telemetry(self.dat)
+        if telemetry is not None:
+            telemetry.start(sim_num, TOT_TIMESTEPS)
+
+        # live viewers read the traces straight from shared memory
+        live = LiveView.get_publisher(self.dat, TOT_TIMESTEPS)
+        if live is not None:
+            self.trace_M = live.segment.trace_M
+            self.trace_A = live.segment.trace_A
 
         # iterate over all timesteps
-        for t in range(TOT_TIMESTEPS):
-            # handle timers first
-            self.print_nucs(fp)
-
-            # initialize array to hold timer indicies to delete
-            delete_timers = []
-            # check each timer
-            for nuc_index in timers:
-                if timers[nuc_index]['timer'] == 0:
-                    # add back to pool & update
-                    lim = self.fake_readd(map_to_seq, nuc_index_seq, lim, nuc_index)
-
-                    old = timers[nuc_index]['old']
-                    new = timers[nuc_index]['new']
-                    
-                    self.update(old, new, nuc_index)
-                    delete_timers.append(nuc_index)
+        t = 0
+        while t < TOT_TIMESTEPS:
+            # only a comparison until the next check is due
+            if telemetry is not None and t >= telemetry.next_check:
+                telemetry.check(t, self)
+            if live is not None and t >= live.next_check:
+                live.publish(t, self)
+
+            if adaptive and t >= next_leap_try:
+                # try to cover several timesteps with a single leap
+                tau = self.choose_leap(t, TOT_TIMESTEPS)
+
+                if tau >= 2:
+                    t = self.leap(t, tau, writer)
+                    num_leaps += 1
+                    if self.stop_time is not None:
+                        break
+                    continue
+
+                # a division or recruitment needs an ordinary step, then
+                # leap again right after it; otherwise leaping does not pay
+                # off right now, so take some ordinary steps before trying again
+                if self.is_division(t) or self.is_recruitment(t):
+                    next_leap_try = t + 1
                 else:
-                    # decrement timer's count
-                    timers[nuc_index]['timer'] -= 1
+                    next_leap_try = t + LEAP_RETRY
 
-            # remove all timers to be deleted
-            for timer in delete_timers:
-                del timers[timer]
+            if self.record_frame(t, writer):
+                break
+            self.step(t)
+            t += 1
 
-            # handle divisions
-            if self.dat['d'] != Divisions.NONE and t != 0:
-                div_rate = self.dat['data']['divisions']
+        if adaptive:
+            print("Leaps:", num_leaps)
 
-                # check if we are dividing now
-                if t % div_rate == 0:
-                    # decide a random number of nucleosomes to be replaced
-                    # centered around a poisson of half of available nucleosomes
-                    num_nucs_replaced = int(np.random.poisson(lim / 2))
+        if self.stop_time is not None:
+            self.finish_early(TOT_TIMESTEPS, sim_num, writer)
 
-                    # check if we exceeded the limit
-                    # unlikely but may happen bc poisson unbounded
-                    if num_nucs_replaced > lim:
-                        num_nucs_replaced = lim
+        writer.close()
 
-                    # randomly sample which indicies to replace
-                    nucs_replaced = random.sample(nuc_index_seq[:lim], num_nucs_replaced)
+        if live is not None:
+            # keep the traces when the segment goes away
+            self.trace_M = self.trace_M.copy()
+            self.trace_A = self.trace_A.copy()
+            live.finish(self.num_frames, self)
 
-                    # replace each of the chosen indicies with a U-state
-                    for nuc in nucs_replaced:
-                        old = self.nucleosomes[nuc].state
-                        self.update(old, States.U_STATE, nuc)
+        if telemetry is not None:
+            telemetry.finish(t, self)
 
-                    # skip everything else for this timestep--just go to next one
-                    continue
-    
-            # handle recruitment
-            if self.dat['r'] != Recruit.NONE and \
-                    t >= self.dat['data']['recruit_time_init'] and \
-                    t <= (self.dat['data']['recruit_time_init'] + 
-                            self.dat['data']['recruit_time']):
-
-                # get indicies where recruitment will happen
-                start_nuc = int(self.dat['n']/2 - self.dat['data']['recruit_n']/2)
-                end_nuc = start_nuc + self.dat['data']['recruit_n']
-
-                # iterate over these indicies and simulate recruitment
-                # by moving each nuc 1 step towards M
-                for i in range(start_nuc, end_nuc):
-                    nuc_seq_i = map_to_seq[i]
-                    if nuc_seq_i < lim:
-                        lim = self.handle_timers(i, self.nucleosomes[i].state, States.M_STATE, timers, nuc_index_seq, map_to_seq, lim)
+    def record_frame(self, t, writer):
+        '''
+        record_frame()
+        write out the state at the start of timestep t and check the stopping rules
+        returns True if the simulation should stop
+        '''
+        # conversions from here on are first visible in frame t + 1
+        self.TIME = t
+        writer.frame(t, self)
+
+        # keep the totals of every frame for ensemble statistics
+        self.trace_M[t] = self.totals[States.M_STATE]
+        self.trace_A[t] = self.totals[States.A_STATE]
+        self.num_frames = t + 1
+
+        if not self.stop_rules.rules:
+            return False
+
+        reason = self.stop_rules.check(self.totals, lambda: self.is_absorbing(t))
+        if reason is not None:
+            self.stop_time = t
+            self.stop_reason = reason
+            return True
+
+        return False
+
+    def is_absorbing(self, t):
+        '''
+        is_absorbing()
+        check if the current state can never change again after timestep t
+        '''
+        # pending conversions
+        if len(self.timers) > 0:
+            return False
+
+        # divisions only change M and A nucleosomes
+        has_M_or_A = self.totals[States.M_STATE] + self.totals[States.A_STATE] > 0
+        if self.dat['d'] != Divisions.NONE and has_M_or_A:
+            return False
+
+        # recruitment only changes non-M nucleosomes at the recruitment sites
+        if self.recruiter.may_change(t, self.states):
+            return False
+
+        # targeted spreading converts U and opposite nucleosomes of a domain;
+        # be conservative and only call it absorbing when every nucleosome agrees
+        if self.spreader is not None and has_M_or_A and \
+                max(self.totals.values()) < self.dat['n']:
+            return False
+
+        # random and feedback conversions
+        to_U, to_A, to_M = self.propensities()
+        return not (np.any(to_U) or np.any(to_A) or np.any(to_M))
+
+    def finish_early(self, tot_timesteps, sim_num, writer):
+        '''
+        finish_early()
+        handle a simulation stopped by a stopping rule.
+        if the state is absorbing, the remaining output is the same frame
+        over and over, so we write it without simulating. A plateau carries
+        the last frame forward the same way, so ensemble statistics of later
+        timesteps keep every replica.
+        the stopping time and reason are written next to the outfile
+        '''
+        filled = self.stop_reason == Stop.enum_to_string(Stop.PLATEAU) or self.is_absorbing(self.stop_time)
+
+        if filled:
+            for t in range(self.stop_time + 1, tot_timesteps):
+                writer.frame(t, self)
+
+            self.trace_M[self.num_frames:] = self.totals[States.M_STATE]
+            self.trace_A[self.num_frames:] = self.totals[States.A_STATE]
+            self.num_frames = tot_timesteps
+
+        print("Stopped at timestep:", self.stop_time, "reason:", self.stop_reason, "filled:", filled)
+
+        with open(self.dat['o'] + "_" + str(sim_num) + ".stop.txt", "w") as stop_fp:
+            stop_fp.write("Timestep\tReason\tFilled\n")
+            stop_fp.write(str(self.stop_time) + "\t" + self.stop_reason + "\t" + str(int(filled)) + "\n")
+
+    def step(self, t):
+        '''
+        step()
+        simulate a single timestep
+        '''
+        # handle timers first
+        self.step_timers()
+
+        # handle divisions
+        # skip everything else for this timestep--just go to next one
+        if self.step_division(t):
+            return
+
+        # handle recruitment
+        self.step_recruitment(t)
+
+        # handle random and feedback events
+        self.step_events()
+
+    def step_timers(self):
+        '''
+        step_timers()
+        count down timers and update nucleosomes whose timer ran out
+        '''
+        # initialize array to hold timer indicies to delete
+        delete_timers = []
+        # check each timer
+        for nuc_index in self.timers:
+            if self.timers[nuc_index]['timer'] == 0:
+                # add back to pool & update
+                self.lim = self.fake_readd(self.map_to_seq, self.nuc_index_seq, self.lim, nuc_index)
+
+                old = self.timers[nuc_index]['old']
+                new = self.timers[nuc_index]['new']
                 
-            # choose number of events to happen in this timeslice
-            num_events = int(np.random.poisson(EVENTS_PER_TIMESTEP * (lim / n_nucs)))
-
-            # handle if poisson overshoots limit
-            if num_events >= lim:
-                num_events = lim 
-
-            # select indicies to have an event
-            nucs_w_event = random.sample(nuc_index_seq[:lim], num_events)
-
-            # calculate alpha: probability of random events
-            a = 1/(self.dat['f'] + 1)
-            
-            # choose number of random events
-            num_rand_events = np.random.poisson(EVENTS_PER_TIMESTEP * (lim / n_nucs) * a)
-
-            # handle if poisson overshoots 
-            if num_rand_events > len(nucs_w_event):
-                num_rand_events = len(nucs_w_event)
-
-            # choose indicies to have a random event
-            nucs_w_rand_event = random.sample(nucs_w_event, num_rand_events)
-            # remainder of nucs with event which were not chosen for random
-            # will have a feedback event
-            nucs_w_feedback_event = list( set(nucs_w_event) - set(nucs_w_rand_event) )
-
-            # handle all random events
-            for nuc in nucs_w_rand_event:
-                # get old state
-                old = self.nucleosomes[nuc].state
-
-                # if old == U-state, then we have equal chance of getting M or A, given that we
-                # have a CR floating around which allows that conversion
-                if old == States.U_STATE:
-                    if random.random() < 2/3:
-                        if random.random() < 0.5:
-                            lim = self.handle_timers(nuc, old, States.A_STATE, timers, nuc_index_seq, map_to_seq, lim)
-                        else:
-                            lim = self.handle_timers(nuc, old, States.M_STATE, timers, nuc_index_seq, map_to_seq, lim)
-                elif random.random() < 1/3:
-                    lim = self.handle_timers(nuc, old, States.U_STATE, timers, nuc_index_seq, map_to_seq, lim)
-            
-            ## VERY IMPORTANT that M_mat and A_mat are np ARRAYS, not matricies! WE DO NOT WANT DOT PRODUCT
-
-            # handle feedback events
-            # calculate probability matricies for feedback events for M and A
-            prob_conv_M = self.prob_mat[nucs_w_feedback_event,:] * self.M_mat
-            prob_conv_A = self.prob_mat[nucs_w_feedback_event,:] * self.A_mat
-
-            # get the total probability
-            tot_prob_per_nuc_M = np.sum(prob_conv_M, axis = 1) / self.dat['n'] 
-            tot_prob_per_nuc_A = np.sum(prob_conv_A, axis = 1) / self.dat['n']
-
-            # iterate over all nucs with feedback events
-            for nuc in range(len(nucs_w_feedback_event)):
-                # get current state
-                curr_state = self.nucleosomes[nucs_w_feedback_event[nuc]].state
-
-                if curr_state == States.M_STATE:
-                    # if current state is M, we can only move towards A
-                    # check probability of moving to A
-                    if random.random() < tot_prob_per_nuc_A[nuc] :
-                        lim = self.handle_timers(nucs_w_feedback_event[nuc], curr_state, States.U_STATE, timers, nuc_index_seq, map_to_seq, lim)
-                elif curr_state == States.A_STATE:
-                    # if current state is A, we can only move towards M
-                    # check probability of moving towards M
-                    if random.random() < tot_prob_per_nuc_M[nuc] :
-                        lim = self.handle_timers(nucs_w_feedback_event[nuc], curr_state, States.U_STATE, timers, nuc_index_seq, map_to_seq, lim)
-                else: # U state
-                    # if we're in U state, we can move towards M or A
-                    if tot_prob_per_nuc_A[nuc] != 0 and \
-                            tot_prob_per_nuc_M[nuc] != 0:
-
-                        # get the probabilities of going to A or M
-                        A_prob = tot_prob_per_nuc_A[nuc]
-                        M_prob = tot_prob_per_nuc_M[nuc]
-                        
-                        added_prob = A_prob + M_prob
-
-                        if added_prob > 1:
-                            # normalize to 1
-                            scaling = 1 / added_prob 
-                            A_prob *= scaling
-                            M_prob *= scaling
-
-                        # use cumulative sum trick to pick whether we go to M or A or do nothing
-                        cumsum = np.cumsum([1 - A_prob - M_prob, A_prob, M_prob])
-                        int_sums = cumsum < random.random()
-                        index = np.sum(int_sums.astype(int))
-
-                        if index == 1:
-                            lim = self.handle_timers(nucs_w_feedback_event[nuc], curr_state, States.A_STATE, timers, nuc_index_seq, map_to_seq, lim)
-                        elif index == 2:
-                            lim = self.handle_timers(nucs_w_feedback_event[nuc], curr_state, States.M_STATE, timers, nuc_index_seq, map_to_seq, lim)
-                        # else nothing
-
-        fp.close()
-    ##
+                self.update(old, new, nuc_index)
+                delete_timers.append(nuc_index)
+            else:
+                # decrement timer's count
+                self.timers[nuc_index]['timer'] -= 1
+
+        # remove all timers to be deleted
+        for timer in delete_timers:
+            del self.timers[timer]
+
+    def is_division(self, t):
+        '''
+        is_division()
+        check if we divide at timestep t
+        '''
+        return self.divider.is_due(t)
+
+    def is_recruitment(self, t):
+        '''
+        is_recruitment()
+        check if timestep t is in the recruitment window
+        '''
+        return self.recruiter.is_active(t)
+
+    def step_division(self, t):
+        '''
+        step_division()
+        replace nucleosomes with U-state nucleosomes if we divide at timestep t
+        returns True if we divided
+        '''
+        # check if we are dividing now
+        if not self.is_division(t):
+            return False
+
+        # replace nucleosomes without pending conversions with U, in one pass
+        self.sync(t, Phase.DIVISION)
+        self.divider.apply(t, self, self.pool_mask())
+
+        return True
+
+    def pool_mask(self):
+        '''
+        pool_mask()
+        mask of the nucleosomes without a pending conversion, None if that is all of them
+        '''
+        if len(self.timers) == 0:
+            return None
+
+        pool = np.ones(shape=(self.dat['n']), dtype=bool)
+        pool[list(self.timers)] = False
+        return pool
+
+    def save_state(self):
+        '''
+        save_state()
+        copy of the state of all nucleosomes and pending conversions
+        '''
+        timers = { i:dict(timer) for i, timer in self.timers.items() }
+        return self.states.copy(), timers
+
+    def load_state(self, states, timers):
+        '''
+        load_state()
+        set all nucleosomes and pending conversions to a saved state
+        '''
+        differ = np.flatnonzero(self.states != states)
+        for state in (States.M_STATE, States.U_STATE, States.A_STATE):
+            self.update_many(self.TIME, differ[states[differ] == state], state)
+
+        # nucleosomes with a pending conversion are out of the pool
+        self.timers = { i:dict(timer) for i, timer in timers.items() }
+        self.map_to_seq = [ x for x in range(self.dat['n']) ]
+        self.nuc_index_seq = [ x for x in range(self.dat['n']) ]
+        self.lim = self.dat['n']
+        for i in self.timers:
+            self.lim = self.fake_del(self.map_to_seq, self.nuc_index_seq, self.lim, i)
+
+    def warm_start(self, snapshot):
+        '''
+        warm_start()
+        start from the end of a burn-in. With --crn the common streams
+        continue after the burn-in; otherwise the simulation continues with
+        streams of its own stream number and sim number
+        '''
+        self.load_state(snapshot.states, snapshot.timers)
+
+        if self.crn is not None:
+            # common streams continue at the timesteps after the burn-in
+            self.crn.offset = snapshot.burn_in
+        else:
+            # reseeded in place, the nucleosomes share the generators
+            rng, np_rng = Constants.make_rngs(self.dat['data']['seed'], self.dat['data']['stream'], self.sim_num, WARM_STREAMS)
+            self.rng.setstate(rng.getstate())
+            self.np_rng.bit_generator.state = np_rng.bit_generator.state
+
+    def fork_division(self):
+        '''
+        fork_division()
+        divide into two daughters that both continue, instead of following
+        one of them as step_division() does. The old nucleosomes are split
+        between the daughters: nucleosomes replaced with U in one daughter
+        are kept in the other. Returns the saved state of both daughters
+        '''
+        self.step_timers()
+
+        # same replaced nucleosomes as step_division()
+        in_pool = self.pool_mask()
+        if in_pool is None:
+            in_pool = np.ones(shape=(self.dat['n']), dtype=bool)
+        replaced = np.zeros(shape=(self.dat['n']), dtype=bool)
+        self.sync(self.TIME, Phase.DIVISION)
+        replaced[self.divider.select(self.np_rng, in_pool)] = True
+
+        states, timers = self.save_state()
+        daughters = []
+        for sel in (replaced, in_pool & ~replaced):
+            daughter = states.copy()
+            daughter[sel] = States.U_STATE
+            daughters.append((daughter, timers))
+
+        return daughters
+
+    def step_recruitment(self, t):
+        '''
+        step_recruitment()
+        recruit CR to the recruitment sites whose window includes t
+        '''
+        if self.is_recruitment(t):
+            self.sync(t, Phase.RECRUIT)
+            self.recruiter.apply(t, self, self.pool_mask())
+
+    def recruit(self, t, sites):
+        '''
+        recruit()
+        move every site towards M: conversions due this timestep happen
+        at once, the others get timers as in handle_timers()
+        '''
+        old = self.states[sites]
+        t_next = self.np_rng.exponential(self.recruit_rates[old]).astype(np.intp)
+
+        self.update_many(t, sites[t_next == 0], States.M_STATE)
 
-    def divide(self):
+        for i in np.flatnonzero(t_next > 0):
+            nuc = int(sites[i])
+            self.timers[nuc] = { 'timer':int(t_next[i]), 'old':int(old[i]), 'new':States.M_STATE }
+            self.lim = self.fake_del(self.map_to_seq, self.nuc_index_seq, self.lim, nuc)
+
+    def step_events(self):
         '''
-        divide()
-        handle divisions for each nucleosome
+        step_events()
+        choose nucleosomes to have an event this timestep and
+        handle random and feedback events
         '''
-        for i in range(self.dat['n']):
-            if random.random() <= 0.5:
-                prev = self.nucleosomes[i].state
-                self.nucleosomes[i].state = States.U_STATE
-                self.update(prev, States.U_STATE)
-                self.colors[i] = Constants.state_to_color(States.U_STATE)
+        n_nucs = self.dat['n']
+        EVENTS_PER_TIMESTEP = self.EVENTS_PER_TIMESTEP
+        timers = self.timers
+        map_to_seq = self.map_to_seq
+        nuc_index_seq = self.nuc_index_seq
+        lim = self.lim
+
+        # choose number of events to happen in this timeslice
+        self.sync(self.TIME, Phase.EVENTS)
+        num_events = int(self.np_rng.poisson(EVENTS_PER_TIMESTEP * (lim / n_nucs)))
+
+        # handle if poisson overshoots limit
+        if num_events >= lim:
+            num_events = lim 
+
+        # select indicies to have an event
+        nucs_w_event = self.rng.sample(nuc_index_seq[:lim], num_events)
+
+        # calculate alpha: probability of random events
+        a = 1/(self.dat['f'] + 1)
+        
+        # choose number of random events
+        self.sync(self.TIME, Phase.RANDOM)
+        num_rand_events = self.np_rng.poisson(EVENTS_PER_TIMESTEP * (lim / n_nucs) * a)
+
+        # handle if poisson overshoots 
+        if num_rand_events > len(nucs_w_event):
+            num_rand_events = len(nucs_w_event)
+
+        # choose indicies to have a random event
+        nucs_w_rand_event = self.rng.sample(nucs_w_event, num_rand_events)
+        # remainder of nucs with event which were not chosen for random
+        # will have a feedback event
+        nucs_w_feedback_event = list( set(nucs_w_event) - set(nucs_w_rand_event) )
+
+        # handle all random events
+        self.sync(self.TIME, Phase.CONVERT)
+        for nuc in nucs_w_rand_event:
+            # get old state
+            old = self.states.item(nuc)
+
+            # if old == U-state, then we have equal chance of getting M or A, given that we
+            # have a CR floating around which allows that conversion
+            if old == States.U_STATE:
+                if self.rng.random() < 2/3:
+                    if self.rng.random() < 0.5:
+                        lim = self.handle_timers(nuc, old, States.A_STATE, timers, nuc_index_seq, map_to_seq, lim)
+                    else:
+                        lim = self.handle_timers(nuc, old, States.M_STATE, timers, nuc_index_seq, map_to_seq, lim)
+            elif self.rng.random() < 1/3:
+                lim = self.handle_timers(nuc, old, States.U_STATE, timers, nuc_index_seq, map_to_seq, lim)
+        
+        # targeted spreading replaces the feedback fields
+        self.sync(self.TIME, Phase.FEEDBACK)
+        if self.spreader is not None:
+            self.lim = self.step_targeted(nucs_w_feedback_event, timers, nuc_index_seq, map_to_seq, lim)
+            return
+
+        # handle feedback events
+        # get the total probability of conversion for M and A
+        # each nucleosome only sums over its own domain and bleed neighbours
+        tot_prob_per_nuc_M = self.kernel.field(nucs_w_feedback_event, self.M_mat) / self.dat['n']
+        tot_prob_per_nuc_A = self.kernel.field(nucs_w_feedback_event, self.A_mat) / self.dat['n']
+
+        # iterate over all nucs with feedback events
+        for nuc in range(len(nucs_w_feedback_event)):
+            # get current state
+            curr_state = self.states.item(nucs_w_feedback_event[nuc])
+
+            if curr_state == States.M_STATE:
+                # if current state is M, we can only move towards A
+                # check probability of moving to A
+                if self.rng.random() < tot_prob_per_nuc_A[nuc] :
+                    lim = self.handle_timers(nucs_w_feedback_event[nuc], curr_state, States.U_STATE, timers, nuc_index_seq, map_to_seq, lim)
+            elif curr_state == States.A_STATE:
+                # if current state is A, we can only move towards M
+                # check probability of moving towards M
+                if self.rng.random() < tot_prob_per_nuc_M[nuc] :
+                    lim = self.handle_timers(nucs_w_feedback_event[nuc], curr_state, States.U_STATE, timers, nuc_index_seq, map_to_seq, lim)
+            else: # U state
+                # if we're in U state, we can move towards M or A
+                if tot_prob_per_nuc_A[nuc] != 0 and \
+                        tot_prob_per_nuc_M[nuc] != 0:
+
+                    # get the probabilities of going to A or M
+                    A_prob = tot_prob_per_nuc_A[nuc]
+                    M_prob = tot_prob_per_nuc_M[nuc]
+                    
+                    added_prob = A_prob + M_prob
+
+                    if added_prob > 1:
+                        # normalize to 1
+                        scaling = 1 / added_prob 
+                        A_prob *= scaling
+                        M_prob *= scaling
+
+                    # use cumulative sum trick to pick whether we go to M or A or do nothing
+                    cumsum = np.cumsum([1 - A_prob - M_prob, A_prob, M_prob])
+                    int_sums = cumsum < self.rng.random()
+                    index = np.sum(int_sums.astype(int))
+
+                    if index == 1:
+                        lim = self.handle_timers(nucs_w_feedback_event[nuc], curr_state, States.A_STATE, timers, nuc_index_seq, map_to_seq, lim)
+                    elif index == 2:
+                        lim = self.handle_timers(nucs_w_feedback_event[nuc], curr_state, States.M_STATE, timers, nuc_index_seq, map_to_seq, lim)
+                    # else nothing
+
+        self.lim = lim
+
+    def step_targeted(self, nucs_w_feedback_event, timers, nuc_index_seq, map_to_seq, lim):
+        '''
+        step_targeted()
+        targeted spreading: every M or A nucleosome with a feedback event picks a
+        partner at a power law distance in its domain and converts it one step
+        towards its own state (A or M to U, U to the state of the source)
+        '''
+        sources = np.asarray(nucs_w_feedback_event, dtype=np.intp)
+        sources = sources[(self.states[sources] == States.M_STATE) | (self.states[sources] == States.A_STATE)]
+        partners = self.spreader.draw(sources, self.np_rng)
+
+        for nuc, partner in zip(sources.tolist(), partners.tolist()):
+            # no partner, or the partner is already converting
+            if partner < 0 or partner in timers:
+                continue
+
+            # states as of now: earlier events of this timestep count
+            source_state = self.states.item(nuc)
+            old = self.states.item(partner)
+            if source_state == States.U_STATE or old == source_state:
+                continue
+
+            if old == States.U_STATE:
+                lim = self.handle_timers(partner, old, source_state, timers, nuc_index_seq, map_to_seq, lim)
+            else:
+                lim = self.handle_timers(partner, old, States.U_STATE, timers, nuc_index_seq, map_to_seq, lim)
+
+        return lim
+
+    ## Adaptive timestep (tau-leaping)
+    def propensities(self):
+        '''
+        propensities()
+        per timestep probability of every possible conversion of every nucleosome,
+        under the same rules as step_events()
+        returns (to_U, to_A, to_M) arrays
+        '''
+        n_nucs = self.dat['n']
+        lim = self.lim
+
+        # chance that a nucleosome has a random event and a feedback event,
+        # which only depends on the size of the pool
+        if lim not in self.pool_events:
+            self.pool_events[lim] = expected_events(
+                    self.EVENTS_PER_TIMESTEP * (lim / n_nucs), 1/(self.dat['f'] + 1), lim
+                    )
+        rand_events, feedback_events = self.pool_events[lim]
+        q_rand = rand_events / max(lim, 1)
+        q_feedback = feedback_events / max(lim, 1)
+
+        is_M = self.M_mat == 1
+        is_A = self.A_mat == 1
+        is_U = ~(is_M | is_A)
+
+        # feedback fields over the whole string
+        field_M, field_A = self.leap_fields()
+        field_M = field_M / n_nucs
+        field_A = field_A / n_nucs
+
+        # M and A only move to U
+        to_U = np.where(is_M, q_rand/3 + q_feedback * np.minimum(field_A, 1), 0)
+        to_U = np.where(is_A, q_rand/3 + q_feedback * np.minimum(field_M, 1), to_U)
+
+        # U moves to A or M, feedback only if both fields are nonzero
+        both = (field_A != 0) & (field_M != 0)
+        scaling = 1 / np.maximum(field_A + field_M, 1)
+        to_A = np.where(is_U, q_rand/3 + q_feedback * np.where(both, field_A * scaling, 0), 0)
+        to_M = np.where(is_U, q_rand/3 + q_feedback * np.where(both, field_M * scaling, 0), 0)
+
+        return to_U, to_A, to_M
+
+    def leap_fields(self):
+        '''
+        leap_fields()
+        feedback fields of M and A of every nucleosome. Updated from the
+        last call with the kernel columns of the nucleosomes that changed
+        since, instead of a field of the whole string every time
+        '''
+        n_nucs = self.dat['n']
+
+        if self.field_cache is not None:
+            last_M, last_A, field_M, field_A, updates = self.field_cache
+            changed_M = np.flatnonzero(self.M_mat != last_M)
+            changed_A = np.flatnonzero(self.A_mat != last_A)
+
+            if updates < FIELD_REFRESH and (len(changed_M) + len(changed_A)) * FIELD_CHANGED_SHARE <= n_nucs:
+                delta_M = self.M_mat[changed_M].astype(float) - last_M[changed_M]
+                delta_A = self.A_mat[changed_A].astype(float) - last_A[changed_A]
+                field_M = field_M + self.kernel.column_field(changed_M, delta_M)
+                field_A = field_A + self.kernel.column_field(changed_A, delta_A)
+                self.field_cache = (self.M_mat.copy(), self.A_mat.copy(), field_M, field_A, updates + 1)
+                return field_M, field_A
+
+        rows = np.arange(n_nucs)
+        field_M = self.kernel.field(rows, self.M_mat)
+        field_A = self.kernel.field(rows, self.A_mat)
+        self.field_cache = (self.M_mat.copy(), self.A_mat.copy(), field_M, field_A, 0)
+        return field_M, field_A
+
+    def choose_leap(self, t, tot_timesteps):
+        '''
+        choose_leap()
+        choose how many timesteps to cover with one leap from timestep t,
+        such that the expected relative change in M, U and A totals stays
+        within the user tolerance tau_eps
+        leaps end at the next division or recruitment; pending timers run out
+        during the leap as in step()
+        '''
+        # divisions and recruitment take ordinary steps
+        if self.is_division(t) or self.is_recruitment(t):
+            return 0
+
+        bound = tot_timesteps - t
+
+        next_division = self.divider.next_due(t)
+        if next_division is not None:
+            bound = min(bound, next_division - t)
+
+        next_recruitment = self.recruiter.next_start(t)
+        if next_recruitment is not None:
+            bound = min(bound, next_recruitment - t)
+
+        to_U, to_A, to_M = self.propensities()
+        # nucleosomes with a timer are out of the pool until it runs out
+        if len(self.timers) > 0:
+            timed = np.fromiter(self.timers, dtype=np.intp, count=len(self.timers))
+            to_U[timed] = 0
+            to_A[timed] = 0
+            to_M[timed] = 0
+        self.leap_rates = (to_U, to_A, to_M)
+
+        # summed rates of every reaction
+        R_MU = np.sum(to_U * self.M_mat)
+        R_AU = np.sum(to_U * self.A_mat)
+        R_UA = np.sum(to_A)
+        R_UM = np.sum(to_M)
+
+        # mean and variance of the change of each total per timestep
+        changes = (
+                (self.totals[States.M_STATE], R_UM - R_MU, R_UM + R_MU),
+                (self.totals[States.A_STATE], R_UA - R_AU, R_UA + R_AU),
+                (self.totals[States.U_STATE], R_MU + R_AU - R_UA - R_UM, R_MU + R_AU + R_UA + R_UM)
+                )
+
+        tau = bound
+        for total, mean, var in changes:
+            allowed = max(self.dat['data']['tau_eps'] * total, 1)
+            if mean != 0:
+                tau = min(tau, allowed / abs(mean))
+            if var != 0:
+                tau = min(tau, allowed ** 2 / var)
+
+        return int(tau)
+
+    def leap(self, t, tau, writer):
+        '''
+        leap()
+        simulate tau timesteps at once with the rates from choose_leap()
+        every nucleosome converts at most once, at a random timestep within
+        the leap, so output is still written for every timestep; timers
+        count down and convert as in step()
+        returns the timestep after the leap, or the stopping time
+        '''
+        to_U, to_A, to_M = self.leap_rates
+        total = to_U + to_A + to_M
+
+        # chance of converting at least once in tau timesteps
+        prob = 1 - (1 - total) ** tau
+        self.sync(t, Phase.LEAP)
+        nucs = np.flatnonzero(self.np_rng.random(len(total)) < prob)
+
+        # pick where each nucleosome goes, and when
+        pick = self.np_rng.random(len(nucs)) * total[nucs]
+        when = self.np_rng.integers(0, tau, size=len(nucs))
+        order = np.argsort(when, kind='stable')
+
+        k = 0
+        for s in range(tau):
+            if self.record_frame(t + s, writer):
+                return t + s
+            self.step_timers()
+
+            while k < len(order) and when[order[k]] == s:
+                nuc = nucs[order[k]]
+                old = self.states.item(nuc)
+
+                if old != States.U_STATE:
+                    new = States.U_STATE
+                elif pick[order[k]] < to_A[nuc]:
+                    new = States.A_STATE
+                else:
+                    new = States.M_STATE
+
+                self.update(old, new, nuc)
+                k += 1
+
+        return t + tau
+    ##
 
     def update(self, old, new, i):
         '''
@@ -517,9 +1015,11 @@ class Chromatin:
 
         self.totals[old] -= 1
         self.totals[new] += 1
-        self.colors[i] = Constants.state_to_color(new)
-    
-        self.nucleosomes[i].state = new
+        self.line = None
+        self.states[i] = new
+
+        if self.writer is not None and self.writer.wants_events:
+            self.writer.event(self.TIME + 1, i, new)
 
         if old == States.M_STATE:
             self.M_mat[i] = 0
@@ -531,3 +1031,26 @@ class Chromatin:
         elif new == States.A_STATE:
             self.A_mat[i] = 1
 
+    def update_many(self, t, indicies, new):
+        '''
+        update_many()
+        convert many nucleosomes to the same state at once
+        and update all datastructures in bulk
+        '''
+        indicies = np.asarray(indicies, dtype=np.intp)
+        indicies = indicies[self.states[indicies] != new]
+        if len(indicies) == 0:
+            return
+
+        counts = np.bincount(self.states[indicies], minlength=len(States.get_enums()))
+        for state in self.totals:
+            self.totals[state] -= int(counts[state])
+        self.totals[new] += len(indicies)
+
+        self.states[indicies] = new
+        self.M_mat[indicies] = new == States.M_STATE
+        self.A_mat[indicies] = new == States.A_STATE
+        self.line = None
+
+        if self.writer is not None and self.writer.wants_events:
+            self.writer.events(t + 1, indicies, new)
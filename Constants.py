@@ -5,11 +5,10 @@
 import math
 import random
 import numpy as np
-import scipy.stats as stats
-from MyEnum import States
+import Spreading
+from MyEnum import States, Divisions, Phase
 
 # Set constants
-TIMESTEPS_PER_CELLCYCLE = 0
 # rates -- be sure to change these
 # per nuc per cell cycle
 CR_U_to_A = 1
@@ -19,10 +18,15 @@ CR_M_to_U = 1
 
 POWER = 2 # arbitrary number
 
-# set random seeds for reproducibility
+# fraction of M nucleosomes above which a gene is off, as in process_sims.pl
+PERCENT_M_THRESH = 0.7
+
+# default master seed for reproducibility
+# every simulation draws from its own streams, see make_rngs()
 SEED = 1
-random.seed(SEED)
-np.random.seed(SEED)
+
+# first coordinate of common random numbers (--crn), see CommonStreams
+CRN_STREAM = 2 ** 32
 
 # set colors
 GRAY = (0.662745,0.662745,0.662745)
@@ -30,16 +34,27 @@ RED = (0.545098,0,0)
 BLUE = (0,0,0.545098)
 
 # begin functions
-def get_max_events():
+def get_timesteps_per_cellcycle(inputs):
+    '''
+    get_timesteps_per_cellcycle(inputs)
+    a cell cycle is the time between divisions, or the whole simulation
+    if there are no divisions
+    '''
+    if inputs['d'] != Divisions.NONE:
+        return inputs['data']['divisions']
+    else:
+        return inputs['t']
+
+def get_max_events(timesteps_per_cellcycle):
     '''
-    get_max_events()
+    get_max_events(timesteps_per_cellcycle)
     check which rate yields the maximum number of events
     return that number
     '''
-    return max(CR_U_to_A, CR_A_to_U, CR_U_to_M, CR_M_to_U) / TIMESTEPS_PER_CELLCYCLE
+    return max(CR_U_to_A, CR_A_to_U, CR_U_to_M, CR_M_to_U) / timesteps_per_cellcycle
 
 
-def get_rate(old, new):
+def get_rate(old, new, timesteps_per_cellcycle):
     ''' 
     given an old and new nucleosome state, return the rate of 
     conversion from old to new
@@ -54,45 +69,114 @@ def get_rate(old, new):
         return 0
     else:
         if old == States.M_STATE:
-            return 1 / CR_M_to_U * TIMESTEPS_PER_CELLCYCLE
+            return 1 / CR_M_to_U * timesteps_per_cellcycle
 
         elif old == States.A_STATE:
-            return 1 / CR_A_to_U * TIMESTEPS_PER_CELLCYCLE
+            return 1 / CR_A_to_U * timesteps_per_cellcycle
 
         elif old == States.U_STATE:
             if new == States.M_STATE:
-                return 1 / CR_U_to_M * TIMESTEPS_PER_CELLCYCLE
+                return 1 / CR_U_to_M * timesteps_per_cellcycle
 
             if new == States.A_STATE:
-                return 1 / CR_U_to_A * TIMESTEPS_PER_CELLCYCLE
+                return 1 / CR_U_to_A * timesteps_per_cellcycle
 
-def truncated_power_law(power, limit_neg, limit_pos):
+def make_rngs(seed, *coords):
     '''
-    truncated_power_law(power_constant, negative_limit, positive_limit)
-    use to calculate random probability based on a double truncated power law
-    not currently used
+    make_rngs(master_seed, coordinates...)
+    random number generators of one simulation, replica or lineage branch
+    the streams only depend on the master seed and the coordinates
+    (e.g. parameter point, sim number, cell), so a replica gets the same
+    numbers whatever ran before it, in whichever process
+    returns a python random.Random for single numbers and a numpy
+    Generator for arrays
     '''
-    # pick a random number
-    prob_direction = random.random()
+    # coordinates are a spawn key, like the children of SeedSequence.spawn()
+    seq = np.random.SeedSequence(seed, spawn_key=tuple(int(x) for x in coords))
+    py_seq, np_seq = seq.spawn(2)
 
-    # get the probability of going negative
-    neg_prob = limit_neg / (limit_neg + limit_pos)
+    rng = random.Random(int.from_bytes(py_seq.generate_state(4).tobytes(), "little"))
+    np_rng = np.random.Generator(np.random.PCG64(np_seq))
 
-    if prob_direction < neg_prob:
-        # negative direction
-        # limit_neg must be a positive number of nucs in neg direction
-        x = np.arange(1, limit_neg+1, dtype='float')
-        pmf = 1/x**power
-        pmf /= pmf.sum()
-        dist = stats.rv_discrete(values=(range(1, limit_neg+1), pmf))
-        return 0 - dist.rvs(size=1)
-    else:
-        # positive direction
-        x = np.arange(1, limit_pos+1, dtype='float')
-        pmf = 1/x**power
-        pmf /= pmf.sum()
-        dist = stats.rv_discrete(values=(range(1, limit_pos+1), pmf))
-        return dist.rvs(size=1)
+    return rng, np_rng
+
+class CommonStreams:
+    '''
+    CommonStreams class
+    common random numbers: the generators of a replica are reset at every
+    timestep and phase to a position that only depends on the master seed,
+    the coordinates (sim number, ...), the timestep and the phase, never on
+    the parameter point or on how many numbers earlier phases used.
+    replica i of neighbouring parameter points then draws the same event
+    selections and uniforms, and their difference has far less variance.
+    a reset costs a few microseconds, most of it seeding the python generator
+    '''
+
+    def __init__(self, seed, *coords):
+        '''
+        initialization function
+        '''
+        # CRN_STREAM keeps the coordinates apart from those of make_rngs()
+        seq = np.random.SeedSequence(seed, spawn_key=(CRN_STREAM,) + tuple(int(x) for x in coords))
+        py_seq, np_seq = seq.spawn(2)
+
+        self.py_key = int.from_bytes(py_seq.generate_state(2).tobytes(), "little") << 64
+        self.bit_generator = np.random.Philox(key=np_seq.generate_state(2, np.uint64))
+        self.state = self.bit_generator.state
+        self.num_phases = len(Phase.get_enums())
+        # timesteps before timestep 0, e.g. the burn-in of a warm start
+        self.offset = 0
+
+        # the initial states are drawn before the first timestep
+        self.rng = random.Random(self.py_key)
+        self.np_rng = np.random.Generator(self.bit_generator)
+
+    def sync(self, t, phase):
+        '''
+        sync(timestep, phase)
+        move both generators to the numbers of phase (a MyEnum Phase) of timestep t
+        '''
+        t += self.offset
+        # the counter counts blocks of 4 numbers from (0, 1, phase, t);
+        # the initial states use the blocks from (0, 0, 0, 0)
+        self.state['state']['counter'][:] = (0, 1, phase, t)
+        self.state['buffer_pos'] = 4
+        self.state['has_uint32'] = 0
+        self.bit_generator.state = self.state
+
+        self.rng.seed(self.py_key + 1 + t * self.num_phases + phase)
+
+def make_streams(data, *coords):
+    '''
+    make_streams(input_data, coordinates...)
+    random number generators of a simulation: make_rngs() of the stream number
+    and the coordinates or, with --crn, common streams of the coordinates alone,
+    which are the same at every parameter point
+    returns (CommonStreams or None, random.Random, numpy Generator)
+    '''
+    if data['crn']:
+        common = CommonStreams(data['seed'], *coords)
+        return common, common.rng, common.np_rng
+
+    rng, np_rng = make_rngs(data['seed'], data['stream'], *coords)
+    return None, rng, np_rng
+
+def powerlaw_ppf(q, power):
+    '''
+    powerlaw_ppf(quantile, power_constant)
+    percent point function of the power law distribution on [0, 1]
+    same as scipy.stats.powerlaw.ppf, without importing scipy
+    works on numbers and numpy arrays
+    '''
+    return q ** (1 / power)
+
+def truncated_power_law(power, limit_neg, limit_pos, np_rng):
+    '''
+    truncated_power_law(power_constant, negative_limit, positive_limit, generator)
+    use to calculate random probability based on a double truncated power law
+    returns a signed offset; draws from cached alias tables, see Spreading.py
+    '''
+    return int(Spreading.truncated_offsets([limit_neg], [limit_pos], power, np_rng)[0])
 
 def state_to_color(state):
     '''
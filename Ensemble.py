@@ -0,0 +1,221 @@
+## Ensemble.py
+## Author: Aparna Rajpurkar
+
+# run ensembles of replica simulations
+# replicas are run in batches until the per timestep statistics are known
+# to the requested precision or the replica budget is used up
+
+# imports
+import time
+import numpy as np
+import Constants
+import Simulation
+import Telemetry
+from MyEnum import Replicas
+
+# z value of the confidence intervals
+CI_Z = 1.96
+
+def replica_stats(trace_M, trace_A, n, tot_timesteps):
+    '''
+    replica_stats(M_totals, A_totals, N_nucs, T_timesteps)
+    gap score and off (1 if the gene is off) of every timestep of a replica
+    same definitions as process_sims.pl
+    timesteps after an early stop that was not filled in (see
+    Chromatin.finish_early()) are NaN
+    '''
+    gap = np.full(tot_timesteps, np.nan)
+    off = np.full(tot_timesteps, np.nan)
+
+    m = trace_M.astype(float)
+    a = trace_A.astype(float)
+    frames = len(m)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        gap[:frames] = np.where(m + a > 0, (m - a) / (m + a), 0)
+    off[:frames] = m / n >= Constants.PERCENT_M_THRESH
+
+    return gap, off
+
+class RunningStats:
+    '''
+    RunningStats class
+    running mean and variance per timestep over any number of replicas
+    batches are merged with the parallel version of Welford's algorithm,
+    so partial results from anywhere can be combined
+    '''
+
+    def __init__(self, length):
+        '''
+        initialization function
+        '''
+        self.count = np.zeros(shape=(length))
+        self.mean = np.zeros(shape=(length))
+        self.M2 = np.zeros(shape=(length))
+
+    def add_batch(self, values):
+        '''
+        add_batch(replicas_by_timesteps_array)
+        add a batch of replicas. NaN values are skipped
+        '''
+        values = np.atleast_2d(values)
+        valid = ~np.isnan(values)
+
+        count = valid.sum(axis=0).astype(float)
+        total = np.where(valid, values, 0).sum(axis=0)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            mean = np.where(count > 0, total / count, 0)
+        M2 = np.where(valid, (values - mean) ** 2, 0).sum(axis=0)
+
+        self.merge(count, mean, M2)
+
+    def merge(self, count, mean, M2):
+        '''
+        merge(counts, means, M2s)
+        combine with the statistics of another set of replicas
+        '''
+        new_count = self.count + count
+        with np.errstate(divide='ignore', invalid='ignore'):
+            delta = mean - self.mean
+            self.mean = np.where(new_count > 0, self.mean + delta * count / new_count, 0)
+            self.M2 = np.where(new_count > 0, self.M2 + M2 + delta ** 2 * self.count * count / new_count, 0)
+        self.count = new_count
+
+    def sd(self):
+        '''
+        sd()
+        population standard deviation, same as process_sims.pl
+        '''
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return np.where(self.count > 0, np.sqrt(self.M2 / self.count), 0)
+
+    def ci(self):
+        '''
+        ci()
+        half width of the confidence interval of the mean
+        uses the sample standard deviation
+        '''
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return np.where(self.count > 1, CI_Z * np.sqrt(self.M2 / (self.count - 1) / self.count), np.inf)
+
+    def precision(self):
+        '''
+        precision()
+        widest confidence interval over all timesteps with at least 2 replicas
+        timesteps after every replica stopped early are left out
+        '''
+        ci = self.ci()[self.count > 1]
+        if len(ci) == 0:
+            return np.inf
+        return np.max(ci)
+
+class EnsembleResult:
+    '''
+    EnsembleResult class
+    per timestep ensemble statistics and the precision reached
+    '''
+
+    def __init__(self, inputs, gap, off, replicas):
+        '''
+        initialization function
+        '''
+        self.inputs = inputs
+        self.gap = gap
+        self.off = off
+        self.replicas = replicas
+
+        # worst confidence interval over all timesteps
+        self.gap_precision = gap.precision()
+        self.off_precision = off.precision()
+
+def run_batch(inputs, first_sim, count):
+    '''
+    run_batch(inputs, first_sim_num, number_of_replicas)
+    run replicas first_sim to first_sim + count - 1
+    returns their gap and off series as (replicas, timesteps) arrays
+    '''
+    tot_timesteps = inputs['t']
+    gaps = np.zeros(shape=(count, tot_timesteps))
+    offs = np.zeros(shape=(count, tot_timesteps))
+
+    telemetry = Telemetry.get_telemetry(inputs)
+
+    for b in range(count):
+        sim_num = first_sim + b
+        print("On sim", sim_num)
+        start = time.monotonic()
+        result = Simulation.run_simulation(inputs, sim_num)
+        gaps[b], offs[b] = replica_stats(result.trace_M, result.trace_A, inputs['n'], tot_timesteps)
+
+        if telemetry is not None:
+            telemetry.replica_done(time.monotonic() - start)
+
+    return gaps, offs
+
+def run_ensemble(inputs, first_sim=0):
+    '''
+    run_ensemble(inputs, first_sim_num)
+    run replicas in batches until the confidence intervals of the mean gap
+    score and percent off of every timestep are within the requested
+    precision, or until the maximum number of replicas has run.
+    with a fixed number of replicas, just run that many
+    '''
+    data = inputs['data']
+    tot_timesteps = inputs['t']
+
+    if inputs['adv']['replicas'] == Replicas.FIXED:
+        min_replicas = max_replicas = data['replicas']
+    else:
+        min_replicas = data['replicas_min']
+        max_replicas = data['replicas_max']
+
+    gap = RunningStats(tot_timesteps)
+    off = RunningStats(tot_timesteps)
+
+    telemetry = Telemetry.get_telemetry(inputs)
+    if telemetry is not None:
+        telemetry.start_ensemble(max_replicas)
+
+    replicas = 0
+    while replicas < max_replicas:
+        batch = min(data['replica_batch'], max_replicas - replicas)
+
+        gaps, offs = run_batch(inputs, first_sim + replicas, batch)
+
+        gap.add_batch(gaps)
+        off.add_batch(offs)
+        replicas += batch
+
+        if replicas < min_replicas:
+            continue
+
+        # check if we reached the requested precision
+        gap_ci = gap.precision()
+        off_ci = off.precision()
+        print("Replicas:", replicas, "precision: gap", gap_ci, "off", off_ci)
+
+        if inputs['adv']['replicas'] == Replicas.ADAPTIVE and \
+                gap_ci <= data['precision'] and off_ci <= data['precision']:
+            break
+
+    return EnsembleResult(inputs, gap, off, replicas)
+
+def write_summary(result, filename):
+    '''
+    write_summary(ensemble_result, filename)
+    write per timestep statistics in the format of process_sims.pl,
+    with the number of replicas and confidence intervals added
+    '''
+    inputs = result.inputs
+    gap_sd = result.gap.sd()
+    gap_ci = result.gap.ci()
+    off_ci = result.off.ci()
+
+    with open(filename, "w") as fp:
+        fp.write("RecruitTime\tFValue\tTimestep\tAvgGapScore\tSDGapScore\tPercOff\tN\tCIGapScore\tCIPercOff\n")
+        for t in range(inputs['t']):
+            fp.write("\t".join(str(x) for x in (
+                inputs['data']['recruit_time'], inputs['f'], t,
+                result.gap.mean[t], gap_sd[t], result.off.mean[t],
+                int(result.gap.count[t]), gap_ci[t], off_ci[t]
+                )) + "\n")
@@ -0,0 +1,377 @@
+## Equivalence.py
+## Author: Aparna Rajpurkar
+
+# statistical equivalence of simulation engines
+# every engine other than plain timesim (block kernel, float64, fixed
+# timesteps, one locus) draws different random numbers, so its trajectories
+# cannot be compared with the reference byte for byte. Instead both run
+# ensembles of replicas on a matrix of configurations (F values, division
+# intervals, with and without recruitment, string lengths) and we compare
+# the distributions of:
+#   final M and A fractions, time averaged gap score, first passage time to
+#       off (censored at the end): two-sample Kolmogorov-Smirnov tests
+#   switching rates out of off and on: two-sample test of poisson rates
+#   mean gap score of every timestep: largest difference against its
+#       confidence interval
+# equivalence is shown, not assumed (two one-sided tests): every metric has
+# confidence bounds of its difference at ALPHA (Bonferroni corrected over all
+# tests of the run). A metric is ok only if the upper bound is within its
+# tolerance, differs if the lower bound is beyond it, and is inconclusive
+# otherwise, with an estimate of the replicas that would settle it.
+# replica i of both engines runs with the same stream, so the bounds come
+# from a bootstrap over the pairs of replicas and the paired differences of
+# the gap scores: an engine with identical output has bounds of 0 and is ok.
+# MainEquivalence.py reference runs timesim against itself as a check of
+# the harness. The wall time of both ensembles gives the speedup of the engine
+
+# imports
+import copy
+import itertools
+import math
+import time
+import numpy as np
+import Analysis
+import Constants
+import Ensemble
+import Simulation
+from MyEnum import Divisions, Recruit, States
+
+# candidate engines: options added to the inputs of the reference
+ENGINES = {
+        # timesim itself: identical output, every metric must be ok
+        'reference' : {},
+        'adaptive' : { 'timestep':"adaptive" },
+        'rows' : { 'kernel':"rows" },
+        'float32' : { 'kernel_precision':"float32", 'accumulate':"float32" },
+        'uint16' : { 'kernel_precision':"uint16" },
+        # the batched multi-locus engine with a single locus of n nucleosomes
+        'loci' : None
+        }
+
+# family-wise false alarm rate over all tests of a run
+ALPHA = 0.05
+
+# tolerances: Kolmogorov-Smirnov distance, relative difference of switching
+# rates, and largest difference of the mean gap score of a timestep
+KS_TOL = 0.2
+RATE_TOL = 0.25
+GAP_TOL = 0.05
+
+# tests per configuration: 4 distributions, 2 switching rates and the gap curve
+TESTS = 7
+
+# resamples of the replica pairs for the bootstrap bounds: at least
+# BOOTSTRAP, and enough that BOOTSTRAP_TAIL of them lie beyond each bound
+BOOTSTRAP = 2000
+BOOTSTRAP_TAIL = 20
+
+# replicas per engine and configuration when --replicas is not given: two
+# independent samples of the same distribution come out ok at KS_TOL
+REPLICAS = 400
+
+def ks_distance(x, y):
+    '''
+    ks_distance(sample_1, sample_2)
+    two-sample Kolmogorov-Smirnov distance of sorted samples
+    '''
+    values = np.r_[x, y]
+    return np.max(np.abs(np.searchsorted(x, values, side='right') / len(x) -
+        np.searchsorted(y, values, side='right') / len(y)))
+
+def ks_2samp(x, y):
+    '''
+    ks_2samp(sample_1, sample_2)
+    two-sample Kolmogorov-Smirnov distance and its asymptotic p value
+    (Numerical Recipes approximation, without importing scipy)
+    '''
+    x = np.sort(np.asarray(x, dtype=float))
+    y = np.sort(np.asarray(y, dtype=float))
+    if len(x) == 0 or len(y) == 0:
+        return np.nan, np.nan
+
+    d = ks_distance(x, y)
+
+    ne = np.sqrt(len(x) * len(y) / (len(x) + len(y)))
+    lam = (ne + 0.12 + 0.11 / ne) * d
+    if lam < 0.2:
+        return d, 1.0
+    k = np.arange(1, 101)
+    p = 2 * np.sum((-1) ** (k - 1) * np.exp(-2 * k ** 2 * lam ** 2))
+    return d, float(min(max(p, 0), 1))
+
+def relative_difference(count_1, exposure_1, count_2, exposure_2):
+    '''
+    relative_difference(count_1, exposure_1, count_2, exposure_2)
+    relative difference of two poisson rates, 0 if neither ever switched
+    '''
+    rate_1 = count_1 / exposure_1 if exposure_1 > 0 else 0.0
+    rate_2 = count_2 / exposure_2 if exposure_2 > 0 else 0.0
+    if rate_1 == rate_2:
+        return 0.0
+    return abs(rate_2 - rate_1) / max(rate_1, rate_2)
+
+def rate_test(count_1, exposure_1, count_2, exposure_2):
+    '''
+    rate_test(count_1, exposure_1, count_2, exposure_2)
+    relative difference of two poisson rates and the p value of their
+    difference, conditional on the total count (binomial test, normal approximation)
+    '''
+    diff = relative_difference(count_1, exposure_1, count_2, exposure_2)
+    total = count_1 + count_2
+    if total == 0 or exposure_1 <= 0 or exposure_2 <= 0:
+        return diff, 1.0
+
+    share = exposure_1 / (exposure_1 + exposure_2)
+    z = abs(count_1 - total * share) / np.sqrt(total * share * (1 - share))
+    return diff, math.erfc(z / math.sqrt(2))
+
+def paired_bootstrap(statistic, reference, candidate, alpha, np_rng):
+    '''
+    paired_bootstrap(statistic, reference_values, candidate_values, alpha, generator)
+    (lower, upper) one-sided confidence bounds at level 1 - alpha of a
+    statistic of the two samples, from resamples of the replica pairs.
+    Identical samples give (0, 0)
+    '''
+    replicas = len(reference)
+    if replicas == 0:
+        return 0.0, np.inf
+
+    resamples = max(BOOTSTRAP, int(math.ceil(BOOTSTRAP_TAIL / alpha)))
+    stats = np.empty(shape=(resamples))
+    for b in range(resamples):
+        pick = np_rng.integers(0, replicas, size=replicas)
+        stats[b] = statistic(reference[pick], candidate[pick])
+    return float(np.quantile(stats, alpha)), float(np.quantile(stats, 1 - alpha))
+
+def verdict(lower, upper, tol):
+    '''
+    verdict(lower_bound, upper_bound, tolerance)
+    ok if the whole confidence interval is within the tolerance, differs if
+    it is all beyond it, inconclusive otherwise
+    '''
+    if upper <= tol:
+        return "ok"
+    if lower > tol:
+        return "differs"
+    return "inconclusive"
+
+def replicas_needed(replicas, diff, upper, tol):
+    '''
+    replicas_needed(replicas, difference, upper_bound, tolerance)
+    estimate of the replicas that bring the upper bound within the
+    tolerance, as bounds narrow like 1 / sqrt(replicas). 0 if no number
+    of replicas will
+    '''
+    if upper <= tol:
+        return replicas
+    if not diff < tol:
+        return 0
+    return int(math.ceil(replicas * ((upper - diff) / (tol - diff)) ** 2))
+
+def z_value(p):
+    '''
+    z_value(two_sided_p)
+    z of a two-sided p value of the normal distribution, by bisection
+    '''
+    low, high = 0.0, 40.0
+    for k in range(60):
+        mid = (low + high) / 2
+        if math.erfc(mid / math.sqrt(2)) > p:
+            low = mid
+        else:
+            high = mid
+    return (low + high) / 2
+
+def configurations(inputs):
+    '''
+    configurations(inputs)
+    input dictionaries of the configuration matrix
+    F values: --screen-Fval, string lengths: --screen-nucleosomes
+    divisions: none, or with -d every interval of --screen-divisions
+    recruitment: none, and with -r recruitment
+    configurations without a single event per timestep are skipped, as
+    every engine trivially agrees on them
+    '''
+    data = inputs['data']
+    fvals = data['screen_fval'] or [ inputs['f'] ]
+    lengths = data['screen_nucleosomes'] or [ inputs['n'] ]
+    divisions = [ None ]
+    if inputs['d'] != Divisions.NONE:
+        divisions = data['screen_divisions'] or [ data['divisions'] ]
+    recruit = [ Recruit.NONE ]
+    if inputs['r'] != Recruit.NONE:
+        recruit.append(inputs['r'])
+
+    configs = []
+    for point, (f, n, div, rec) in enumerate(itertools.product(fvals, lengths, divisions, recruit)):
+        config = copy.deepcopy(inputs)
+        config['f'] = f
+        config['n'] = n
+        config['r'] = rec
+        if div is None:
+            config['d'] = Divisions.NONE
+        else:
+            config['d'] = Divisions.USER_SET
+            config['data']['divisions'] = div
+        if int(Constants.get_max_events(Constants.get_timesteps_per_cellcycle(config)) * n) == 0:
+            print("Skipping N =", n, "F =", f, "divisions:", div, "recruit:", rec != Recruit.NONE,
+                    "(no events per timestep)")
+            continue
+        config['data']['stream'] = point
+        config['o'] = inputs['o'] + "_point" + str(point)
+        configs.append(config)
+
+    if len(configs) == 0:
+        raise ValueError("no configuration has events per timestep: use -d with division intervals of at most N timesteps")
+
+    return configs
+
+def engine_inputs(inputs, engine):
+    '''
+    engine_inputs(inputs, engine_name)
+    inputs of a configuration run with a candidate engine
+    '''
+    if ENGINES[engine] is None:
+        options = { 'loci':[ inputs['n'] ] }
+    else:
+        options = ENGINES[engine]
+
+    candidate = Simulation.SimConfig(inputs, **options).inputs
+    candidate['o'] = inputs['o'] + "_" + engine
+    return candidate
+
+class EngineSample:
+    '''
+    EngineSample class
+    per replica summaries of an ensemble run with one engine
+    '''
+
+    def __init__(self, inputs, replicas):
+        '''
+        initialization function
+        '''
+        self.inputs = inputs
+        self.final_M = np.zeros(shape=(replicas))
+        self.final_A = np.zeros(shape=(replicas))
+        self.mean_gap = np.zeros(shape=(replicas))
+        self.passage = np.zeros(shape=(replicas))
+        # switches out of off and on and the timesteps spent there
+        self.switches = np.zeros(shape=(2, replicas, 2))
+        self.analysis = Analysis.Analysis(max_lag=0)
+        self.seconds = 0
+
+    def run(self, sim_num):
+        '''
+        run(sim_num)
+        run and time one replica, keep its summaries
+        returns its gap score of every timestep
+        '''
+        n = self.inputs['n']
+        tot_timesteps = self.inputs['t']
+
+        start = time.monotonic()
+        result = Simulation.run_simulation(self.inputs, sim_num)
+        self.seconds += time.monotonic() - start
+
+        gap, off = Ensemble.replica_stats(result.trace_M, result.trace_A, n, tot_timesteps)
+        self.final_M[sim_num] = result.totals[States.M_STATE] / n
+        self.final_A[sim_num] = result.totals[States.A_STATE] / n
+        self.mean_gap[sim_num] = np.nanmean(gap)
+
+        before = [ row[1:3] for row in self.analysis.switching() ]
+        self.analysis.add_traces(result.trace_M, result.trace_A, n)
+        after = [ row[1:3] for row in self.analysis.switching() ]
+        for state in range(2):
+            self.switches[state, sim_num] = np.subtract(after[state], before[state])
+
+        first = self.analysis.first_off[-1]
+        self.passage[sim_num] = tot_timesteps if first is None else first
+
+        return gap
+
+def pooled_rate_difference(reference, candidate):
+    '''
+    pooled_rate_difference(reference_switches, candidate_switches)
+    relative difference of the switching rates of replicas of (switches, timesteps)
+    '''
+    return relative_difference(*reference.sum(axis=0), *candidate.sum(axis=0))
+
+def compare(reference, candidate, gap_diff, alpha, np_rng):
+    '''
+    compare(reference_sample, candidate_sample, paired_gap_differences, corrected_alpha, generator)
+    rows of (metric, difference, lower bound, upper bound, tolerance, p value,
+    verdict, replicas needed)
+    '''
+    replicas = len(reference.final_M)
+    rows = []
+    for metric in ("final_M", "final_A", "mean_gap", "passage"):
+        ref = getattr(reference, metric)
+        cand = getattr(candidate, metric)
+        d, p = ks_2samp(ref, cand)
+        bounds = paired_bootstrap(lambda x, y: ks_distance(np.sort(x), np.sort(y)), ref, cand, alpha, np_rng)
+        rows.append((metric, d) + bounds + (KS_TOL, p))
+
+    names = [ row[0] for row in reference.analysis.switching() ]
+    for state, name in enumerate(names):
+        ref = reference.switches[state]
+        cand = candidate.switches[state]
+        diff, p = rate_test(*ref.sum(axis=0), *cand.sum(axis=0))
+        bounds = paired_bootstrap(pooled_rate_difference, ref, cand, alpha, np_rng)
+        rows.append(("rate_" + name, diff) + bounds + (RATE_TOL, p))
+
+    # mean gap score of every timestep: paired differences and confidence
+    # intervals that hold for all timesteps at once
+    valid = gap_diff.count > 1
+    z = z_value(2 * alpha / max(np.count_nonzero(valid), 1)) / Ensemble.CI_Z
+    diff = np.abs(gap_diff.mean)[valid]
+    ci = z * gap_diff.ci()[valid]
+    if len(diff) > 0:
+        rows.append(("gap_curve", float(np.max(diff)), float(np.max(diff - ci)), float(np.max(diff + ci)), GAP_TOL, np.nan))
+    else:
+        rows.append(("gap_curve", np.nan, 0.0, np.inf, GAP_TOL, np.nan))
+
+    return [ row + (verdict(row[2], row[3], row[4]), replicas_needed(replicas, row[1], row[3], row[4])) for row in rows ]
+
+def run_equivalence(inputs, engine):
+    '''
+    run_equivalence(inputs, engine_name)
+    run the reference and the engine on every configuration with
+    --replicas replicas each, replica by replica
+    returns a list of (configuration inputs, comparison rows, speedup)
+    '''
+    replicas = inputs['data']['replicas']
+    configs = configurations(inputs)
+    alpha = ALPHA / (TESTS * len(configs))
+
+    results = []
+    for point, config in enumerate(configs):
+        print("Configuration", point, "of", len(configs), "N =", config['n'], "F =", config['f'],
+                "divisions:", config['data']['divisions'] if config['d'] != Divisions.NONE else None,
+                "recruit:", config['r'] != Recruit.NONE)
+        reference = EngineSample(config, replicas)
+        candidate = EngineSample(engine_inputs(config, engine), replicas)
+
+        gap_diff = Ensemble.RunningStats(config['t'])
+        for sim_num in range(replicas):
+            gap_diff.add_batch(reference.run(sim_num) - candidate.run(sim_num))
+
+        speedup = reference.seconds / candidate.seconds if candidate.seconds > 0 else np.inf
+        rng, np_rng = Constants.make_rngs(config['data']['seed'], config['data']['stream'])
+        results.append((config, compare(reference, candidate, gap_diff, alpha, np_rng), speedup))
+
+    return results
+
+def write_report(results, engine, filename):
+    '''
+    write_report(results, engine_name, filename)
+    one line per configuration and metric
+    '''
+    with open(filename, "w") as fp:
+        fp.write("Engine\tN\tFValue\tDivisions\tRecruit\tMetric\tDifference\tLowerBound\tUpperBound\tTolerance\tPValue\tVerdict\tReplicasNeeded\tSpeedup\n")
+        for config, rows, speedup in results:
+            divisions = config['data']['divisions'] if config['d'] != Divisions.NONE else 0
+            for metric, diff, lower, upper, tol, p, result, needed in rows:
+                fp.write("\t".join(str(x) for x in (
+                    engine, config['n'], config['f'], divisions, int(config['r'] != Recruit.NONE),
+                    metric, diff, lower, upper, tol, p, result, needed, speedup
+                    )) + "\n")
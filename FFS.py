@@ -0,0 +1,391 @@
+## FFS.py
+## Author: Aparna Rajpurkar
+
+# forward flux sampling of switches between M and A dominated strings
+# in the bistable regime switches are too rare for brute force replicas.
+# Forward flux sampling splits a switch into steps between interfaces of the
+# gap score (M - A) / (M + A), given with --ffs-interfaces from the start
+# basin to the target, e.g. 0.8,0.5,0.2,-0.2,-0.5,-0.8 from off to on:
+#   stage 0: simulations in the start basin (from -i) count how often the
+#            string leaves the basin and crosses the first interface. The
+#            flux is crossings per timestep spent coming from the basin,
+#            counted from the first crossing on, and the state at every
+#            crossing is kept as a checkpoint
+#   stage i: trials start from random checkpoints of interface i and run
+#            until they reach interface i + 1 (success, a new checkpoint) or
+#            fall back into the start basin (failure). Trials that do neither
+#            within -t timesteps time out and count as failures
+# the switching rate is the flux times the success probabilities of every
+# stage. Its relative variance is 1 / crossings + sum (1 - p) / (p trials)
+# (Allen, Valeriani and ten Wolde 2006), its confidence interval log normal.
+#
+# checkpoints keep the packed states, pending conversions, the timestep
+# (divisions depend on it) and the checkpoint they came from. Every trial has
+# its own random numbers (seed, stream, TRIAL_STREAMS, stage, trial), so the
+# transition paths are found again by running the chain of trials that led
+# to a success at the last interface once more, recording every frame.
+# basin runs use streams 0, 1, 2, ... in rounds of BASIN_ROUND, until
+# --ffs-crossings are collected or BASIN_RUNS_MAX runs of -t timesteps are
+# spent; crossings are taken in stream order, so the flux does not depend on
+# --procs. Basin runs and trials run in parallel with --procs workers
+
+# imports
+import math
+import multiprocessing
+import numpy as np
+import Bank
+import Chromatin
+import Constants
+import Ensemble
+import Trajectory
+from MyEnum import States
+
+# random streams of forward flux sampling are (seed, stream, kind, ...)
+BASIN_STREAMS = 0
+TRIAL_STREAMS = 1
+PICK_STREAMS = 2
+
+# basin runs started together, and the most basin runs of stage 0
+BASIN_ROUND = 16
+BASIN_RUNS_MAX = 256
+
+# trial outcomes
+FAILURE, SUCCESS, TIMEOUT = range(3)
+
+# Chromatin object used by the workers, as in Lineage.py
+_template = None
+
+def init_worker(inputs):
+    '''
+    init_worker(inputs)
+    build the template Chromatin object, unless it was inherited from the parent
+    '''
+    global _template
+    if _template is None:
+        _template = Chromatin.Chromatin(inputs)
+        _template.init_timesim(inputs['n'])
+
+def order(totals, sign):
+    '''
+    order(totals, sign)
+    gap score of the totals, times -1 if the interfaces decrease, so the
+    order parameter always grows from the start basin to the target
+    '''
+    m = totals[States.M_STATE]
+    a = totals[States.A_STATE]
+    if m + a == 0:
+        return 0.0
+    return sign * (m - a) / (m + a)
+
+class Checkpoint:
+    '''
+    Checkpoint class
+    state of a string at an interface crossing
+    '''
+
+    def __init__(self, chromatin, t):
+        '''
+        initialization function
+        '''
+        states, self.timers = chromatin.save_state()
+        self.packed = Bank.pack_states(states[None])[0]
+        self.t = t
+
+        # checkpoint the trial that made this one started from, and the
+        # (stage, trial number) of that trial. Set by the driver, so
+        # workers never get the chain of ancestors
+        self.parent = None
+        self.trial = None
+
+    def start(self):
+        '''
+        start()
+        what a trial needs to start from the checkpoint
+        '''
+        return self.packed, self.timers, self.t
+
+def run_basin(task):
+    '''
+    run_basin((run, timesteps, lower, upper, sign, max_crossings))
+    simulate in the start basin and keep a checkpoint at every crossing of
+    the first interface by a string coming from the basin
+    returns (checkpoints, timesteps coming from the basin at each checkpoint,
+    timesteps coming from the basin)
+    '''
+    run, timesteps, lower, upper, sign, max_crossings = task
+    chromatin = _template
+    inputs = chromatin.dat
+
+    # initial states as in Chromatin.init_nucs()
+    chromatin.set_streams(BASIN_STREAMS, run)
+    states = np.array([ Chromatin.Nucleosome(inputs['i'], 0, 0, chromatin.rng).state for i in range(inputs['n']) ], dtype=np.uint8)
+    chromatin.TIME = 0
+    chromatin.load_state(states, {})
+
+    checkpoints = []
+    exposures = []
+    exposure = 0
+    last = order(chromatin.totals, sign)
+    from_basin = last < lower
+    # the initial states are deeper in the basin than the strings that
+    # usually leave it; only count from the first crossing on
+    started = False
+
+    for t in range(timesteps):
+        chromatin.TIME = t
+        chromatin.step(t)
+        lam = order(chromatin.totals, sign)
+
+        if from_basin and started:
+            exposure += 1
+            if last < lower <= lam:
+                checkpoints.append(Checkpoint(chromatin, t + 1))
+                exposures.append(exposure)
+                if len(checkpoints) >= max_crossings:
+                    break
+            if lam >= upper:
+                # a switch during the basin run; count again once back
+                from_basin = False
+        if lam < lower:
+            from_basin = True
+        if last < lower <= lam:
+            started = True
+        last = lam
+
+    return checkpoints, exposures, exposure
+
+def run_trial(task):
+    '''
+    run_trial((stage, trial, checkpoint start, lower, upper, sign, max_timesteps, record))
+    run from a checkpoint until the next interface or the start basin
+    returns (outcome, checkpoint at the next interface or None, recorded frames)
+    '''
+    stage, trial, (packed, timers, t), lower, upper, sign, max_timesteps, record = task
+    chromatin = _template
+
+    chromatin.set_streams(TRIAL_STREAMS, stage, trial)
+    chromatin.TIME = t
+    chromatin.load_state(Bank.unpack_states(packed, chromatin.dat['n']), timers)
+
+    frames = [ chromatin.states.copy() ] if record else None
+    for k in range(max_timesteps):
+        chromatin.TIME = t
+        chromatin.step(t)
+        t += 1
+        if record:
+            frames.append(chromatin.states.copy())
+
+        lam = order(chromatin.totals, sign)
+        if lam >= upper:
+            return SUCCESS, Checkpoint(chromatin, t), frames
+        if lam < lower:
+            return FAILURE, None, frames
+
+    return TIMEOUT, None, frames
+
+class FFSResult:
+    '''
+    FFSResult class
+    flux, success probabilities of every stage and the switching rate
+    '''
+
+    def __init__(self, interfaces, flux_crossings, exposure, stages, final):
+        '''
+        initialization function
+        stages are (trials, successes, timeouts) of every stage,
+        final the checkpoints at the last interface
+        '''
+        self.interfaces = interfaces
+        self.flux_crossings = flux_crossings
+        self.exposure = exposure
+        self.stages = stages
+        self.final = final
+
+        self.flux = flux_crossings / exposure if exposure > 0 else 0.0
+        self.probs = [ s / trials if trials > 0 else 0.0 for trials, s, timeouts in stages ]
+        self.rate = self.flux * float(np.prod(self.probs)) if len(stages) == len(interfaces) - 1 else 0.0
+
+        # relative variance of the rate, binomial for every stage
+        if self.rate > 0:
+            rel_var = 1 / flux_crossings + sum((1 - p) / (p * trials) for p, (trials, s, timeouts) in zip(self.probs, stages))
+            spread = math.exp(Ensemble.CI_Z * math.sqrt(rel_var))
+            self.rel_error = math.sqrt(rel_var)
+            self.low = self.rate / spread
+            self.high = self.rate * spread
+        else:
+            # no successes at a stage: rule of three for that stage
+            self.rel_error = np.inf
+            self.low = 0.0
+            bound = self.flux
+            for p, (trials, s, timeouts) in zip(self.probs, stages):
+                bound *= p if s > 0 else 3 / trials
+            self.high = bound if self.flux > 0 else np.inf
+
+def map_tasks(pool, procs, function, tasks):
+    '''
+    map_tasks(pool, processes, function, tasks)
+    '''
+    if pool is None:
+        return list(map(function, tasks))
+    return pool.map(function, tasks, chunksize=max(1, len(tasks) // (4 * procs)))
+
+def run_ffs(inputs):
+    '''
+    run_ffs(inputs)
+    forward flux sampling from the start basin (-i) over --ffs-interfaces
+    with --ffs-crossings checkpoints at the first interface and --ffs-trials
+    trials per stage. Basin runs and trials take at most -t timesteps
+    returns an FFSResult
+    '''
+    global _template
+    data = inputs['data']
+    interfaces = data['ffs_interfaces']
+    sign = 1 if interfaces[-1] > interfaces[0] else -1
+    lams = [ sign * x for x in interfaces ]
+    procs = data['procs']
+
+    _template = Chromatin.Chromatin(inputs)
+    _template.init_timesim(inputs['n'])
+
+    pool = None
+    if procs > 1:
+        # fork shares the kernel; other start methods build it in each worker
+        if "fork" in multiprocessing.get_all_start_methods():
+            context = multiprocessing.get_context("fork")
+        else:
+            context = multiprocessing.get_context()
+        pool = context.Pool(procs, init_worker, (inputs,))
+
+    # picks of checkpoints, independent of the number of workers
+    pick_np_rng = Constants.make_rngs(data['seed'], data['stream'], PICK_STREAMS)[1]
+
+    try:
+        # stage 0: flux out of the start basin
+        crossings = data['ffs_crossings']
+        checkpoints = []
+        exposure = 0
+        run = 0
+        while len(checkpoints) < crossings and run < BASIN_RUNS_MAX:
+            runs = range(run, min(run + BASIN_ROUND, BASIN_RUNS_MAX))
+            wanted = -(-(crossings - len(checkpoints)) // len(runs))
+            tasks = [ (r, inputs['t'], lams[0], lams[-1], sign, wanted) for r in runs ]
+            # in stream order; a run past the last crossing needed is dropped
+            for found, exposures, timesteps in map_tasks(pool, procs, run_basin, tasks):
+                missing = crossings - len(checkpoints)
+                if missing <= 0:
+                    break
+                if len(found) > missing:
+                    checkpoints += found[:missing]
+                    exposure += exposures[missing - 1]
+                else:
+                    checkpoints += found
+                    exposure += timesteps
+            run = runs.stop
+        flux_crossings = len(checkpoints)
+        print("Stage 0: crossings", flux_crossings, "in", exposure, "timesteps from", run, "basin runs")
+        if flux_crossings < crossings:
+            print("Warning: only", flux_crossings, "of", crossings, "crossings of the first interface in",
+                    run, "basin runs of", inputs['t'], "timesteps, the flux is less precise")
+
+        # stages 1..: trials between interfaces
+        stages = []
+        for stage in range(1, len(lams)):
+            if len(checkpoints) == 0:
+                break
+            trials = data['ffs_trials']
+            starts = pick_np_rng.integers(len(checkpoints), size=trials)
+            tasks = [ (stage, k, checkpoints[starts[k]].start(), lams[0], lams[stage], sign, inputs['t'], False)
+                    for k in range(trials) ]
+
+            results = map_tasks(pool, procs, run_trial, tasks)
+            found = []
+            timeouts = 0
+            for k, (outcome, checkpoint, frames) in enumerate(results):
+                if outcome == SUCCESS:
+                    checkpoint.parent = checkpoints[starts[k]]
+                    checkpoint.trial = (stage, k)
+                    found.append(checkpoint)
+                elif outcome == TIMEOUT:
+                    timeouts += 1
+            checkpoints = found
+            stages.append((trials, len(checkpoints), timeouts))
+            print("Stage", stage, "interface", interfaces[stage], "successes", len(checkpoints), "of", trials, "timeouts", timeouts)
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+    return FFSResult(interfaces, flux_crossings, exposure, stages, checkpoints)
+
+def transition_path(inputs, checkpoint):
+    '''
+    transition_path(inputs, checkpoint_at_last_interface)
+    frames from the first interface to the last, found again by running the
+    chain of trials that led to the checkpoint
+    '''
+    init_worker(inputs)
+    interfaces = inputs['data']['ffs_interfaces']
+    sign = 1 if interfaces[-1] > interfaces[0] else -1
+    lams = [ sign * x for x in interfaces ]
+
+    chain = []
+    while checkpoint.parent is not None:
+        chain.append(checkpoint)
+        checkpoint = checkpoint.parent
+    chain.reverse()
+
+    frames = []
+    for checkpoint in chain:
+        stage, trial = checkpoint.trial
+        outcome, end, segment = run_trial((stage, trial, checkpoint.parent.start(), lams[0], lams[stage], sign, inputs['t'], True))
+        # the first frame of a segment is the last of the one before
+        frames += segment if len(frames) == 0 else segment[1:]
+
+    return frames
+
+def write_ffs(result, filename):
+    '''
+    write_ffs(result, filename)
+    flux, switching rate and one line per stage
+    '''
+    with open(filename, "w") as fp:
+        fp.write("# flux\t" + str(result.flux) + "\tcrossings\t" + str(result.flux_crossings) +
+                "\ttimesteps\t" + str(result.exposure) + "\n")
+        fp.write("# rate\t" + str(result.rate) + "\tlow\t" + str(result.low) + "\thigh\t" + str(result.high) +
+                "\trelative_error\t" + str(result.rel_error) + "\n")
+        fp.write("Stage\tFrom\tTo\tTrials\tSuccesses\tTimeouts\tProbability\n")
+        for stage, ((trials, successes, timeouts), p) in enumerate(zip(result.stages, result.probs)):
+            fp.write("\t".join(str(x) for x in (
+                stage + 1, result.interfaces[stage], result.interfaces[stage + 1],
+                trials, successes, timeouts, p
+                )) + "\n")
+
+def write_paths(inputs, result, outfile):
+    '''
+    write_paths(inputs, result, outfile)
+    up to --ffs-paths transition paths as text trajectories
+    (<outfile>_path<k>.txt), one line per timestep
+    returns the filenames
+    '''
+    # distinct ancestors at the first interface give different paths
+    chosen = []
+    roots = set()
+    for checkpoint in result.final:
+        root = checkpoint
+        while root.parent is not None:
+            root = root.parent
+        if id(root) not in roots:
+            roots.add(id(root))
+            chosen.append(checkpoint)
+        if len(chosen) == inputs['data']['ffs_paths']:
+            break
+
+    filenames = []
+    for k, checkpoint in enumerate(chosen):
+        filename = outfile + "_path" + str(k) + ".txt"
+        with open(filename, "wb") as fp:
+            for frame in transition_path(inputs, checkpoint):
+                fp.write(Trajectory.TO_CHAR[frame].tobytes() + b"\n")
+        filenames.append(filename)
+
+    return filenames
@@ -4,10 +4,10 @@
 # imports
 import getopt
 import sys
+import Bank
 import Constants
-import Chromatin
-from MyEnum import ProbSpread, States, Domain, DomainBleed, Divisions, ProbConv, Recruit
-from Animate import animate_from_file
+import Operators
+from MyEnum import ProbSpread, States, Domain, DomainBleed, Divisions, ProbConv, Recruit, TimeStep, Stop, Replicas, Output, Backpressure, Precision, KernelRep, Plan, Replace
 
 class InputError(Exception):
     '''
@@ -41,7 +41,7 @@ def usage():
     print("\t-r, --recruit\n\t\tinclude recruitment in simulation\n\t\t[default: False]")
 
     print("Advanced Options")
-    print("\t--prob-spread <rand, powerlaw>\n\t\tProbability distribution for spreading of modification\n\t\t[default: rand]")
+    print("\t--prob-spread <rand, powerlaw>\n\t\tProbability distribution for spreading of modification. powerlaw: a modified nucleosome\n\t\tconverts a partner at a power law distance in its domain instead of summing feedback\n\t\t[default: rand]")
 
     print("\t--domain <none, equal, set>\n\t\tadd static domains of either equal size with user-set number of domains or custom sizes\n\t\t[default: none]")
     print("\t--domain-equal <INT>\n\t\tadd static domains of the same size. Input number of domains.\n\t\t[default:2]")
@@ -57,6 +57,70 @@ def usage():
     print("\t--recruit-time-init <INT>\n\t\tstart of recruitment\n\t\t[default: 10]")
     print("\t--recruit-time <INT>\n\t\tduration of recruitment in timesteps\n\t\t[default: 10]")
     print("\t--recruit-n <INT>\n\t\tnumber of nucleosomes to recruit CR to\n\t\t[default: 5]")
+    print("\t--recruit-sites <comma separated list of integers>\n\t\tcenters of recruitment sites, each of recruit-n nucleosomes\n\t\t[default: the center of the string]")
+    print("\t--recruit-period <INT>\n\t\trepeat the recruitment window every this many timesteps. 0 recruits once\n\t\t[default: 0]")
+    print("\t--recruit-file <FILE>\n\t\tread recruitment sites from a file, one per line: <center> <width> <start> <duration> [<period>]\n\t\t[default: none]")
+    print("\t--division-replace <poisson, binomial>\n\t\treplace a poisson of half of the nucleosomes at a division, or each nucleosome with chance 1/2\n\t\t[default: poisson]")
+
+    print("\t--timestep <fixed, adaptive>\n\t\tfixed timesteps, or adaptive leaps over several timesteps when few conversions are likely.\n\t\tfaster than fixed timesteps in stable states, about as fast when many conversions happen\n\t\t[default: fixed]")
+    print("\t--tau-eps <FLOAT>\n\t\terror tolerance of adaptive leaps: allowed relative change of M, U and A totals per leap\n\t\t[default: 0.03]")
+
+    print("\t--stop <comma separated list of none, absorb, plateau, passage>\n\t\tstop early when no event can change the state any more, the gap score stops changing or M passes a threshold.\n\t\tabsorb and plateau carry the last frame forward; passage leaves the rest empty and is refused\n\t\twhere ensemble statistics are computed (MainSim.py, MainSweep.py, MainEquivalence.py)\n\t\t[default: none]")
+    print("\t--stop-window <INT>\n\t\tnumber of timesteps per window of the gap score plateau rule\n\t\t[default: 1000]")
+    print("\t--stop-tol <FLOAT>\n\t\tstop when mean gap scores of two consecutive windows differ by less than this\n\t\t[default: 0.01]")
+    print("\t--stop-thresh <FLOAT>\n\t\tstop when the fraction of M nucleosomes reaches this threshold\n\t\t[default: " + str(Constants.PERCENT_M_THRESH) + "]")
+
+    print("\t--output <text, events>\n\t\ttrajectory format: one line of letters per timestep, or a binary log of conversion events with keyframes\n\t\t[default: text]")
+    print("\t--keyframe <INT>\n\t\ttimesteps between full keyframes of the event log\n\t\t[default: 1000]")
+
+    print("\t--replicas <INT>\n\t\tfixed number of replicas to run with MainSim.py\n\t\t[default: 100]")
+    print("\t--precision <FLOAT>\n\t\trun replicas until the confidence intervals of mean gap score and percent off are this narrow\n\t\t[default: fixed number of replicas]")
+    print("\t--replicas-min <INT>\n\t\tminimum number of replicas with --precision\n\t\t[default: 20]")
+    print("\t--replicas-max <INT>\n\t\tmaximum number of replicas with --precision\n\t\t[default: 1000]")
+    print("\t--replica-batch <INT>\n\t\tnumber of replicas to run between precision checks\n\t\t[default: 10]")
+
+    print("\t--loci <comma separated list of integers>\n\t\tsimulate independent loci of these lengths together. n is set to their sum\n\t\t[default: one locus of n nucleosomes]")
+    print("\t--loci-file <FILE>\n\t\tread loci from a file, one per line: <length> or <name> <length>\n\t\t[default: none]")
+
+    print("\t--lineage\n\t\tfollow both daughters at every division and write a record of every cell. Needs -d\n\t\t[default: False]")
+    print("\t--lineage-max <INT>\n\t\tmaximum number of cells per generation in lineage mode\n\t\t[default: 1024]")
+    print("\t--lineage-sample <FLOAT>\n\t\tprobability of following each daughter in lineage mode\n\t\t[default: 1]")
+    print("\t--screen-Fval <comma separated list of floats>\n\t\tF values screened by MainScreen.py\n\t\t[default: the F value]")
+    print("\t--screen-divisions <comma separated list of integers>\n\t\tdivision intervals screened by MainScreen.py\n\t\t[default: the division interval]")
+    print("\t--screen-recruit-time-init <comma separated list of integers>\n\t\trecruitment starts screened by MainScreen.py\n\t\t[default: the recruitment start]")
+    print("\t--screen-recruit-time <comma separated list of integers>\n\t\trecruitment durations screened by MainScreen.py\n\t\t[default: the recruitment duration]")
+    print("\t--screen-nucleosomes <comma separated list of integers>\n\t\tstring lengths compared by MainEquivalence.py\n\t\t[default: n]")
+
+    print("\t--kernel-precision <float64, float32, float16, uint16>\n\t\tstorage of the feedback kernel. uint16 is scaled per block\n\t\t[default: float64]")
+    print("\t--accumulate <float64, float32>\n\t\tprecision of feedback field sums\n\t\t[default: float64]")
+    print("\t--kernel <block, rows, hmatrix>\n\t\tstore one kernel block per domain, compute the kernel rows of every feedback event when needed,\n\t\tor store every block as a hierarchical matrix with low-rank far field\n\t\t[default: block]")
+    print("\t--kernel-tol <FLOAT>\n\t\trelative tolerance of the low-rank factors of --kernel hmatrix\n\t\t[default: 1e-6]")
+
+    print("\t--plan <none, check, auto>\n\t\testimate memory, disk and runtime before running: no planning, refuse runs that do not fit,\n\t\tor pick the kernel, precision and trajectory output that fit\n\t\t[default: check]")
+    print("\t--max-memory <FLOAT>\n\t\tmemory in MB a run may use\n\t\t[default: available memory]")
+    print("\t--max-disk <FLOAT>\n\t\tdisk space in MB the output may use\n\t\t[default: free space next to the outfile]")
+    print("\t--max-hours <FLOAT>\n\t\testimated runtime in hours above which a run is refused\n\t\t[default: no limit]")
+
+    print("\t--bank <DIR>\n\t\tburn-in snapshot bank of MainBank.py. Replica i starts from the end of burn-in i of its setting instead of from -i; the bank needs a snapshot per replica\n\t\t[default: none]")
+    print("\t--burn-in <INT>\n\t\ttimesteps of burn-in of the snapshots of MainBank.py, rounded up to whole cell cycles\n\t\t[default: 60000]")
+    print("\t--ffs-interfaces <comma separated list of floats>\n\t\tgap scores of the interfaces of MainFFS.py, from the edge of the start basin (-i) to the target\n\t\t[default: none]")
+    print("\t--ffs-crossings <INT>\n\t\tcrossings of the first interface collected by MainFFS.py,\n\t\tfrom at most 256 basin runs of -t timesteps\n\t\t[default: 1000]")
+    print("\t--ffs-trials <INT>\n\t\ttrials per interface of MainFFS.py\n\t\t[default: 1000]")
+    print("\t--ffs-paths <INT>\n\t\ttransition paths written by MainFFS.py\n\t\t[default: 3]")
+    print("\t--queue <DIR>\n\t\tsweep directory of MainSweep.py, on a filesystem shared by all workers\n\t\t[default: <outfile>_queue]")
+    print("\t--lease-timeout <FLOAT>\n\t\tseconds without a heartbeat after which a task of MainSweep.py is given to another worker\n\t\t[default: 300]")
+
+    print("\t--seed <INT>\n\t\tmaster random seed. Every simulation draws from its own stream, derived from the seed, the stream number and the sim number\n\t\t[default: " + str(Constants.SEED) + "]")
+    print("\t--stream <INT>\n\t\tstream number, e.g. the index of a parameter point. Runs with different streams get independent random numbers\n\t\t[default: 0]")
+    print("\t--crn\n\t\tcommon random numbers: replica i draws the same numbers at every parameter point, timestep and phase, whatever the stream. Differences between parameter points of a sweep have less variance\n\t\t[default: False]")
+    print("\t--procs <INT>\n\t\tnumber of worker processes\n\t\t[default: 1]")
+
+    print("\t--write-queue <INT>\n\t\tblocks of output queued for the background writer thread. 0 writes in the simulation thread\n\t\t[default: 8]")
+    print("\t--backpressure <block, grow>\n\t\twhen the output queue is full, wait for the disk or let the queue grow without bound\n\t\t[default: block]")
+    print("\t--live <NAME>\n\t\tpublish frames and totals to shared memory NAME while running. Watch with MainView.py NAME\n\t\t[default: no live view]")
+    print("\t--telemetry <FILE>\n\t\tappend JSON lines with the progress of every replica to FILE. Summarize with MainTelemetry.py\n\t\t[default: no telemetry]")
+    print("\t--telemetry-interval <FLOAT>\n\t\tseconds between telemetry lines of a replica\n\t\t[default: 10]")
+    print("\t--compress\n\t\tgzip trajectory files in the writer thread\n\t\t[default: False]")
 
 def test_int(string):
     ''' 
@@ -74,6 +138,77 @@ def test_float(string):
 
     return num
 
+def test_pos_int(string):
+    '''
+    test if string input is a positive integer number
+    '''
+    num = int(string)
+
+    if num <= 0:
+        raise ValueError
+
+    return num
+
+def test_nonneg_int(string):
+    '''
+    test if string input is an integer number of at least 0
+    '''
+    num = int(string)
+
+    if num < 0:
+        raise ValueError
+
+    return num
+
+def test_int_list(string):
+    '''
+    test if string input is a comma separated list of positive integers
+    '''
+    return [ test_pos_int(x) for x in string.split(",") ]
+
+def test_float_list(string):
+    '''
+    test if string input is a comma separated list of floats
+    '''
+    return [ test_float(x) for x in string.split(",") ]
+
+def test_interfaces(string):
+    '''
+    test if string input is a comma separated list of at least 2 gap scores
+    that strictly increase or strictly decrease
+    '''
+    values = test_float_list(string)
+    steps = [ b - a for a, b in zip(values[:-1], values[1:]) ]
+
+    if len(values) < 2 or min(values) < -1 or max(values) > 1:
+        raise ValueError
+    if not (all(x > 0 for x in steps) or all(x < 0 for x in steps)):
+        raise ValueError
+
+    return values
+
+def test_prob(string):
+    '''
+    test if string input is a probability
+    '''
+    num = float(string)
+
+    if num < 0 or num > 1:
+        raise ValueError
+
+    return num
+
+def test_pos_float(string):
+    '''
+    test if string input is a positive float number
+    '''
+    num = float(string)
+
+    if num <= 0:
+        raise ValueError
+
+    return num
+
 def test_state(string):
     '''
     test if string input is a state 
@@ -102,12 +237,11 @@ def test_enum(string, classname):
     else:
         raise ValueError
 
-def parse_input(opts):
+def default_inputs():
     '''
-    parse_input()
-    given an opts object from getopt, parse all input options
+    default_inputs()
+    return a new input dictionary with every option set to its default
     '''
-    # set defaults and initialize input dictionary
     default_n = 60
     inputs = {
         'n':default_n,
@@ -121,22 +255,138 @@ def parse_input(opts):
             'prob_spread' : ProbSpread.RANDOM,
             'domain' : Domain.NONE,
             'domainbleed' : DomainBleed.NONE,
-            'prob_conv' : ProbConv.EQUAL_DEFAULT
+            'prob_conv' : ProbConv.EQUAL_DEFAULT,
+            'timestep' : TimeStep.FIXED,
+            # list of stopping rules
+            'stop' : [],
+            'replicas' : Replicas.FIXED,
+            'output' : Output.TEXT,
+            'backpressure' : Backpressure.BLOCK,
+            'compress' : False,
+            # follow both daughters at divisions
+            'lineage' : False,
+            # storage of the kernel and precision of field sums
+            'kernel_precision' : Precision.FLOAT64,
+            'accumulate' : Precision.FLOAT64,
+            'kernel' : KernelRep.BLOCK,
+            # planning of memory, disk and runtime, see Planner.py
+            'plan' : Plan.CHECK,
+            # nucleosomes replaced at divisions
+            'division_replace' : Replace.POISSON
             },
         'data': {
             'recruit_time_init':10,
             'recruit_time':10,
             'recruit_n':5,
+            # centers of recruitment sites, None is the center of the string
+            'recruit_centers':None,
+            # recruitment window repeats every recruit_period timesteps, 0 is once
+            'recruit_period':0,
+            # (center, width, start, duration, period) of every site from --recruit-file
+            'recruit_schedule':None,
             'divisions':100,
             # unused
             'prob_conv':[1,1,1,1],
             # number of domains
-            'domains':1,
-            # not fully implemented
-            'domainbleed':0
+            'domains':2,
+            # domain sizes. None means n_nucleosomes/2,n_nucleosomes/2
+            'domain_sizes':None,
+            # probability of domain bleedthrough
+            'domainbleed':0.05,
+            # error tolerance of adaptive timesteps
+            'tau_eps':0.03,
+            # stopping rules
+            'stop_window':1000,
+            'stop_tol':0.01,
+            'stop_thresh':Constants.PERCENT_M_THRESH,
+            # number of replicas
+            'replicas':100,
+            'replicas_min':20,
+            'replicas_max':1000,
+            'replica_batch':10,
+            # half width of confidence intervals with adaptive replicas
+            'precision':0.05,
+            # relative tolerance of hierarchical kernels, see Kernel.HMatrixKernel
+            'kernel_tol':1e-6,
+            # timesteps between keyframes of event logs
+            'keyframe':1000,
+            # lengths and names of loci of multi-locus mode. None is a single locus
+            'loci':None,
+            'loci_names':None,
+            # blocks of output queued for the writer thread
+            'write_queue':8,
+            # lineage mode population cap and probability of following a daughter
+            'lineage_max':1024,
+            'lineage_sample':1,
+            # number of worker processes
+            'procs':1,
+            # master seed and stream number of the random numbers
+            'seed':Constants.SEED,
+            'stream':0,
+            # common random numbers of every parameter point, see Constants.CommonStreams
+            'crn':False,
+            # parameter values screened by MainScreen.py. None is the single value above
+            'screen_fval':None,
+            'screen_divisions':None,
+            'screen_recruit_time_init':None,
+            'screen_recruit_time':None,
+            'screen_nucleosomes':None,
+            # sweep directory and lease timeout in seconds of MainSweep.py
+            'queue':None,
+            # interfaces, first interface crossings, trials per interface and
+            # transition paths of forward flux sampling, see FFS.py
+            'ffs_interfaces':None,
+            'ffs_crossings':1000,
+            'ffs_trials':1000,
+            'ffs_paths':3,
+            'lease_timeout':300,
+            # burn-in snapshot bank and burn-in timesteps, see Bank.py
+            'bank':None,
+            'burn_in':60000,
+            # limits of the planner in MB and hours. None is what the host has
+            'max_memory':None,
+            'max_disk':None,
+            'max_hours':None,
+            # telemetry file and seconds between lines
+            'telemetry':None,
+            'telemetry_interval':10,
+            # shared memory name of the live view
+            'live':None
             }
             }
 
+    return inputs
+
+def test_enum_list(string, classname):
+    '''
+    test if string is a comma separated list of an enum class' values
+    "none" gives an empty list
+    '''
+    enums = []
+    for val in string.split(","):
+        enum = test_enum(val, classname)
+        if enum != classname.NONE:
+            add_to_list(enums, enum)
+
+    return enums
+
+def add_to_list(lst, item):
+    '''
+    add item to list if it is not in there yet
+    '''
+    if item not in lst:
+        lst.append(item)
+
+def parse_input(opts, inputs=None):
+    '''
+    parse_input()
+    given an opts object from getopt, parse all input options
+    on top of an existing input dictionary if one is given
+    '''
+    # set defaults and initialize input dictionary
+    if inputs is None:
+        inputs = default_inputs()
+
     # iterate over every option and argument
     # this part is already quite difficult to read so I won't add more comments
     # it's pretty self explanatory & repetitive
@@ -183,33 +433,33 @@ def parse_input(opts):
             except ValueError:
                 raise InputError(opt, arg, "must be in [" + ", ".join(ProbSpread.get_values()) + "]")
         elif opt == "--domain":
-            raise RuntimeError("Not fully implemented! option:[",opt,"]")
             try:
                 inputs['adv']['domain'] = test_enum(arg, Domain)
             except ValueError:
                 raise InputError(opt, arg, "must be in [" + ", ".join(Domain.get_values()) + "]")
         elif opt == "--domainbleed":
-            raise RuntimeError("Not fully implemented! option:[",opt,"]")
             try:
                 inputs['adv']['domainbleed'] = test_enum(arg, DomainBleed)
             except ValueError:
                 raise InputError(opt, arg, "must be in [" + ", ".join(DomainBleed.get_values()) + "]")
         elif opt == "--domain-equal":
-            raise RuntimeError("Not fully implemented! option:[",opt,"]")
             try:
                 inputs['adv']['domain'] = Domain.EQUAL_DEFAULT
-                inputs['data']['domains'] = test_int(arg) 
+                inputs['data']['domains'] = test_pos_int(arg)
             except ValueError:
-                raise InputError(opt, arg, "requires int!")
+                raise InputError(opt, arg, "requires positive int!")
         elif opt == "--domain-set":
-            raise RuntimeError("Unimplemented option:[",opt,"]")
+            try:
+                inputs['adv']['domain'] = Domain.USER_SET
+                inputs['data']['domain_sizes'] = test_int_list(arg)
+            except ValueError:
+                raise InputError(opt, arg, "requires comma separated list of positive ints!")
         elif opt == "--domainbleed-prob":
-            raise RuntimeError("Not fully implemented! option:[",opt,"]")
             try:
                 inputs['adv']['domainbleed'] = DomainBleed.USER_SET
-                inputs['data']['domainbleed'] = test_float(arg)
+                inputs['data']['domainbleed'] = test_prob(arg)
             except ValueError:
-                raise InputError(opt, arg, "requires float!")
+                raise InputError(opt, arg, "requires float between 0 and 1!")
         elif opt == "--divisions-num":
             try:
                 inputs['d'] = Divisions.USER_SET
@@ -236,11 +486,472 @@ def parse_input(opts):
                 inputs['data']['recruit_n'] = test_int(arg)
             except ValueError:
                 raise InputError(opt, arg, "requires int!")
+        elif opt == "--recruit-sites":
+            try:
+                inputs['r'] = Recruit.USER_SET
+                inputs['data']['recruit_centers'] = [ test_nonneg_int(x) for x in arg.split(",") ]
+            except ValueError:
+                raise InputError(opt, arg, "requires comma separated list of ints of at least 0!")
+        elif opt == "--recruit-period":
+            try:
+                inputs['r'] = Recruit.USER_SET
+                inputs['data']['recruit_period'] = test_nonneg_int(arg)
+            except ValueError:
+                raise InputError(opt, arg, "requires int of at least 0!")
+        elif opt == "--recruit-file":
+            try:
+                inputs['r'] = Recruit.USER_SET
+                inputs['data']['recruit_schedule'] = read_recruit_file(arg)
+            except (ValueError, IndexError):
+                raise InputError(opt, arg, "lines must be <center> <width> <start> <duration> [<period>] with ints of at least 0!")
+            except OSError:
+                raise InputError(opt, arg, "cannot read file!")
+        elif opt == "--division-replace":
+            try:
+                inputs['adv']['division_replace'] = test_enum(arg, Replace)
+            except ValueError:
+                raise InputError(opt, arg, "must be in [" + ", ".join(Replace.get_values()) + "]")
+        elif opt == "--timestep":
+            try:
+                inputs['adv']['timestep'] = test_enum(arg, TimeStep)
+            except ValueError:
+                raise InputError(opt, arg, "must be in [" + ", ".join(TimeStep.get_values()) + "]")
+        elif opt == "--tau-eps":
+            try:
+                inputs['adv']['timestep'] = TimeStep.ADAPTIVE
+                inputs['data']['tau_eps'] = test_pos_float(arg)
+            except ValueError:
+                raise InputError(opt, arg, "requires positive float!")
+        elif opt == "--stop":
+            try:
+                inputs['adv']['stop'] = test_enum_list(arg, Stop)
+            except ValueError:
+                raise InputError(opt, arg, "must be comma separated list of [" + ", ".join(Stop.get_values()) + "]")
+        elif opt == "--stop-window":
+            try:
+                add_to_list(inputs['adv']['stop'], Stop.PLATEAU)
+                inputs['data']['stop_window'] = test_pos_int(arg)
+            except ValueError:
+                raise InputError(opt, arg, "requires positive int!")
+        elif opt == "--stop-tol":
+            try:
+                add_to_list(inputs['adv']['stop'], Stop.PLATEAU)
+                inputs['data']['stop_tol'] = test_pos_float(arg)
+            except ValueError:
+                raise InputError(opt, arg, "requires positive float!")
+        elif opt == "--stop-thresh":
+            try:
+                add_to_list(inputs['adv']['stop'], Stop.PASSAGE)
+                inputs['data']['stop_thresh'] = test_prob(arg)
+            except ValueError:
+                raise InputError(opt, arg, "requires float between 0 and 1!")
+        elif opt == "--replicas":
+            try:
+                inputs['adv']['replicas'] = Replicas.FIXED
+                inputs['data']['replicas'] = test_pos_int(arg)
+            except ValueError:
+                raise InputError(opt, arg, "requires positive int!")
+        elif opt == "--precision":
+            try:
+                inputs['adv']['replicas'] = Replicas.ADAPTIVE
+                inputs['data']['precision'] = test_pos_float(arg)
+            except ValueError:
+                raise InputError(opt, arg, "requires positive float!")
+        elif opt == "--replicas-min":
+            try:
+                inputs['adv']['replicas'] = Replicas.ADAPTIVE
+                inputs['data']['replicas_min'] = test_pos_int(arg)
+            except ValueError:
+                raise InputError(opt, arg, "requires positive int!")
+        elif opt == "--replicas-max":
+            try:
+                inputs['adv']['replicas'] = Replicas.ADAPTIVE
+                inputs['data']['replicas_max'] = test_pos_int(arg)
+            except ValueError:
+                raise InputError(opt, arg, "requires positive int!")
+        elif opt == "--replica-batch":
+            try:
+                inputs['data']['replica_batch'] = test_pos_int(arg)
+            except ValueError:
+                raise InputError(opt, arg, "requires positive int!")
+        elif opt == "--output":
+            try:
+                inputs['adv']['output'] = test_enum(arg, Output)
+            except ValueError:
+                raise InputError(opt, arg, "must be in [" + ", ".join(Output.get_values()) + "]")
+        elif opt == "--keyframe":
+            try:
+                inputs['adv']['output'] = Output.EVENTS
+                inputs['data']['keyframe'] = test_pos_int(arg)
+            except ValueError:
+                raise InputError(opt, arg, "requires positive int!")
+        elif opt == "--loci":
+            try:
+                inputs['data']['loci'] = [ test_pos_int(x) for x in arg.split(",") ]
+                inputs['data']['loci_names'] = [ "locus" + str(x) for x in range(len(inputs['data']['loci'])) ]
+            except ValueError:
+                raise InputError(opt, arg, "requires comma separated list of positive ints!")
+        elif opt == "--loci-file":
+            try:
+                inputs['data']['loci'], inputs['data']['loci_names'] = read_loci_file(arg)
+            except (ValueError, IndexError):
+                raise InputError(opt, arg, "lines must be <length> or <name> <length> with positive int length!")
+            except OSError:
+                raise InputError(opt, arg, "cannot read file!")
+        elif opt == "--lineage":
+            inputs['adv']['lineage'] = True
+        elif opt == "--lineage-max":
+            try:
+                inputs['data']['lineage_max'] = test_pos_int(arg)
+            except ValueError:
+                raise InputError(opt, arg, "requires positive int!")
+        elif opt == "--lineage-sample":
+            try:
+                inputs['data']['lineage_sample'] = test_prob(arg)
+            except ValueError:
+                raise InputError(opt, arg, "requires float between 0 and 1!")
+        elif opt == "--screen-Fval":
+            try:
+                inputs['data']['screen_fval'] = test_float_list(arg)
+            except ValueError:
+                raise InputError(opt, arg, "requires comma separated list of floats!")
+        elif opt == "--screen-divisions":
+            try:
+                inputs['data']['screen_divisions'] = test_int_list(arg)
+            except ValueError:
+                raise InputError(opt, arg, "requires comma separated list of positive ints!")
+        elif opt == "--screen-recruit-time-init":
+            try:
+                inputs['data']['screen_recruit_time_init'] = test_int_list(arg)
+            except ValueError:
+                raise InputError(opt, arg, "requires comma separated list of positive ints!")
+        elif opt == "--screen-recruit-time":
+            try:
+                inputs['data']['screen_recruit_time'] = test_int_list(arg)
+            except ValueError:
+                raise InputError(opt, arg, "requires comma separated list of positive ints!")
+        elif opt == "--screen-nucleosomes":
+            try:
+                inputs['data']['screen_nucleosomes'] = test_int_list(arg)
+            except ValueError:
+                raise InputError(opt, arg, "requires comma separated list of positive ints!")
+        elif opt == "--kernel-precision":
+            try:
+                inputs['adv']['kernel_precision'] = test_enum(arg, Precision)
+            except ValueError:
+                raise InputError(opt, arg, "must be in [" + ", ".join(Precision.get_values()) + "]")
+        elif opt == "--accumulate":
+            try:
+                inputs['adv']['accumulate'] = test_enum(arg, Precision)
+                if inputs['adv']['accumulate'] not in (Precision.FLOAT64, Precision.FLOAT32):
+                    raise ValueError
+            except ValueError:
+                raise InputError(opt, arg, "must be in [float64, float32]")
+        elif opt == "--kernel":
+            try:
+                inputs['adv']['kernel'] = test_enum(arg, KernelRep)
+            except ValueError:
+                raise InputError(opt, arg, "must be in [" + ", ".join(KernelRep.get_values()) + "]")
+        elif opt == "--kernel-tol":
+            try:
+                inputs['data']['kernel_tol'] = test_pos_float(arg)
+            except ValueError:
+                raise InputError(opt, arg, "requires positive float!")
+        elif opt == "--plan":
+            try:
+                inputs['adv']['plan'] = test_enum(arg, Plan)
+            except ValueError:
+                raise InputError(opt, arg, "must be in [" + ", ".join(Plan.get_values()) + "]")
+        elif opt == "--max-memory":
+            try:
+                inputs['data']['max_memory'] = test_pos_float(arg)
+            except ValueError:
+                raise InputError(opt, arg, "requires positive float!")
+        elif opt == "--max-disk":
+            try:
+                inputs['data']['max_disk'] = test_pos_float(arg)
+            except ValueError:
+                raise InputError(opt, arg, "requires positive float!")
+        elif opt == "--max-hours":
+            try:
+                inputs['data']['max_hours'] = test_pos_float(arg)
+            except ValueError:
+                raise InputError(opt, arg, "requires positive float!")
+        elif opt == "--ffs-interfaces":
+            try:
+                inputs['data']['ffs_interfaces'] = test_interfaces(arg)
+            except ValueError:
+                raise InputError(opt, arg, "requires at least 2 increasing or decreasing floats between -1 and 1!")
+        elif opt == "--ffs-crossings":
+            try:
+                inputs['data']['ffs_crossings'] = test_pos_int(arg)
+            except ValueError:
+                raise InputError(opt, arg, "requires positive int!")
+        elif opt == "--ffs-trials":
+            try:
+                inputs['data']['ffs_trials'] = test_pos_int(arg)
+            except ValueError:
+                raise InputError(opt, arg, "requires positive int!")
+        elif opt == "--ffs-paths":
+            try:
+                inputs['data']['ffs_paths'] = test_nonneg_int(arg)
+            except ValueError:
+                raise InputError(opt, arg, "requires int of at least 0!")
+        elif opt == "--bank":
+            try:
+                inputs['data']['bank'] = test_emptystr(arg)
+            except ValueError:
+                raise InputError(opt, arg, "requires a directory!")
+        elif opt == "--burn-in":
+            try:
+                inputs['data']['burn_in'] = test_nonneg_int(arg)
+            except ValueError:
+                raise InputError(opt, arg, "requires int of at least 0!")
+        elif opt == "--queue":
+            try:
+                inputs['data']['queue'] = test_emptystr(arg)
+            except ValueError:
+                raise InputError(opt, arg, "requires a directory!")
+        elif opt == "--lease-timeout":
+            try:
+                inputs['data']['lease_timeout'] = test_pos_float(arg)
+            except ValueError:
+                raise InputError(opt, arg, "requires positive float!")
+        elif opt == "--seed":
+            try:
+                inputs['data']['seed'] = test_nonneg_int(arg)
+            except ValueError:
+                raise InputError(opt, arg, "requires int of at least 0!")
+        elif opt == "--stream":
+            try:
+                inputs['data']['stream'] = test_nonneg_int(arg)
+            except ValueError:
+                raise InputError(opt, arg, "requires int of at least 0!")
+        elif opt == "--crn":
+            inputs['data']['crn'] = True
+        elif opt == "--procs":
+            try:
+                inputs['data']['procs'] = test_pos_int(arg)
+            except ValueError:
+                raise InputError(opt, arg, "requires positive int!")
+        elif opt == "--write-queue":
+            try:
+                inputs['data']['write_queue'] = test_nonneg_int(arg)
+            except ValueError:
+                raise InputError(opt, arg, "requires int of at least 0!")
+        elif opt == "--backpressure":
+            try:
+                inputs['adv']['backpressure'] = test_enum(arg, Backpressure)
+            except ValueError:
+                raise InputError(opt, arg, "must be in [" + ", ".join(Backpressure.get_values()) + "]")
+        elif opt == "--compress":
+            inputs['adv']['compress'] = True
+        elif opt == "--live":
+            try:
+                inputs['data']['live'] = test_emptystr(arg)
+            except ValueError:
+                raise InputError(opt, arg, "requires a name!")
+        elif opt == "--telemetry":
+            try:
+                inputs['data']['telemetry'] = test_emptystr(arg)
+            except ValueError:
+                raise InputError(opt, arg, "requires a filename!")
+        elif opt == "--telemetry-interval":
+            try:
+                inputs['data']['telemetry_interval'] = test_pos_float(arg)
+            except ValueError:
+                raise InputError(opt, arg, "requires positive float!")
         else:
             raise InputError(opt, arg, "unrecognized opt!")
 
+    check_loci(inputs)
+    check_lineage(inputs)
+    check_spread(inputs)
+    check_bank(inputs)
+    check_ffs(inputs)
+    check_domains(inputs)
+
     return inputs
 
+def read_loci_file(filename):
+    '''
+    read_loci_file(filename)
+    read a file with one locus per line: <length> or <name> <length>
+    empty lines and lines starting with # are skipped
+    returns (lengths, names)
+    '''
+    lengths = []
+    names = []
+    with open(filename, "r") as fp:
+        for line in fp:
+            fields = line.split()
+            if len(fields) == 0 or fields[0].startswith("#"):
+                continue
+            if len(fields) == 1:
+                names.append("locus" + str(len(names)))
+                lengths.append(test_pos_int(fields[0]))
+            else:
+                names.append(fields[0])
+                lengths.append(test_pos_int(fields[1]))
+
+    if len(lengths) == 0:
+        raise ValueError
+
+    return lengths, names
+
+def read_recruit_file(filename):
+    '''
+    read_recruit_file(filename)
+    read a file with one recruitment site per line:
+    <center> <width> <start> <duration> [<period>]
+    empty lines and lines starting with # are skipped
+    returns a list of (center, width, start, duration, period)
+    '''
+    sites = []
+    with open(filename, "r") as fp:
+        for line in fp:
+            fields = line.split()
+            if len(fields) == 0 or fields[0].startswith("#"):
+                continue
+            if len(fields) not in (4, 5):
+                raise ValueError
+            values = [ test_nonneg_int(x) for x in fields ]
+            sites.append(tuple(values) if len(values) == 5 else tuple(values) + (0,))
+
+    if len(sites) == 0:
+        raise ValueError
+
+    return sites
+
+def check_loci(inputs):
+    '''
+    check_loci()
+    in multi-locus mode n is the total over all loci
+    options that act on a whole string of nucleosomes are not supported
+    '''
+    if inputs['data']['loci'] is None:
+        return
+
+    inputs['n'] = sum(inputs['data']['loci'])
+
+    if inputs['adv']['timestep'] != TimeStep.FIXED:
+        raise InputError("--timestep", TimeStep.enum_to_string(inputs['adv']['timestep']), "multiple loci need fixed timesteps!")
+    if inputs['adv']['stop']:
+        raise InputError("--stop", ",".join(Stop.enum_to_string(x) for x in inputs['adv']['stop']), "multiple loci cannot stop early!")
+    if inputs['adv']['domain'] == Domain.USER_SET:
+        raise InputError("--domain-set", inputs['data']['domain_sizes'], "multiple loci need equal or no domains!")
+    if inputs['data']['live'] is not None:
+        raise InputError("--live", inputs['data']['live'], "the live view shows a single locus!")
+    if inputs['adv']['domain'] == Domain.EQUAL_DEFAULT and inputs['data']['domains'] > min(inputs['data']['loci']):
+        raise InputError("--domain-equal", inputs['data']['domains'], "more domains than nucleosomes in a locus!")
+
+def check_lineage(inputs):
+    '''
+    check_lineage()
+    lineage mode needs divisions and simulates each cell with fixed timesteps
+    '''
+    if not inputs['adv']['lineage']:
+        return
+
+    if inputs['d'] == Divisions.NONE:
+        raise InputError("--lineage", "", "lineage mode needs divisions (-d)!")
+    if inputs['adv']['timestep'] != TimeStep.FIXED:
+        raise InputError("--timestep", TimeStep.enum_to_string(inputs['adv']['timestep']), "lineage mode needs fixed timesteps!")
+    if inputs['adv']['stop']:
+        raise InputError("--stop", ",".join(Stop.enum_to_string(x) for x in inputs['adv']['stop']), "lineages cannot stop early!")
+    if inputs['data']['loci'] is not None:
+        raise InputError("--loci", inputs['data']['loci'], "lineage mode simulates a single locus!")
+    if inputs['data']['live'] is not None:
+        raise InputError("--live", inputs['data']['live'], "the live view shows a single cell!")
+
+def check_bank(inputs):
+    '''
+    check_bank()
+    warm starts load the snapshot of a single locus into a Chromatin object
+    '''
+    if inputs['data']['bank'] is None:
+        return
+
+    if inputs['data']['loci'] is not None:
+        raise InputError("--loci", inputs['data']['loci'], "warm starts from a bank need a single locus!")
+    if inputs['adv']['lineage']:
+        raise InputError("--lineage", "", "warm starts from a bank do not follow lineages!")
+
+def check_bank_size(inputs):
+    '''
+    check_bank_size()
+    replica i of an ensemble starts from snapshot i, so the bank of every
+    screened point needs --replicas snapshots, or --replicas-max with
+    --precision
+    '''
+    if inputs['data']['bank'] is None:
+        return
+
+    if inputs['adv']['replicas'] == Replicas.FIXED:
+        opt, replicas = "--replicas", inputs['data']['replicas']
+    else:
+        opt, replicas = "--replicas-max", inputs['data']['replicas_max']
+
+    for config in Bank.bank_configs(inputs):
+        size = Bank.bank_size(config)
+        if size < replicas:
+            raise InputError(opt, replicas, Bank.get_dir(config) + " has only " + str(size) +
+                    " snapshots, create the bank with MainBank.py --replicas " + str(replicas) + " or more!")
+
+def check_ensemble_stop(inputs):
+    '''
+    check_ensemble_stop()
+    ensemble statistics need every timestep of every replica: absorbing and
+    plateau stops fill in the rest of a replica, a passage stop does not
+    and would leave it out of every later timestep
+    '''
+    if Stop.PASSAGE in inputs['adv']['stop']:
+        raise InputError("--stop", ",".join(Stop.enum_to_string(x) for x in inputs['adv']['stop']), "passage stops bias ensemble statistics, use absorb or plateau!")
+
+def check_ffs(inputs):
+    '''
+    check_ffs()
+    forward flux sampling checkpoints a single Chromatin object
+    '''
+    if inputs['data']['ffs_interfaces'] is None:
+        return
+
+    if inputs['data']['loci'] is not None:
+        raise InputError("--loci", inputs['data']['loci'], "forward flux sampling needs a single locus!")
+    if inputs['adv']['lineage']:
+        raise InputError("--lineage", "", "forward flux sampling does not follow lineages!")
+
+def check_spread(inputs):
+    '''
+    check_spread()
+    targeted spreading steps one fixed timestep at a time on a single locus
+    '''
+    if inputs['adv']['prob_spread'] != ProbSpread.POWERLAW:
+        return
+
+    if inputs['adv']['timestep'] != TimeStep.FIXED:
+        raise InputError("--timestep", TimeStep.enum_to_string(inputs['adv']['timestep']), "powerlaw spreading needs fixed timesteps!")
+    if inputs['data']['loci'] is not None:
+        raise InputError("--loci", inputs['data']['loci'], "powerlaw spreading simulates a single locus!")
+
+def check_domains(inputs):
+    '''
+    check_domains()
+    fill in default domain sizes and check that domains fit the nucleosomes
+    '''
+    n = inputs['n']
+
+    if inputs['data']['domain_sizes'] is None or inputs['adv']['domain'] != Domain.USER_SET:
+        inputs['data']['domain_sizes'] = [n // 2, n - n // 2]
+
+    if inputs['adv']['domain'] == Domain.EQUAL_DEFAULT:
+        if inputs['data']['domains'] > n:
+            raise InputError("--domain-equal", inputs['data']['domains'], "more domains than nucleosomes!")
+
+    if inputs['adv']['domain'] == Domain.USER_SET:
+        if sum(inputs['data']['domain_sizes']) != n:
+            raise InputError("--domain-set", inputs['data']['domain_sizes'], "domain sizes must add up to the number of nucleosomes!")
+
 def display_inputs(inputs):
     '''
     display_inputs()
@@ -252,37 +963,142 @@ def display_inputs(inputs):
     print("F-value:", inputs['f'])
     print("Init State:", States.enum_to_string(inputs['i']))
     print("Divisions:", inputs['d'])
+    print("Timesteps per cell cycle:", Constants.get_timesteps_per_cellcycle(inputs))
     print("Outfile:", inputs['o'])
+    print("Seed:", inputs['data']['seed'], "stream:", inputs['data']['stream'])
+    if inputs['data']['crn']:
+        print("Common random numbers: on")
+    if inputs['data']['bank'] is not None:
+        print("Warm start from bank:", inputs['data']['bank'])
+    if inputs['adv']['prob_spread'] != ProbSpread.RANDOM:
+        print("Spreading:", ProbSpread.enum_to_string(inputs['adv']['prob_spread']))
+    if inputs['adv']['domain'] != Domain.NONE:
+        print("Domains:", Domain.enum_to_string(inputs['adv']['domain']))
+    if inputs['adv']['domainbleed'] != DomainBleed.NONE:
+        print("Domain bleedthrough:", inputs['data']['domainbleed'])
+    if inputs['adv']['timestep'] == TimeStep.ADAPTIVE:
+        print("Adaptive timesteps, tolerance:", inputs['data']['tau_eps'])
+    if inputs['adv']['output'] == Output.EVENTS:
+        print("Event log output, keyframe every", inputs['data']['keyframe'], "timesteps")
+    if inputs['adv']['replicas'] == Replicas.ADAPTIVE:
+        print("Replicas:", inputs['data']['replicas_min'], "to", inputs['data']['replicas_max'], "precision:", inputs['data']['precision'])
+    if inputs['adv']['lineage']:
+        print("Lineage mode, at most", inputs['data']['lineage_max'], "cells per generation, sampling:", inputs['data']['lineage_sample'])
+    if inputs['data']['procs'] > 1:
+        print("Worker processes:", inputs['data']['procs'])
+    if inputs['adv']['kernel_precision'] != Precision.FLOAT64 or inputs['adv']['accumulate'] != Precision.FLOAT64:
+        print("Kernel precision:", Precision.enum_to_string(inputs['adv']['kernel_precision']), "accumulate:", Precision.enum_to_string(inputs['adv']['accumulate']))
+    if inputs['adv']['kernel'] != KernelRep.BLOCK:
+        print("Kernel:", KernelRep.enum_to_string(inputs['adv']['kernel']))
+    if inputs['adv']['kernel'] == KernelRep.HMATRIX:
+        print("Kernel tolerance:", inputs['data']['kernel_tol'])
+    if inputs['d'] != Divisions.NONE and inputs['adv']['division_replace'] != Replace.POISSON:
+        print("Division replacement:", Replace.enum_to_string(inputs['adv']['division_replace']))
+    if inputs['r'] != Recruit.NONE and (inputs['data']['recruit_centers'] is not None or inputs['data']['recruit_schedule'] is not None or inputs['data']['recruit_period'] > 0):
+        print("Recruitment sites:", ", ".join("/".join(str(x) for x in site) for site in Operators.get_sites(inputs)), "(center/width/start/duration/period)")
+    if inputs['adv']['compress']:
+        print("Compressed output")
+    if inputs['data']['live'] is not None:
+        print("Live view:", inputs['data']['live'])
+    if inputs['data']['telemetry'] is not None:
+        print("Telemetry:", inputs['data']['telemetry'], "every", inputs['data']['telemetry_interval'], "s")
+    if inputs['data']['loci'] is not None:
+        print("Loci:", len(inputs['data']['loci']), "lengths:", ",".join(str(x) for x in inputs['data']['loci']))
+    if inputs['adv']['stop']:
+        print("Stopping rules:", ", ".join(Stop.enum_to_string(x) for x in inputs['adv']['stop']))
     print("================================")
 
 
-def get_input():
+# short and long options, shared by get_input() and the library API
+SHORT_OPTS = "hn:t:f:i:do:r"
+LONG_OPTS = [
+    "help",
+    "nucleosomes=", 
+    "timesteps=",
+    "Fval=",
+    "initstate=",
+    "divisions",
+    "outfile=",
+    "recruit",
+    "prob-spread=",
+    "domain=",
+    "domain-equal=",
+    "domain-set=",
+    "domainbleed=",
+    "domainbleed-prob=",
+    "divisions-num=",
+    "prob-conv-mod=",
+    "recruit-time-init=",
+    "recruit-time=",
+    "recruit-n=",
+    "recruit-sites=",
+    "recruit-period=",
+    "recruit-file=",
+    "division-replace=",
+    "timestep=",
+    "tau-eps=",
+    "stop=",
+    "stop-window=",
+    "stop-tol=",
+    "stop-thresh=",
+    "replicas=",
+    "precision=",
+    "replicas-min=",
+    "replicas-max=",
+    "replica-batch=",
+    "output=",
+    "keyframe=",
+    "loci=",
+    "loci-file=",
+    "write-queue=",
+    "backpressure=",
+    "compress",
+    "telemetry=",
+    "live=",
+    "telemetry-interval=",
+    "lineage",
+    "lineage-max=",
+    "lineage-sample=",
+    "procs=",
+    "kernel-precision=",
+    "accumulate=",
+    "kernel=",
+    "kernel-tol=",
+    "plan=",
+    "max-memory=",
+    "max-disk=",
+    "max-hours=",
+    "ffs-interfaces=",
+    "ffs-crossings=",
+    "ffs-trials=",
+    "ffs-paths=",
+    "bank=",
+    "burn-in=",
+    "queue=",
+    "lease-timeout=",
+    "seed=",
+    "stream=",
+    "crn",
+    "screen-Fval=",
+    "screen-divisions=",
+    "screen-recruit-time-init=",
+    "screen-recruit-time=",
+    "screen-nucleosomes="
+    ]
+
+def get_input(argv=None, ensemble=False):
     '''
     get_input()
     handle the complicated command line input
+    reads sys.argv unless a list of arguments is given
+    with ensemble, the inputs are also checked for ensemble statistics
+    and the size of the snapshot bank
     '''
+    if argv is None:
+        argv = sys.argv[1:]
+
     try:
-        opts, args = getopt.getopt(sys.argv[1:], "hn:t:f:i:do:r", [
-            "help",
-            "nucleosomes=", 
-            "timesteps=",
-            "Fval=",
-            "initstate=",
-            "divisions",
-            "outfile=",
-            "recruit",
-            "prob-spread=",
-            "domain=",
-            "domain-equal=",
-            "domain-set=",
-            "domainbleed=",
-            "domainbleed-prob=",
-            "divisions-num=",
-            "prob-conv-mod=",
-            "recruit-time-init=",
-            "recruit-time=",
-            "recruit-n="
-            ])
+        opts, args = getopt.getopt(argv, SHORT_OPTS, LONG_OPTS)
     except getopt.GetoptError as err:
         print(str(err), file=sys.stderr)  
         usage()
@@ -290,6 +1106,9 @@ def get_input():
 
     try:
         inputs = parse_input(opts)
+        if ensemble:
+            check_ensemble_stop(inputs)
+            check_bank_size(inputs)
     except InputError as e:
         print(type(e).__name__ + ":", "Opt [", e.opt, "] arg [", e.arg, "]:", e.msg, file=sys.stderr)
         usage()
@@ -298,7 +1117,7 @@ def get_input():
         usage()
         sys.exit(2)
     except RuntimeError as e:
-        print(type(e).__name__ + ":", e.arg)
+        print(type(e).__name__ + ":", *e.args)
         sys.exit(2)
 
     if inputs['o'] == "":
@@ -306,12 +1125,4 @@ def get_input():
 
     display_inputs(inputs)
 
-    if inputs['d'] != Divisions.NONE:
-        Constants.TIMESTEPS_PER_CELLCYCLE = inputs['data']['divisions']
-    else:
-        Constants.TIMESTEPS_PER_CELLCYCLE = inputs['t']
-
-    print("global:",Constants.TIMESTEPS_PER_CELLCYCLE)
-
     return inputs
-
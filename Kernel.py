@@ -0,0 +1,846 @@
+## Kernel.py
+## Author: Aparna Rajpurkar
+
+# imports
+import numpy as np
+import Constants
+from MyEnum import Domain, DomainBleed, Precision, KernelRep
+
+# block-structured feedback kernel
+# a nucleosome only feels nucleosomes in its own domain and, with bleedthrough,
+# in the two neighbouring domains. Instead of a dense n x n matrix, we store
+# one dense block per domain: rows = nucleosomes of the domain,
+# columns = the window of nucleosomes the domain can feel.
+# blocks can be stored in reduced precision: float32, float16, or uint16
+# with one scale per block. Fields are accumulated in float64 or float32.
+# strings too long for any block storage use a RowKernel, which computes
+# the rows it needs on every call instead, or an HMatrixKernel, which stores
+# every block as a hierarchical matrix: dense near the diagonal, low-rank
+# factors (adaptive cross approximation) for pairs of clusters far apart,
+# to a relative tolerance.
+
+# numpy types of the precision options
+DTYPES = {
+        Precision.FLOAT64:np.float64,
+        Precision.FLOAT32:np.float32,
+        Precision.FLOAT16:np.float16,
+        Precision.UINT16:np.uint16
+        }
+
+# densities of M (or A) nucleosomes used to check the fields of reduced kernels
+CHECK_DENSITIES = (0.1, 0.5, 0.9)
+
+# hierarchical kernels: default relative tolerance of the low-rank factors,
+# largest dense block, and admissibility: clusters are compressed if the
+# smaller one is at most HM_ETA times their distance
+HM_TOL = 1e-6
+HM_LEAF = 32
+HM_ETA = 1
+
+# for planning: entries an HBlock stores per row and level of its cluster
+# tree below the dense leaves (measured at the default tolerance), and bytes
+# per stored entry with its indicies
+HM_LEVEL_ENTRIES = 16
+HM_ENTRY_BYTES = 14
+
+def domain_limits(domain_enum, n, num_domains, domain_sizes):
+    '''
+    domain_limits(DOMAIN_ENUM, N_nucs, number_of_domains, list_of_domain_sizes)
+    return a list of (left_limit, right_limit) tuples, one per domain
+    limits follow the convention of the Nucleosome class
+    '''
+    if domain_enum == Domain.NONE:
+        # the whole string is one domain
+        # NOTE: the right limit is n, not n - 1, as it always has been
+        return [(0, n)]
+
+    if domain_enum == Domain.EQUAL_DEFAULT:
+        # equal sized domains; any leftover nucleosomes form a last, smaller domain
+        size = n // num_domains
+        limits = []
+        for low in range(0, n, size):
+            limits.append((low, min(low + size - 1, n - 1)))
+        return limits
+
+    if domain_enum == Domain.USER_SET:
+        # user-set sizes, must add up to n
+        limits = []
+        low = 0
+        for size in domain_sizes:
+            limits.append((low, low + size - 1))
+            low += size
+        return limits
+
+def quantize(block, storage):
+    '''
+    quantize(float64_block, PRECISION_ENUM)
+    store a block in reduced precision
+    returns (stored_block, scale); the probabilities are stored_block * scale
+    '''
+    if storage != Precision.UINT16:
+        return block.astype(DTYPES[storage]), 1.0
+
+    # uint16 with one scale per block, so the largest value uses the full range
+    top = block.max() if block.size > 0 else 0
+    scale = top / np.iinfo(np.uint16).max if top > 0 else 1.0
+    return np.rint(block / scale).astype(np.uint16), scale
+
+def calc_prob_block(targets, sources, left, right, ext_left, ext_right, db_val):
+    '''
+    calc_prob_block(target_indicies, source_indicies, left, right, extreme_left, extreme_right, bleed_prob)
+    vectorized probability calculation for every (target, source) pair
+    where all targets belong to the domain [left, right] and
+    [extreme_left, extreme_right] is the window including bleedthrough
+    '''
+    i = np.asarray(targets, dtype=float)[:, None]
+    j = np.asarray(sources, dtype=float)[None, :]
+
+    block = np.zeros(shape=(i.shape[0], j.shape[1]))
+
+    # powerlaw.ppf(0) is 0, so empty denominators are masked out below
+    with np.errstate(divide='ignore', invalid='ignore'):
+        regions = (
+                # inside the domain, to the left and right of the target
+                ((j >= left) & (j < i), (i - j) / (i - left), 1),
+                ((j > i) & (j <= right), (j - i) / (right - i), 1),
+                # bleedthrough into the neighbouring domains
+                ((j >= ext_left) & (j < left), (i - j) / (i - ext_left), db_val),
+                ((j > right) & (j <= ext_right), (j - i) / (ext_right - i), db_val),
+                )
+
+        for mask, frac, scale in regions:
+            if not mask.any():
+                continue
+            prob = scale * Constants.powerlaw_ppf(np.where(mask, frac, 0), Constants.POWER)
+            block = np.where(mask, prob, block)
+
+    return block
+
+def domain_windows(n, limits, db_enum):
+    '''
+    domain_windows(N_nucs, limits, DOMAINBLEED_ENUM)
+    per domain: (left, right, extreme_left, extreme_right, first row,
+    last row + 1, first column, last column + 1) of its kernel block
+    '''
+    windows = []
+    for d in range(len(limits)):
+        left, right = limits[d]
+
+        # windows including bleedthrough
+        ext_left = left
+        ext_right = right
+        if db_enum != DomainBleed.NONE:
+            if d > 0:
+                ext_left = limits[d - 1][0]
+            if d < len(limits) - 1:
+                ext_right = limits[d + 1][1]
+
+        windows.append((left, right, ext_left, ext_right,
+            left, min(right, n - 1) + 1, ext_left, min(ext_right, n - 1) + 1))
+
+    return windows
+
+def block_key(left, right, ext_left, ext_right, row_lo, row_hi, col_lo, col_hi):
+    '''
+    block_key(domain_window)
+    the block only depends on positions relative to the domain
+    '''
+    return (left - ext_left, right - left, ext_right - right, row_hi - row_lo, col_hi - col_lo)
+
+def block_shapes(n, limits, db_enum):
+    '''
+    block_shapes(N_nucs, limits, DOMAINBLEED_ENUM)
+    (rows, columns) of every distinct block of a BlockKernel, without building it
+    '''
+    shapes = {}
+    for window in domain_windows(n, limits, db_enum):
+        row_lo, row_hi, col_lo, col_hi = window[4:]
+        shapes[block_key(*window)] = (row_hi - row_lo, col_hi - col_lo)
+    return list(shapes.values())
+
+def touched_domains(domain_of, num_domains, cols):
+    '''
+    touched_domains(domain_of, number_of_domains, nucleosome_indicies)
+    domains whose window may include cols: their own and the neighbouring
+    ones, which reach into them with bleedthrough
+    '''
+    if num_domains == 1:
+        return [ 0 ]
+    doms = domain_of[cols]
+    return np.unique(np.clip(np.r_[doms - 1, doms, doms + 1], 0, num_domains - 1))
+
+class BlockKernel:
+    '''
+    BlockKernel class
+    stores the feedback probabilities as one dense block per domain
+    and computes the feedback field of any set of nucleosomes
+    '''
+
+    def __init__(self, n, limits, db_enum, db_val, storage=Precision.FLOAT64, accumulate=Precision.FLOAT64):
+        '''
+        initialization function
+        '''
+        self.n = n
+        self.storage = storage
+        self.acc = DTYPES[accumulate]
+
+        # which domain each nucleosome belongs to
+        self.domain_of = np.zeros(shape=(n), dtype=np.intp)
+
+        # per domain: (first row, first column, last column + 1, block)
+        # and the scale of the block
+        self.blocks = []
+        self.scales = []
+
+        # identical domains (same size and same neighbour sizes) share a block
+        cache = {}
+
+        for d, (left, right, ext_left, ext_right, row_lo, row_hi, col_lo, col_hi) in enumerate(domain_windows(n, limits, db_enum)):
+            self.domain_of[row_lo:row_hi] = d
+
+            key = block_key(left, right, ext_left, ext_right, row_lo, row_hi, col_lo, col_hi)
+            if key not in cache:
+                cache[key] = quantize(calc_prob_block(
+                        range(row_lo, row_hi), range(col_lo, col_hi),
+                        left, right, ext_left, ext_right, db_val
+                        ), storage)
+
+            block, scale = cache[key]
+            self.blocks.append((row_lo, col_lo, col_hi, block))
+            self.scales.append(scale)
+
+        self.nbytes = sum(b.nbytes for b, scale in cache.values())
+
+    def dot(self, k, sub, vec):
+        '''
+        dot(block_number, block_rows, state_window)
+        rows of block k times the states, in the accumulation precision
+        '''
+        acc = self.acc
+        return (sub.astype(acc, copy=False) @ vec.astype(acc, copy=False)) * self.scales[k]
+
+    def field(self, rows, vec):
+        '''
+        field(nucleosome_indicies, state_array)
+        for each nucleosome in rows, sum the kernel against the state array
+        only the window of each nucleosome's domain is touched
+        '''
+        rows = np.asarray(rows, dtype=np.intp)
+        out = np.zeros(shape=(len(rows)))
+
+        if len(rows) == 0:
+            return out
+
+        # fast path: a single domain
+        if len(self.blocks) == 1:
+            row_lo, col_lo, col_hi, block = self.blocks[0]
+            out[:] = self.dot(0, block[rows - row_lo], vec[col_lo:col_hi])
+            return out
+
+        # group rows by domain
+        doms = self.domain_of[rows]
+        order = np.argsort(doms, kind='stable')
+        doms_sorted = doms[order]
+        starts = np.flatnonzero(np.r_[True, doms_sorted[1:] != doms_sorted[:-1]])
+        ends = np.r_[starts[1:], len(order)]
+
+        for s, e in zip(starts, ends):
+            k = doms_sorted[s]
+            row_lo, col_lo, col_hi, block = self.blocks[k]
+            idx = order[s:e]
+            out[idx] = self.dot(k, block[rows[idx] - row_lo], vec[col_lo:col_hi])
+
+        return out
+
+    def column_field(self, cols, vals):
+        '''
+        column_field(nucleosome_indicies, values)
+        field of every nucleosome from a state array that is vals at cols
+        and zero elsewhere. Only the kernel columns of cols are touched, so
+        a few changed nucleosomes update a field of the whole string cheaply
+        '''
+        cols = np.asarray(cols, dtype=np.intp)
+        vals = np.asarray(vals)
+        out = np.zeros(shape=(self.n))
+
+        if len(cols) == 0:
+            return out
+
+        for k in touched_domains(self.domain_of, len(self.blocks), cols):
+            row_lo, col_lo, col_hi, block = self.blocks[k]
+            inside = (cols >= col_lo) & (cols < col_hi)
+            if inside.any():
+                out[row_lo:row_lo + block.shape[0]] += self.dot(k, block[:, cols[inside] - col_lo], vals[inside])
+
+        return out
+
+    def field_gather(self, rows, vec, base):
+        '''
+        field_gather(nucleosome_indicies, state_array, string_offsets)
+        like field(), for many strings of this length stored one after
+        another in vec: row k is nucleosome rows[k] of the string
+        that starts at vec[base[k]]
+        '''
+        rows = np.asarray(rows, dtype=np.intp)
+        base = np.asarray(base, dtype=np.intp)
+        out = np.zeros(shape=(len(rows)))
+
+        if len(rows) == 0:
+            return out
+
+        # group rows by domain
+        doms = self.domain_of[rows]
+        order = np.argsort(doms, kind='stable')
+        doms_sorted = doms[order]
+        starts = np.flatnonzero(np.r_[True, doms_sorted[1:] != doms_sorted[:-1]])
+        ends = np.r_[starts[1:], len(order)]
+
+        for s, e in zip(starts, ends):
+            k = doms_sorted[s]
+            row_lo, col_lo, col_hi, block = self.blocks[k]
+            idx = order[s:e]
+            cols = base[idx, None] + np.arange(col_lo, col_hi)
+            sub = block[rows[idx] - row_lo].astype(self.acc, copy=False)
+            out[idx] = np.einsum('ij,ij->i', sub, vec[cols].astype(self.acc, copy=False)) * self.scales[k]
+
+        return out
+
+    def to_dense(self):
+        '''
+        to_dense()
+        expand into a full n x n matrix. For inspection only
+        '''
+        dense = np.zeros(shape=(self.n, self.n))
+        for (row_lo, col_lo, col_hi, block), scale in zip(self.blocks, self.scales):
+            dense[row_lo:row_lo + block.shape[0], col_lo:col_hi] = block.astype(np.float64) * scale
+        return dense
+
+class RowKernel:
+    '''
+    RowKernel class
+    stores nothing: the kernel rows of the nucleosomes that need a field
+    are computed when the field is asked for. For strings whose blocks
+    do not fit in memory; costs one kernel row per feedback event
+    '''
+
+    def __init__(self, n, limits, db_enum, db_val, accumulate=Precision.FLOAT64):
+        '''
+        initialization function
+        '''
+        self.n = n
+        self.storage = Precision.FLOAT64
+        self.acc = DTYPES[accumulate]
+        self.db_val = db_val
+        self.windows = domain_windows(n, limits, db_enum)
+        self.nbytes = 0
+
+        self.domain_of = np.zeros(shape=(n), dtype=np.intp)
+        for d, window in enumerate(self.windows):
+            self.domain_of[window[4]:window[5]] = d
+
+        # the rows of the last call; the M and A fields of a timestep use the same rows
+        self.last_rows = None
+        self.last_subs = None
+
+    def rows_by_domain(self, rows):
+        '''
+        rows_by_domain(nucleosome_indicies)
+        returns a list of (domain, positions in rows, kernel rows)
+        '''
+        key = rows.tobytes()
+        if key == self.last_rows:
+            return self.last_subs
+
+        doms = self.domain_of[rows]
+        order = np.argsort(doms, kind='stable')
+        doms_sorted = doms[order]
+        starts = np.flatnonzero(np.r_[True, doms_sorted[1:] != doms_sorted[:-1]])
+        ends = np.r_[starts[1:], len(order)]
+
+        subs = []
+        for s, e in zip(starts, ends):
+            d = doms_sorted[s]
+            left, right, ext_left, ext_right, row_lo, row_hi, col_lo, col_hi = self.windows[d]
+            idx = order[s:e]
+            sub = calc_prob_block(rows[idx], range(col_lo, col_hi), left, right, ext_left, ext_right, self.db_val)
+            subs.append((d, idx, sub.astype(self.acc, copy=False)))
+
+        self.last_rows = key
+        self.last_subs = subs
+        return subs
+
+    def field(self, rows, vec):
+        '''
+        field(nucleosome_indicies, state_array)
+        as BlockKernel.field()
+        '''
+        rows = np.asarray(rows, dtype=np.intp)
+        out = np.zeros(shape=(len(rows)))
+
+        if len(rows) == 0:
+            return out
+
+        for d, idx, sub in self.rows_by_domain(rows):
+            col_lo, col_hi = self.windows[d][6:]
+            out[idx] = sub @ vec[col_lo:col_hi].astype(self.acc, copy=False)
+
+        return out
+
+    def column_field(self, cols, vals):
+        '''
+        column_field(nucleosome_indicies, values)
+        as BlockKernel.column_field(), computing the kernel columns of cols
+        '''
+        cols = np.asarray(cols, dtype=np.intp)
+        vals = np.asarray(vals)
+        out = np.zeros(shape=(self.n))
+
+        if len(cols) == 0:
+            return out
+
+        for d in touched_domains(self.domain_of, len(self.windows), cols):
+            left, right, ext_left, ext_right, row_lo, row_hi, col_lo, col_hi = self.windows[d]
+            inside = (cols >= col_lo) & (cols < col_hi)
+            if inside.any():
+                sub = calc_prob_block(range(row_lo, row_hi), cols[inside], left, right, ext_left, ext_right, self.db_val)
+                out[row_lo:row_hi] += sub.astype(self.acc, copy=False) @ vals[inside].astype(self.acc, copy=False)
+
+        return out
+
+    def field_gather(self, rows, vec, base):
+        '''
+        field_gather(nucleosome_indicies, state_array, string_offsets)
+        as BlockKernel.field_gather()
+        '''
+        rows = np.asarray(rows, dtype=np.intp)
+        base = np.asarray(base, dtype=np.intp)
+        out = np.zeros(shape=(len(rows)))
+
+        if len(rows) == 0:
+            return out
+
+        for d, idx, sub in self.rows_by_domain(rows):
+            col_lo, col_hi = self.windows[d][6:]
+            cols = base[idx, None] + np.arange(col_lo, col_hi)
+            out[idx] = np.einsum('ij,ij->i', sub, vec[cols].astype(self.acc, copy=False))
+
+        return out
+
+    def to_dense(self):
+        '''
+        to_dense()
+        expand into a full n x n matrix. For inspection only
+        '''
+        dense = np.zeros(shape=(self.n, self.n))
+        for left, right, ext_left, ext_right, row_lo, row_hi, col_lo, col_hi in self.windows:
+            dense[row_lo:row_hi, col_lo:col_hi] = calc_prob_block(
+                    range(row_lo, row_hi), range(col_lo, col_hi), left, right, ext_left, ext_right, self.db_val)
+        return dense
+
+def aca(get_row, get_col, m, c, tol, max_rank):
+    '''
+    aca(row_function, column_function, rows, columns, tolerance, max_rank)
+    adaptive cross approximation with partial pivoting: a low-rank
+    approximation U V^T of an m x c block from a few of its rows and columns,
+    recompressed to the tolerance (relative, in the Frobenius norm)
+    returns (U, V), or None if the block needs more than max_rank terms
+    '''
+    us = []
+    vs = []
+    used = np.zeros(shape=(m), dtype=bool)
+    norm2 = 0.0
+    i = 0
+
+    while len(us) < max_rank:
+        used[i] = True
+        row = get_row(i)
+        for u, v in zip(us, vs):
+            row -= u[i] * v
+        j = np.argmax(np.abs(row))
+
+        if row[j] == 0:
+            # the residual of this row is zero: try the next unused row
+            if used.all():
+                break
+            i = np.argmin(used)
+            continue
+
+        v = row / row[j]
+        u = get_col(j)
+        for uk, vk in zip(us, vs):
+            u -= vk[j] * uk
+
+        # Frobenius norm of the approximation, updated with the new term
+        norm2 += (u @ u) * (v @ v) + 2 * sum((uk @ u) * (vk @ v) for uk, vk in zip(us, vs))
+        us.append(u)
+        vs.append(v)
+
+        if np.sqrt((u @ u) * (v @ v)) <= tol * np.sqrt(norm2) or used.all():
+            break
+
+        # next pivot row: largest residual entry of the new column
+        i = np.argmax(np.where(used, -1, np.abs(u)))
+    else:
+        return None
+
+    if len(us) == 0:
+        return np.zeros(shape=(m, 0)), np.zeros(shape=(c, 0))
+
+    # the cross terms are not orthogonal: recompress with a small SVD
+    qu, ru = np.linalg.qr(np.array(us).T)
+    qv, rv = np.linalg.qr(np.array(vs).T)
+    w, s, zt = np.linalg.svd(ru @ rv.T)
+    tail = np.sqrt(np.cumsum(s[::-1] ** 2))[::-1]
+    rank = max(1, int(np.count_nonzero(tail > tol * tail[0])))
+
+    return qu @ (w[:, :rank] * s[:rank]), qv @ zt[:rank].T
+
+def csr_dot(ptr, index, values, rows, vec):
+    '''
+    csr_dot(row_pointers, column_indicies, values, rows, vector)
+    rows of a sparse matrix in compressed row form times a vector
+    '''
+    starts = ptr[rows]
+    lengths = ptr[rows + 1] - starts
+    owner = np.repeat(np.arange(len(rows)), lengths)
+    pos = np.arange(owner.shape[0]) + np.repeat(starts - (np.cumsum(lengths) - lengths), lengths)
+    return np.bincount(owner, weights=values[pos] * vec[index[pos]], minlength=len(rows))
+
+def to_csr(rows, index, values, m):
+    '''
+    to_csr(row_indicies, column_indicies, values, number_of_rows)
+    compressed row form of entries in any order
+    '''
+    order = np.argsort(rows, kind='stable')
+    ptr = np.r_[0, np.cumsum(np.bincount(rows, minlength=m))].astype(np.intp)
+    return ptr, index[order].astype(np.int32), values[order]
+
+def hmatrix_entries(rows, cols):
+    '''
+    hmatrix_entries(rows, columns)
+    estimate of the entries an HBlock of this shape stores, without building it:
+    three dense leaves per row near the diagonal and a few low-rank terms per level
+    '''
+    levels = max(np.log2(cols / HM_LEAF), 0)
+    return min(rows * cols, int(rows * (3 * HM_LEAF + HM_LEVEL_ENTRIES * levels)))
+
+class HBlock:
+    '''
+    HBlock class
+    one kernel block (rows of a domain, columns of its window) as a
+    hierarchical matrix: the rows and columns are bisected recursively,
+    pairs of clusters that are far apart compared to their size are stored
+    as low-rank factors U V^T, the pairs near the diagonal as small dense
+    blocks. Dense entries and U are kept in compressed row form, V as
+    (slot, column, value) triplets, so a field is two gathers and bincounts
+    '''
+
+    def __init__(self, left, right, ext_left, ext_right, row_lo, row_hi, col_lo, col_hi, db_val, tol):
+        '''
+        initialization function
+        '''
+        self.window = (left, right, ext_left, ext_right)
+        self.row_lo = row_lo
+        self.col_lo = col_lo
+        self.db_val = db_val
+        self.tol = tol
+        self.m = row_hi - row_lo
+        self.c = col_hi - col_lo
+
+        # the kernel has a different formula left of the domain, in it and
+        # right of it: clusters of columns never straddle these pieces
+        self.pieces = [ p - col_lo for p in (left, right + 1) if col_lo < p < col_hi ]
+
+        self.dense = []
+        self.factors = []
+        self.build(0, self.m, 0, self.c)
+        self.pack()
+
+    def entries(self, r0, r1, c0, c1):
+        '''
+        entries(first_row, last_row + 1, first_column, last_column + 1)
+        sub-block of the kernel block, in local coordinates
+        '''
+        return calc_prob_block(range(self.row_lo + r0, self.row_lo + r1),
+                range(self.col_lo + c0, self.col_lo + c1), *self.window, self.db_val)
+
+    def build(self, r0, r1, c0, c1):
+        '''
+        build(first_row, last_row + 1, first_column, last_column + 1)
+        store the sub-block, compressed if its clusters are far apart
+        '''
+        for p in self.pieces:
+            if c0 < p < c1:
+                self.build(r0, r1, c0, p)
+                self.build(r0, r1, p, c1)
+                return
+
+        rows = r1 - r0
+        cols = c1 - c0
+
+        # distance between the clusters, in nucleosomes
+        lo = self.row_lo + r0
+        hi = self.row_lo + r1 - 1
+        gap = max(self.col_lo + c0 - hi, lo - (self.col_lo + c1 - 1), 0)
+
+        if gap > 0 and min(rows, cols) <= HM_ETA * gap:
+            max_rank = rows * cols // (rows + cols)
+            uv = aca(lambda i: self.entries(r0 + i, r0 + i + 1, c0, c1)[0],
+                    lambda j: self.entries(r0, r1, c0 + j, c0 + j + 1)[:, 0],
+                    rows, cols, self.tol, max_rank)
+            if uv is not None:
+                self.factors.append((r0, c0, uv[0], uv[1]))
+                return
+
+        if rows <= HM_LEAF and cols <= HM_LEAF:
+            self.dense.append((r0, c0, self.entries(r0, r1, c0, c1)))
+            return
+
+        row_splits = (r0, (r0 + r1) // 2, r1) if rows > HM_LEAF else (r0, r1)
+        col_splits = (c0, (c0 + c1) // 2, c1) if cols > HM_LEAF else (c0, c1)
+        for a, b in zip(row_splits[:-1], row_splits[1:]):
+            for x, y in zip(col_splits[:-1], col_splits[1:]):
+                self.build(a, b, x, y)
+
+    def pack(self):
+        '''
+        pack()
+        flatten the dense blocks and factors into index arrays
+        '''
+        rows = []
+        cols = []
+        vals = []
+        for r0, c0, block in self.dense:
+            r, c = np.indices(block.shape)
+            rows.append((r0 + r).ravel())
+            cols.append((c0 + c).ravel())
+            vals.append(block.ravel())
+        self.d_ptr, self.d_col, self.d_val = to_csr(
+                np.concatenate(rows + [ np.zeros(shape=(0), dtype=np.intp) ]),
+                np.concatenate(cols + [ np.zeros(shape=(0), dtype=np.intp) ]),
+                np.concatenate(vals + [ np.zeros(shape=(0)) ]), self.m)
+
+        # every rank one term of every factor has a slot: V^T vec of the
+        # slots first, then the U rows of the requested nucleosomes
+        u_rows = []
+        u_slots = []
+        u_vals = []
+        v_slots = []
+        v_cols = []
+        v_vals = []
+        slot = 0
+        for r0, c0, u, v in self.factors:
+            rank = u.shape[1]
+            slots = slot + np.arange(rank)
+            u_rows.append(np.repeat(np.arange(r0, r0 + u.shape[0]), rank))
+            u_slots.append(np.tile(slots, u.shape[0]))
+            u_vals.append(u.ravel())
+            v_slots.append(np.repeat(slots, v.shape[0]))
+            v_cols.append(np.tile(np.arange(c0, c0 + v.shape[0]), rank))
+            v_vals.append(v.T.ravel())
+            slot += rank
+        self.slots = slot
+
+        empty = [ np.zeros(shape=(0), dtype=np.intp) ]
+        self.u_ptr, self.u_slot, self.u_val = to_csr(
+                np.concatenate(u_rows + empty), np.concatenate(u_slots + empty),
+                np.concatenate(u_vals + [ np.zeros(shape=(0)) ]), self.m)
+        self.v_slot = np.concatenate(v_slots + empty).astype(np.int32)
+        self.v_col = np.concatenate(v_cols + empty).astype(np.int32)
+        self.v_val = np.concatenate(v_vals + [ np.zeros(shape=(0)) ])
+
+        self.max_rank = max([ u.shape[1] for r0, c0, u, v in self.factors ] + [ 0 ])
+        self.entries_stored = self.d_val.size + self.u_val.size + self.v_val.size
+        self.nbytes = sum(a.nbytes for a in (self.d_ptr, self.d_col, self.d_val,
+            self.u_ptr, self.u_slot, self.u_val, self.v_slot, self.v_col, self.v_val))
+
+        # the build lists are not needed any more
+        self.dense = None
+        self.factors = None
+
+    def dot(self, rows, vec):
+        '''
+        dot(local_rows, window_states)
+        rows of the block times the states of its window
+        '''
+        vec = vec.astype(np.float64, copy=False)
+        far = np.bincount(self.v_slot, weights=self.v_val * vec[self.v_col], minlength=self.slots)
+        return csr_dot(self.d_ptr, self.d_col, self.d_val, rows, vec) + \
+                csr_dot(self.u_ptr, self.u_slot, self.u_val, rows, far)
+
+    def to_dense(self):
+        '''
+        to_dense()
+        expand into the full block. For inspection only
+        '''
+        dense = np.zeros(shape=(self.m, self.c))
+        dense[np.repeat(np.arange(self.m), np.diff(self.d_ptr)), self.d_col] = self.d_val
+
+        u = np.zeros(shape=(self.m, self.slots))
+        u[np.repeat(np.arange(self.m), np.diff(self.u_ptr)), self.u_slot] = self.u_val
+        v = np.zeros(shape=(self.slots, self.c))
+        v[self.v_slot, self.v_col] = self.v_val
+
+        return dense + u @ v
+
+class HMatrixKernel:
+    '''
+    HMatrixKernel class
+    as BlockKernel, with every distinct block stored as an HBlock compressed
+    to a relative tolerance. Memory and the cost of a field over the whole
+    string grow like n log n instead of n times the window
+    '''
+
+    def __init__(self, n, limits, db_enum, db_val, tol=HM_TOL):
+        '''
+        initialization function
+        '''
+        self.n = n
+        self.storage = Precision.FLOAT64
+        self.acc = np.float64
+        self.tol = tol
+
+        self.domain_of = np.zeros(shape=(n), dtype=np.intp)
+        self.blocks = []
+
+        cache = {}
+        for d, window in enumerate(domain_windows(n, limits, db_enum)):
+            row_lo, row_hi, col_lo, col_hi = window[4:]
+            self.domain_of[row_lo:row_hi] = d
+
+            key = block_key(*window)
+            if key not in cache:
+                cache[key] = HBlock(*window, db_val, tol)
+            self.blocks.append((row_lo, col_lo, col_hi, cache[key]))
+
+        self.nbytes = sum(b.nbytes for b in cache.values())
+        # entries stored, and entries of the same blocks stored dense
+        self.entries = sum(b.entries_stored for b in cache.values())
+        self.dense_entries = sum(b.m * b.c for b in cache.values())
+        self.max_rank = max(b.max_rank for b in cache.values())
+
+    def groups(self, rows):
+        '''
+        groups(nucleosome_indicies)
+        (block number, positions in rows) of every domain with rows
+        '''
+        doms = self.domain_of[rows]
+        order = np.argsort(doms, kind='stable')
+        doms_sorted = doms[order]
+        starts = np.flatnonzero(np.r_[True, doms_sorted[1:] != doms_sorted[:-1]])
+        ends = np.r_[starts[1:], len(order)]
+        return [ (doms_sorted[s], order[s:e]) for s, e in zip(starts, ends) ]
+
+    def field(self, rows, vec):
+        '''
+        field(nucleosome_indicies, state_array)
+        as BlockKernel.field()
+        '''
+        rows = np.asarray(rows, dtype=np.intp)
+        out = np.zeros(shape=(len(rows)))
+
+        if len(rows) == 0:
+            return out
+
+        for k, idx in self.groups(rows):
+            row_lo, col_lo, col_hi, block = self.blocks[k]
+            out[idx] = block.dot(rows[idx] - row_lo, vec[col_lo:col_hi])
+
+        return out
+
+    def column_field(self, cols, vals):
+        '''
+        column_field(nucleosome_indicies, values)
+        as BlockKernel.column_field(). The far field factors are summed over
+        the whole window of every touched domain, which costs no more than a
+        field of its rows
+        '''
+        cols = np.asarray(cols, dtype=np.intp)
+        out = np.zeros(shape=(self.n))
+
+        if len(cols) == 0:
+            return out
+
+        for k in touched_domains(self.domain_of, len(self.blocks), cols):
+            row_lo, col_lo, col_hi, block = self.blocks[k]
+            inside = (cols >= col_lo) & (cols < col_hi)
+            if inside.any():
+                vec = np.zeros(shape=(col_hi - col_lo))
+                vec[cols[inside] - col_lo] = np.asarray(vals)[inside]
+                out[row_lo:row_lo + block.m] += block.dot(np.arange(block.m), vec)
+
+        return out
+
+    def field_gather(self, rows, vec, base):
+        '''
+        field_gather(nucleosome_indicies, state_array, string_offsets)
+        as BlockKernel.field_gather()
+        '''
+        rows = np.asarray(rows, dtype=np.intp)
+        base = np.asarray(base, dtype=np.intp)
+        out = np.zeros(shape=(len(rows)))
+
+        if len(rows) == 0:
+            return out
+
+        for k, idx in self.groups(rows):
+            row_lo, col_lo, col_hi, block = self.blocks[k]
+            # one product per string
+            for b in np.unique(base[idx]):
+                sel = idx[base[idx] == b]
+                out[sel] = block.dot(rows[sel] - row_lo, vec[b + col_lo:b + col_hi])
+
+        return out
+
+    def to_dense(self):
+        '''
+        to_dense()
+        expand into a full n x n matrix. For inspection only
+        '''
+        dense = np.zeros(shape=(self.n, self.n))
+        expanded = {}
+        for row_lo, col_lo, col_hi, block in self.blocks:
+            if id(block) not in expanded:
+                expanded[id(block)] = block.to_dense()
+            dense[row_lo:row_lo + block.m, col_lo:col_hi] = expanded[id(block)]
+        return dense
+
+def make_kernel(n, limits, db_enum, db_val, adv, tol=HM_TOL):
+    '''
+    make_kernel(N_nucs, limits, DOMAINBLEED_ENUM, bleed_prob, advanced_inputs, hmatrix_tolerance)
+    the kernel representation and precision chosen in the inputs
+    '''
+    if adv['kernel'] == KernelRep.ROWS:
+        return RowKernel(n, limits, db_enum, db_val, adv['accumulate'])
+    if adv['kernel'] == KernelRep.HMATRIX:
+        return HMatrixKernel(n, limits, db_enum, db_val, tol)
+    return BlockKernel(n, limits, db_enum, db_val, adv['kernel_precision'], adv['accumulate'])
+
+def precision_report(reference, kernel, samples, np_rng):
+    '''
+    precision_report(float64_kernel, reduced_kernel, samples_per_density, generator)
+    drift of the feedback transition probabilities (field / n, as in
+    Chromatin.step_events()) of a reduced precision kernel, for random
+    states with several densities of M (or A) nucleosomes
+    returns a list of (density, max abs error, mean abs error, max relative error)
+    '''
+    n = reference.n
+    rows = np.arange(n)
+    report = []
+
+    for density in CHECK_DENSITIES:
+        abs_err = []
+        rel_err = []
+        for s in range(samples):
+            mask = (np_rng.random(n) < density).astype(np.uint8)
+            exact = reference.field(rows, mask) / n
+            approx = kernel.field(rows, mask) / n
+            diff = np.abs(approx - exact)
+            abs_err.append(diff)
+            rel_err.append(diff[exact > 0] / exact[exact > 0])
+
+        abs_err = np.concatenate(abs_err)
+        rel_err = np.concatenate(rel_err)
+        report.append((density, abs_err.max(), abs_err.mean(), rel_err.max() if len(rel_err) > 0 else 0))
+
+    return report
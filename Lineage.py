@@ -0,0 +1,242 @@
+## Lineage.py
+## Author: Aparna Rajpurkar
+
+# lineage mode: follow both daughters at every division
+# each cell is simulated for one cell cycle, then forked into two daughters
+# that share out the old nucleosomes (see Chromatin.fork_division()).
+# the cells of a generation are independent and run on a worker pool.
+# workers are forked after the kernel is built, so they share it
+# copy-on-write instead of building their own.
+# only a compact record of each cell is kept: no per timestep trajectories
+
+# imports
+import multiprocessing
+import numpy as np
+import Constants
+import Chromatin
+import Telemetry
+import Trajectory
+from MyEnum import States
+
+# random streams of a lineage are (seed, stream, sim_num, kind, ...)
+# kind separates subsampling from the streams of the cells
+# with --crn the stream is left out, see Constants.make_streams()
+SAMPLE_STREAMS = 0
+CELL_STREAMS = 1
+
+# Chromatin object used by the workers to simulate cells
+# set before the pool is created, so forked workers inherit it
+_template = None
+
+def get_filename(inputs, sim_num):
+    '''
+    get_filename(inputs, sim_num)
+    name of the lineage record written by a simulation
+    '''
+    return inputs['o'] + "_" + str(sim_num) + ".lineage.txt"
+
+def init_worker(inputs):
+    '''
+    init_worker(inputs)
+    build the template Chromatin object, unless it was inherited from the parent
+    '''
+    global _template
+    if _template is None:
+        _template = Chromatin.Chromatin(inputs)
+        _template.init_timesim(inputs['n'])
+
+def run_cell(task):
+    '''
+    run_cell((cell, states, timers, first, last, sim_num))
+    simulate a cell from timestep first to last and divide at last
+    if last is before the end of the simulation
+    returns (cell, M totals, A totals, state at last, daughters or None)
+    '''
+    cell, states, timers, first, last, sim_num = task
+    chromatin = _template
+    tot_timesteps = chromatin.dat['t']
+
+    # every cell has its own random numbers, whichever worker runs it
+    chromatin.set_streams(sim_num, CELL_STREAMS, cell)
+
+    chromatin.load_state(states, timers)
+
+    end = min(last + 1, tot_timesteps)
+    trace_M = np.zeros(shape=(end - first), dtype=np.int32)
+    trace_A = np.zeros(shape=(end - first), dtype=np.int32)
+
+    for t in range(first, end):
+        chromatin.TIME = t
+        trace_M[t - first] = chromatin.totals[States.M_STATE]
+        trace_A[t - first] = chromatin.totals[States.A_STATE]
+        if t < last:
+            chromatin.step(t)
+
+    end_states = chromatin.states.copy()
+
+    # divide at last unless nothing is left to simulate afterwards
+    daughters = None
+    if last + 1 < tot_timesteps:
+        daughters = chromatin.fork_division()
+
+    return cell, trace_M, trace_A, end_states, daughters
+
+class Lineage:
+    '''
+    Lineage class
+    simulate a population of cells descending from one cell
+    has the same attributes as Chromatin that SimResult uses
+    '''
+
+    def __init__(self, input_dat, sim_num=0):
+        '''
+        initialization function
+        '''
+        global _template
+
+        self.dat = input_dat
+        self.max_cells = input_dat['data']['lineage_max']
+        self.sample = input_dat['data']['lineage_sample']
+        self.procs = input_dat['data']['procs']
+
+        # the root cell; its kernel is shared by every cell
+        _template = Chromatin.Chromatin(input_dat, sim_num)
+        _template.init_timesim(input_dat['n'])
+        self.root = _template.save_state()
+
+        # random numbers of subsampling
+        common, self.rng, self.np_rng = Constants.make_streams(input_dat['data'], sim_num, SAMPLE_STREAMS)
+
+        self.stop_time = None
+        self.stop_reason = None
+
+    def timesim(self, n_nucs, sim_num):
+        '''
+        timesim()
+        simulate all generations of cells and write the lineage record
+        the traces are the mean M and A totals of the cells alive at every timestep
+        '''
+        tot_timesteps = self.dat['t']
+        div = self.dat['data']['divisions']
+
+        sum_M = np.zeros(shape=(tot_timesteps))
+        sum_A = np.zeros(shape=(tot_timesteps))
+        alive = np.zeros(shape=(tot_timesteps))
+
+        pool = None
+        if self.procs > 1:
+            # fork shares the kernel; other start methods build it in each worker
+            if "fork" in multiprocessing.get_all_start_methods():
+                context = multiprocessing.get_context("fork")
+            else:
+                context = multiprocessing.get_context()
+            pool = context.Pool(self.procs, init_worker, (self.dat,))
+
+        # (cell, parent, states, timers) of every cell of the current generation
+        cells = [ (0, -1, self.root[0], self.root[1]) ]
+        next_cell = 1
+        generation = 0
+        first = 0
+        final = []
+
+        telemetry = Telemetry.get_telemetry(self.dat)
+        if telemetry is not None:
+            telemetry.start(sim_num, tot_timesteps)
+
+        fp = open(get_filename(self.dat, sim_num), "w")
+        fp.write("Cell\tParent\tGeneration\tBirth\tEnd\tM\tU\tA\tStates\n")
+
+        try:
+            while len(cells) > 0 and first < tot_timesteps:
+                # a cell cycle ends with the next division
+                last = (first // div + 1) * div
+                print("Generation", generation, "cells:", len(cells), "timesteps:", first, "to", min(last, tot_timesteps - 1))
+                if telemetry is not None and first > 0:
+                    # population mean of the last timestep simulated
+                    telemetry.generation(first, generation, len(cells), {
+                        States.M_STATE:sum_M[first - 1] / alive[first - 1],
+                        States.A_STATE:sum_A[first - 1] / alive[first - 1],
+                        States.U_STATE:n_nucs - (sum_M[first - 1] + sum_A[first - 1]) / alive[first - 1]
+                        })
+
+                tasks = [ (cell, states, timers, first, last, sim_num) for cell, parent, states, timers in cells ]
+                if pool is not None:
+                    results = pool.map(run_cell, tasks, chunksize=max(1, len(tasks) // (4 * self.procs)))
+                else:
+                    results = map(run_cell, tasks)
+
+                daughters = []
+                for (cell, parent, states, timers), result in zip(cells, results):
+                    cell, trace_M, trace_A, end_states, forked = result
+                    end = first + len(trace_M)
+                    sum_M[first:end] += trace_M
+                    sum_A[first:end] += trace_A
+                    alive[first:end] += 1
+
+                    counts = np.bincount(end_states, minlength=len(States.get_enums()))
+                    fp.write("\t".join(str(x) for x in (
+                        cell, parent, generation, first, end - 1,
+                        counts[States.M_STATE], counts[States.U_STATE], counts[States.A_STATE],
+                        Trajectory.TO_CHAR[end_states].tobytes().decode()
+                        )) + "\n")
+
+                    if forked is None:
+                        final.append(end_states)
+                        continue
+                    for daughter_states, daughter_timers in forked:
+                        daughters.append((cell, daughter_states, daughter_timers))
+
+                cells = self.choose_daughters(daughters, next_cell)
+                next_cell += len(cells)
+                generation += 1
+                first = last + 1
+        finally:
+            fp.close()
+            if pool is not None:
+                pool.close()
+                pool.join()
+
+        self.num_cells = next_cell
+        self.generations = generation
+
+        # population mean of every timestep
+        with np.errstate(divide='ignore', invalid='ignore'):
+            self.trace_M = np.where(alive > 0, sum_M / alive, 0)
+            self.trace_A = np.where(alive > 0, sum_A / alive, 0)
+        self.num_frames = tot_timesteps
+
+        # final state of every cell of the last generation
+        self.states = np.array(final, dtype=np.uint8).reshape(len(final), n_nucs)
+        counts = np.bincount(self.states.ravel(), minlength=len(States.get_enums()))
+        self.totals = {
+                States.M_STATE:int(counts[States.M_STATE]),
+                States.A_STATE:int(counts[States.A_STATE]),
+                States.U_STATE:int(counts[States.U_STATE])
+                }
+
+        print("Cells simulated:", self.num_cells, "generations:", self.generations)
+
+        if telemetry is not None:
+            telemetry.finish(tot_timesteps, self)
+
+    def choose_daughters(self, daughters, next_cell):
+        '''
+        choose_daughters()
+        keep each daughter with the subsampling probability, then at most
+        the population cap of them. Numbers the kept daughters from next_cell
+        '''
+        keep = self.np_rng.random(len(daughters)) < self.sample
+        chosen = np.flatnonzero(keep)
+
+        if len(chosen) == 0 and len(daughters) > 0:
+            # never let the lineage die out by subsampling
+            chosen = np.array([ self.np_rng.integers(len(daughters)) ])
+        if len(chosen) > self.max_cells:
+            chosen = np.sort(self.np_rng.choice(chosen, self.max_cells, replace=False))
+
+        cells = []
+        for k, d in enumerate(chosen):
+            parent, states, timers = daughters[d]
+            cells.append((next_cell + k, parent, states, timers))
+
+        return cells
@@ -0,0 +1,329 @@
+## LiveView.py
+## Author: Aparna Rajpurkar
+
+# live view of a running simulation (--live <NAME>, MainView.py <NAME>)
+# timesim publishes into a shared memory segment; a viewer process draws
+# whatever is newest at its own frame rate. The simulation never waits:
+# frames the viewer does not pick up in time are overwritten.
+#
+# segment layout:
+#   header:  magic "HSLIVE01", n (uint32), timesteps (uint32), slots (uint32),
+#            padding (uint32), frames published (uint64),
+#            timesteps recorded (uint64), done (uint64)
+#   traces:  M and A totals of every timestep (int32 x timesteps, twice).
+#            These are the trace arrays of the Chromatin object itself,
+#            so keeping them costs nothing extra
+#   slots:   ring of frames: sequence (uint64), timestep (uint64), n states
+#
+# every slot is a seqlock: the sequence is odd while the slot is written
+# and 2k + 2 once frame k is complete. A reader copies the slot and
+# checks that the sequence did not change, otherwise it drops the frame.
+# frames are published at most PUBLISH_HZ times per second; the loop only
+# compares the timestep with next_check, as the telemetry does
+
+# imports
+import struct
+import time
+import numpy as np
+from multiprocessing import shared_memory
+
+MAGIC = b"HSLIVE01"
+HEADER = struct.Struct("<8sIIIIQQQ")
+SLOT_HEADER = struct.Struct("<QQ")
+
+# frames per second published to the viewer, and frames kept in the ring
+PUBLISH_HZ = 60
+SLOTS = 8
+
+# offsets of the counters in the header
+PUBLISHED = 24
+RECORDED = 32
+DONE = 40
+
+def slot_size(n):
+    '''
+    slot_size(N_nucs)
+    bytes of one slot, padded to 8 bytes
+    '''
+    return SLOT_HEADER.size + (n + 7) // 8 * 8
+
+def layout(n, tot_timesteps, slots):
+    '''
+    layout(N_nucs, timesteps, slots)
+    (offset of the traces, offset of the first slot, total size)
+    '''
+    traces = HEADER.size
+    first_slot = traces + 2 * 4 * tot_timesteps
+    return traces, first_slot, first_slot + slots * slot_size(n)
+
+class LiveSegment:
+    '''
+    LiveSegment class
+    numpy views of a live segment, shared by the publisher and the viewer
+    '''
+
+    def __init__(self, shm, n, tot_timesteps, slots):
+        '''
+        initialization function
+        '''
+        self.shm = shm
+        self.n = n
+        self.tot_timesteps = tot_timesteps
+        self.slots = slots
+        buf = shm.buf
+
+        traces, first_slot, size = layout(n, tot_timesteps, slots)
+        self.counters = np.ndarray(shape=(3), dtype=np.uint64, buffer=buf, offset=PUBLISHED)
+        self.trace_M = np.ndarray(shape=(tot_timesteps), dtype=np.int32, buffer=buf, offset=traces)
+        self.trace_A = np.ndarray(shape=(tot_timesteps), dtype=np.int32, buffer=buf, offset=traces + 4 * tot_timesteps)
+
+        self.seq = []
+        self.times = []
+        self.frames = []
+        for k in range(slots):
+            offset = first_slot + k * slot_size(n)
+            self.seq.append(np.ndarray(shape=(1), dtype=np.uint64, buffer=buf, offset=offset))
+            self.times.append(np.ndarray(shape=(1), dtype=np.uint64, buffer=buf, offset=offset + 8))
+            self.frames.append(np.ndarray(shape=(n), dtype=np.uint8, buffer=buf, offset=offset + SLOT_HEADER.size))
+
+    def release(self):
+        '''
+        release()
+        drop the views, so the segment can be closed
+        '''
+        self.counters = self.trace_M = self.trace_A = None
+        self.seq = self.times = self.frames = []
+
+class LivePublisher:
+    '''
+    LivePublisher class
+    the simulation side: owns the segment and publishes frames into it
+    '''
+
+    def __init__(self, name, n, tot_timesteps, slots=SLOTS):
+        '''
+        initialization function
+        '''
+        size = layout(n, tot_timesteps, slots)[2]
+        try:
+            shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+        except FileExistsError:
+            # left behind by a run that was killed
+            old = shared_memory.SharedMemory(name=name)
+            old.close()
+            old.unlink()
+            shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+
+        shm.buf[:HEADER.size] = HEADER.pack(MAGIC, n, tot_timesteps, slots, 0, 0, 0, 0)
+        self.segment = LiveSegment(shm, n, tot_timesteps, slots)
+
+        self.published = 0
+        self.next_check = 1
+        self.last_time = time.monotonic()
+        self.last_t = 0
+
+    def publish(self, t, chromatin):
+        '''
+        publish(timestep, chromatin)
+        called when t reaches next_check: publish the state at the start of t
+        if the viewer is due a frame, and set the next check from the step rate
+        '''
+        now = time.monotonic()
+        elapsed = now - self.last_time
+        segment = self.segment
+
+        if elapsed >= 1 / PUBLISH_HZ or self.published == 0:
+            k = self.published
+            slot = k % segment.slots
+            segment.seq[slot][0] = 2 * k + 1
+            segment.times[slot][0] = t
+            segment.frames[slot][:] = chromatin.states
+            segment.seq[slot][0] = 2 * k + 2
+
+            self.published = k + 1
+            segment.counters[0] = self.published
+            rate = (t - self.last_t) / elapsed if elapsed > 0 else 0
+            self.last_time = now
+            self.last_t = t
+        else:
+            rate = (t - self.last_t) / elapsed if elapsed > 0 else 0
+
+        # the traces are filled up to t by record_frame()
+        segment.counters[1] = t
+
+        steps_left = (1 / PUBLISH_HZ - (now - self.last_time)) * rate if rate > 0 else 1
+        self.next_check = t + max(1, int(steps_left))
+
+    def finish(self, num_frames, chromatin):
+        '''
+        finish(num_frames, chromatin)
+        publish the final state, mark the run done and give up the segment
+        the viewer keeps its mapping of the segment
+        '''
+        self.last_time = 0
+        self.publish(max(num_frames - 1, 0), chromatin)
+        self.segment.counters[1] = num_frames
+        self.segment.counters[2] = 1
+
+        shm = self.segment.shm
+        self.segment.release()
+        shm.close()
+        shm.unlink()
+
+class LiveReader:
+    '''
+    LiveReader class
+    the viewer side: attach to a segment and read the newest frame
+    '''
+
+    def __init__(self, name):
+        '''
+        initialization function
+        raises FileNotFoundError if no simulation published under the name
+        '''
+        shm = shared_memory.SharedMemory(name=name)
+        try:
+            # only the publisher may unlink the segment
+            from multiprocessing import resource_tracker
+            resource_tracker.unregister(shm._name, "shared_memory")
+        except (ImportError, AttributeError, KeyError):
+            pass
+
+        magic, n, tot_timesteps, slots, pad, published, recorded, done = HEADER.unpack(bytes(shm.buf[:HEADER.size]))
+        if magic != MAGIC:
+            shm.close()
+            raise ValueError(name + " is not a live simulation")
+
+        self.segment = LiveSegment(shm, n, tot_timesteps, slots)
+        self.n = n
+        self.tot_timesteps = tot_timesteps
+        self.last = None
+
+    @property
+    def done(self):
+        return bool(self.segment.counters[2])
+
+    def latest(self):
+        '''
+        latest()
+        (timestep, states copy) of the newest complete frame, or None if there
+        is no new frame or it was overwritten while we copied it
+        '''
+        segment = self.segment
+        published = int(segment.counters[0])
+        if published == 0 or published == self.last:
+            return None
+
+        k = published - 1
+        slot = k % segment.slots
+        before = int(segment.seq[slot][0])
+        t = int(segment.times[slot][0])
+        frame = segment.frames[slot].copy()
+        after = int(segment.seq[slot][0])
+
+        if before != 2 * k + 2 or after != before:
+            # torn: the simulation is already writing a newer frame here
+            return None
+
+        self.last = published
+        return t, frame
+
+    def traces(self):
+        '''
+        traces()
+        copies of the M and A totals of every timestep recorded so far
+        '''
+        recorded = min(int(self.segment.counters[1]), self.tot_timesteps)
+        return self.segment.trace_M[:recorded].copy(), self.segment.trace_A[:recorded].copy()
+
+    def close(self):
+        shm = self.segment.shm
+        self.segment.release()
+        shm.close()
+
+def get_publisher(inputs, tot_timesteps):
+    '''
+    get_publisher(inputs, total_timesteps)
+    a publisher for a simulation of the inputs, or None without --live
+    '''
+    name = inputs['data']['live']
+    if name is None:
+        return None
+    return LivePublisher(name, inputs['n'], tot_timesteps)
+
+def view(name, fps, div_count=0):
+    '''
+    view(segment_name, frames_per_second, num_divisions)
+    draw a live simulation until it is done and the window is closed.
+    waits for the simulation to start, and follows the next replica that
+    publishes under the same name
+    '''
+    # matplotlib is slow to import, only import it when viewing
+    import math
+    import matplotlib.pyplot as plt
+    import matplotlib.animation as animation
+    from Animate import COLOR_TABLE
+
+    reader = None
+    while reader is None:
+        try:
+            reader = LiveReader(name)
+        except FileNotFoundError:
+            print("Waiting for", name)
+            time.sleep(1)
+
+    n = reader.n
+    cols = math.ceil(math.sqrt(n))
+    x_vals = (np.arange(n) % cols) / cols
+    y_vals = (np.arange(n) // cols) / math.ceil(n / cols)
+
+    fig = plt.figure()
+    ax1 = fig.add_subplot(2,2,1)
+    ax1.set_xticks([])
+    ax1.set_yticks([])
+    ax1.set_title("N = " + str(n) + " live: " + name)
+    ax2 = fig.add_subplot(2,2,2)
+    ax2.set_ylim([-5,105])
+    ax2.set_xlim(0, reader.tot_timesteps)
+    ax2.set_xlabel("Timesteps")
+    ax2.set_ylabel("% Nucleosomes")
+    fig.tight_layout()
+
+    scat = ax1.scatter(x_vals, y_vals, facecolors = COLOR_TABLE[np.zeros(shape=(n), dtype=np.uint8)])
+    line_A = ax2.plot([], [], lw = 2, color = "red", label = "A")[0]
+    line_M = ax2.plot([], [], lw = 2, color = "blue", label = "M")[0]
+    ax2.legend(loc = "upper right")
+    for x in range(div_count, reader.tot_timesteps, div_count or reader.tot_timesteps):
+        ax2.axvline(x, lw = 1, ls = "dotted", color = "black")
+
+    state = { 'reader':reader }
+
+    def update_an(i):
+        reader = state['reader']
+        if reader.done:
+            # a new replica may publish under the same name
+            try:
+                newer = LiveReader(name)
+                if not newer.done:
+                    reader.close()
+                    state['reader'] = reader = newer
+                else:
+                    newer.close()
+            except (FileNotFoundError, ValueError):
+                pass
+
+        latest = reader.latest()
+        if latest is not None:
+            t, frame = latest
+            scat.set_facecolors(COLOR_TABLE[frame])
+            ax1.set_title("N = " + str(n) + " t = " + str(t))
+
+        trace_M, trace_A = reader.traces()
+        x = np.arange(len(trace_M))
+        line_A.set_data(x, trace_A / n * 100)
+        line_M.set_data(x, trace_M / n * 100)
+        return (scat, line_A, line_M)
+
+    anim = animation.FuncAnimation(fig, update_an, interval = 1000 / fps, cache_frame_data = False)
+    plt.show()
+    state['reader'].close()
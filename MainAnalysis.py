@@ -0,0 +1,64 @@
+## MainAnalysis.py
+## Author: Aparna Rajpurkar
+
+# switching times and epigenetic memory of replica trajectories
+# usage: python3 MainAnalysis.py [options] -o OUTFILE FILE [FILE ...]
+#   every FILE is one replica: a text trajectory or an event log, optionally gzipped
+#   --thresh FLOAT      fraction of M nucleosomes of the off state [default: 0.7]
+#   --thresh-A FLOAT    fraction of A nucleosomes of the on state [default: 0.7]
+#   --max-lag INT       longest lag of the autocorrelation [default: 1000]
+#   --list FILE         read the trajectory filenames from FILE, one per line
+# writes OUTFILE_switching.txt, OUTFILE_dwell.txt, OUTFILE_passage.txt and OUTFILE_acf.txt
+
+import getopt
+import sys
+import Analysis
+import Constants
+
+def usage():
+    print("usage: python3 MainAnalysis.py [--thresh FLOAT] [--thresh-A FLOAT] [--max-lag INT] [--list FILE] -o OUTFILE FILE [FILE ...]", file=sys.stderr)
+
+def main():
+    try:
+        opts, files = getopt.getopt(sys.argv[1:], "ho:", ["help", "outfile=", "thresh=", "thresh-A=", "max-lag=", "list="])
+        outfile = None
+        thresh_M = Constants.PERCENT_M_THRESH
+        thresh_A = Constants.PERCENT_M_THRESH
+        max_lag = Analysis.MAX_LAG
+        for opt, arg in opts:
+            if opt in ("-h", "--help"):
+                usage()
+                sys.exit(2)
+            elif opt in ("-o", "--outfile"):
+                outfile = arg
+            elif opt == "--thresh":
+                thresh_M = float(arg)
+            elif opt == "--thresh-A":
+                thresh_A = float(arg)
+            elif opt == "--max-lag":
+                max_lag = int(arg)
+            elif opt == "--list":
+                with open(arg, "r") as fp:
+                    files += [ line.strip() for line in fp if line.strip() ]
+        if not 0 < thresh_M <= 1 or not 0 < thresh_A <= 1 or max_lag < 0:
+            raise ValueError("thresholds must be in (0, 1] and the lag at least 0")
+    except (getopt.GetoptError, ValueError, OSError) as err:
+        print(str(err), file=sys.stderr)
+        usage()
+        sys.exit(2)
+
+    if outfile is None or len(files) == 0:
+        usage()
+        sys.exit(2)
+
+    analysis = Analysis.Analysis(thresh_M, thresh_A, max_lag)
+    for filename in files:
+        analysis.add_trajectory(filename)
+
+    analysis.write(outfile)
+    for row in analysis.switching():
+        print(row[0] + ": " + str(row[1]) + " switches in " + str(int(row[2])) + " timesteps, rate " +
+                "%.3g [%.3g, %.3g]" % row[3:6] + " per timestep")
+
+if __name__ == "__main__":
+    main()
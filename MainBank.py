@@ -0,0 +1,26 @@
+## MainBank.py
+## Author: Aparna Rajpurkar
+
+# simulate burn-ins once and keep their end states in a snapshot bank
+# usage: python3 MainBank.py --bank DIR [--burn-in INT] [--replicas INT] [--procs INT] [OPTIONS]
+#   one bank of --replicas snapshots for every screened F value and division
+#   interval (--screen-Fval, --screen-divisions), --burn-in timesteps each.
+#   Recruitment options are ignored. Simulations, ensembles and sweeps with
+#   the same --bank DIR then start from the snapshots instead of running
+#   the burn-in again, see Bank.py
+
+import sys
+import Bank
+import Input
+
+def main():
+    inputs = Input.get_input()
+
+    if inputs['data']['bank'] is None:
+        print("usage: python3 MainBank.py --bank DIR [--burn-in INT] [--replicas INT] [--procs INT] [OPTIONS]", file=sys.stderr)
+        sys.exit(2)
+
+    dirs = Bank.create_banks(inputs)
+    print("Banks written:", len(dirs))
+
+main()
@@ -0,0 +1,58 @@
+## MainEquivalence.py
+## Author: Aparna Rajpurkar
+
+# compare a simulation engine with the reference timesim
+# usage: python3 MainEquivalence.py <ENGINE> [OPTIONS]
+#   ENGINE is one of the engines of Equivalence.ENGINES
+#   configurations: --screen-Fval, --screen-nucleosomes, -d with
+#   --screen-divisions, -r; --replicas replicas per engine and configuration
+#   [default: Equivalence.REPLICAS]. The reference engine checks the harness
+#   writes OUTFILE_equivalence.txt
+#   exits 0 if equivalent, 1 if it differs, 3 if inconclusive
+
+import sys
+import Equivalence
+import Input
+
+def main():
+    if len(sys.argv) < 2 or sys.argv[1] not in Equivalence.ENGINES:
+        print("usage: python3 MainEquivalence.py <" + ", ".join(Equivalence.ENGINES) + "> [OPTIONS]", file=sys.stderr)
+        sys.exit(2)
+
+    engine = sys.argv[1]
+    argv = sys.argv[2:]
+    if not any(arg == "--replicas" or arg.startswith("--replicas=") for arg in argv):
+        argv = [ "--replicas", str(Equivalence.REPLICAS) ] + argv
+    inputs = Input.get_input(argv, ensemble=True)
+
+    results = Equivalence.run_equivalence(inputs, engine)
+    Equivalence.write_report(results, engine, inputs['o'] + "_equivalence.txt")
+
+    failed = 0
+    unsure = 0
+    for config, rows, speedup in results:
+        differs = [ row[0] for row in rows if row[6] == "differs" ]
+        inconclusive = [ row[0] for row in rows if row[6] == "inconclusive" ]
+        failed += len(differs) > 0
+        unsure += len(differs) == 0 and len(inconclusive) > 0
+        if differs:
+            verdict = "differs: " + ", ".join(differs)
+        elif inconclusive:
+            needed = [ row[7] for row in rows if row[6] == "inconclusive" ]
+            verdict = "inconclusive: " + ", ".join(inconclusive)
+            if 0 not in needed:
+                verdict += " (about " + str(max(needed)) + " replicas needed)"
+        else:
+            verdict = "equivalent"
+        print("N =", config['n'], "F =", config['f'], "speedup %.2fx" % speedup, verdict)
+
+    if failed > 0:
+        print(engine + ":", "differs on", failed, "of", len(results), "configurations")
+    elif unsure > 0:
+        print(engine + ":", "inconclusive on", unsure, "of", len(results), "configurations")
+    else:
+        print(engine + ":", "equivalent on all", len(results), "configurations")
+    sys.exit(1 if failed > 0 else 3 if unsure > 0 else 0)
+
+if __name__ == "__main__":
+    main()
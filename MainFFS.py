@@ -0,0 +1,36 @@
+## MainFFS.py
+## Author: Aparna Rajpurkar
+
+# switching rates by forward flux sampling, see FFS.py
+# usage: python3 MainFFS.py --ffs-interfaces LIST -i <M, A> -o OUTFILE [OPTIONS]
+#   --ffs-interfaces    gap scores from the edge of the start basin to the target,
+#                       e.g. 0.8,0.5,0.2,-0.2,-0.5,-0.8 to switch from off to on
+#   --ffs-crossings     crossings of the first interface, from at most 256
+#                       basin runs [default: 1000]
+#   --ffs-trials        trials per interface [default: 1000]
+#   --ffs-paths         transition paths to write [default: 3]
+#   --procs             worker processes
+#   -t                  length of the basin runs, and the most timesteps of a trial
+# writes OUTFILE_ffs.txt and OUTFILE_path<k>.txt
+
+import sys
+import FFS
+import Input
+
+def main():
+    inputs = Input.get_input()
+
+    if inputs['data']['ffs_interfaces'] is None:
+        print("usage: python3 MainFFS.py --ffs-interfaces LIST -i <M, A> -o OUTFILE [OPTIONS]", file=sys.stderr)
+        sys.exit(2)
+
+    result = FFS.run_ffs(inputs)
+    FFS.write_ffs(result, inputs['o'] + "_ffs.txt")
+
+    print("Flux:", result.flux, "per timestep")
+    print("Switching rate:", result.rate, "per timestep [" + str(result.low) + ", " + str(result.high) + "]")
+
+    for filename in FFS.write_paths(inputs, result, inputs['o']):
+        print("Transition path:", filename)
+
+main()
@@ -0,0 +1,54 @@
+## MainPrecision.py
+## Author: Aparna Rajpurkar
+
+import Input
+import Kernel
+import Constants
+from MyEnum import Precision, KernelRep
+
+# random states per density of the validation
+SAMPLES = 20
+
+def main():
+    inputs = Input.get_input()
+    n = inputs['n']
+    data = inputs['data']
+    storage = inputs['adv']['kernel_precision']
+    accumulate = inputs['adv']['accumulate']
+
+    # compare the chosen kernel precision, or hierarchical kernel, with a float64 kernel
+    limits = Kernel.domain_limits(inputs['adv']['domain'], n, data['domains'], data['domain_sizes'])
+    reference = Kernel.BlockKernel(n, limits, inputs['adv']['domainbleed'], data['domainbleed'])
+    if inputs['adv']['kernel'] == KernelRep.HMATRIX:
+        kernel = Kernel.HMatrixKernel(n, limits, inputs['adv']['domainbleed'], data['domainbleed'], data['kernel_tol'])
+    else:
+        kernel = Kernel.BlockKernel(n, limits, inputs['adv']['domainbleed'], data['domainbleed'], storage, accumulate)
+
+    rng, np_rng = Constants.make_rngs(data['seed'], data['stream'])
+    report = Kernel.precision_report(reference, kernel, SAMPLES, np_rng)
+
+    dense = reference.to_dense()
+    approx = kernel.to_dense()
+    kernel_err = abs(approx - dense).max()
+
+    if inputs['adv']['kernel'] == KernelRep.HMATRIX:
+        storage_name = "hmatrix"
+        print("Kernel: hmatrix, tolerance:", data['kernel_tol'])
+        print("Compression:", kernel.entries, "of", kernel.dense_entries, "entries stored, ratio", kernel.entries / kernel.dense_entries, "max rank", kernel.max_rank)
+        print("Relative kernel error:", ((approx - dense) ** 2).sum() ** 0.5 / (dense ** 2).sum() ** 0.5)
+    else:
+        storage_name = Precision.enum_to_string(storage)
+        print("Kernel:", storage_name, "accumulate:", Precision.enum_to_string(accumulate))
+    print("Kernel memory:", kernel.nbytes, "bytes, float64:", reference.nbytes, "bytes")
+    print("Max kernel error:", kernel_err)
+
+    with open(inputs['o'] + "_precision.txt", "w") as fp:
+        fp.write("Storage\tAccumulate\tDensity\tMaxAbsError\tMeanAbsError\tMaxRelError\tKernelBytes\tFloat64Bytes\n")
+        for density, max_abs, mean_abs, max_rel in report:
+            print("Density", density, "transition probability drift: max", max_abs, "mean", mean_abs, "max relative", max_rel)
+            fp.write("\t".join(str(x) for x in (
+                storage_name, Precision.enum_to_string(accumulate),
+                density, max_abs, mean_abs, max_rel, kernel.nbytes, reference.nbytes
+                )) + "\n")
+
+main()
@@ -0,0 +1,75 @@
+## MainRender.py
+## Author: Aparna Rajpurkar
+
+# small multiples video of an ensemble of replicas, see Render.py
+# usage: python3 MainRender.py [options] -o OUTFILE FILE [FILE ...]
+#   every FILE is one replica: a text trajectory or an event log, optionally gzipped
+#   --every INT         write every INT-th frame to the video
+#                       [default: the smallest that fits in --seconds]
+#   --seconds FLOAT     length of the video when --every is not given [default: 60]
+#   --divisions INT     timesteps between divisions, drawn as dotted lines [default: none]
+#   --fps INT           frames per second of the video [default: 200]
+#   --width INT         width of the video in pixels [default: 1280]
+#   --ffmpeg PATH       ffmpeg binary [default: ffmpeg]
+#   --list FILE         read the trajectory filenames from FILE, one per line
+# writes OUTFILE.mp4 and the last frame to OUTFILE_dashboard.png
+
+import getopt
+import sys
+import Render
+
+def usage():
+    print("usage: python3 MainRender.py [--every INT] [--seconds FLOAT] [--divisions INT] [--fps INT] [--width INT] [--ffmpeg PATH] [--list FILE] -o OUTFILE FILE [FILE ...]", file=sys.stderr)
+
+def main():
+    try:
+        opts, files = getopt.getopt(sys.argv[1:], "ho:", ["help", "outfile=", "every=", "seconds=", "divisions=", "fps=", "width=", "ffmpeg=", "list="])
+        outfile = None
+        every = None
+        seconds = Render.VIDEO_SECONDS
+        div_count = 0
+        fps = Render.FPS
+        width = Render.WIDTH
+        ffmpeg = "ffmpeg"
+        for opt, arg in opts:
+            if opt in ("-h", "--help"):
+                usage()
+                sys.exit(2)
+            elif opt in ("-o", "--outfile"):
+                outfile = arg
+            elif opt == "--every":
+                every = int(arg)
+            elif opt == "--seconds":
+                seconds = float(arg)
+            elif opt == "--divisions":
+                div_count = int(arg)
+            elif opt == "--fps":
+                fps = int(arg)
+            elif opt == "--width":
+                width = int(arg)
+            elif opt == "--ffmpeg":
+                ffmpeg = arg
+            elif opt == "--list":
+                with open(arg, "r") as fp:
+                    files += [ line.strip() for line in fp if line.strip() ]
+        if (every is not None and every < 1) or seconds <= 0 or div_count < 0 or fps < 1 or width < 64:
+            raise ValueError("--every and --fps must be at least 1, --seconds positive, --divisions at least 0 and --width at least 64")
+    except (getopt.GetoptError, ValueError, OSError) as err:
+        print(str(err), file=sys.stderr)
+        usage()
+        sys.exit(2)
+
+    if outfile is None or len(files) == 0:
+        usage()
+        sys.exit(2)
+
+    try:
+        count = Render.render(files, outfile, every, div_count, fps, ffmpeg, width, seconds)
+    except (FileNotFoundError, ValueError, RuntimeError) as err:
+        print(str(err), file=sys.stderr)
+        sys.exit(1)
+
+    print("Rendered", count, "frames of", len(files), "replicas to", outfile + ".mp4")
+
+if __name__ == "__main__":
+    main()
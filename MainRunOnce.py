@@ -2,12 +2,13 @@
 ## Author: Aparna Rajpurkar
 
 import Input
-import Chromatin
+import Planner
+import Simulation
 
 def main():
     inputs = Input.get_input()
+    Planner.plan_or_exit(inputs)
 
-    chromatin = Chromatin.Chromatin(inputs)
-    chromatin.timesim(inputs['n'], 0)
+    Simulation.run_simulation(inputs, 0)
 
 main()
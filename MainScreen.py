@@ -0,0 +1,24 @@
+## MainScreen.py
+## Author: Aparna Rajpurkar
+
+import numpy as np
+import Input
+import MeanField
+from MyEnum import States
+
+def main():
+    inputs = Input.get_input()
+
+    # integrate every parameter point from all M and from all A
+    grid = MeanField.make_grid(inputs)
+    print("Parameter points:", len(grid['f']))
+
+    from_M = MeanField.integrate(inputs, grid, States.M_STATE)
+    from_A = MeanField.integrate(inputs, grid, States.A_STATE)
+
+    MeanField.write_screen(from_M, from_A, inputs['o'] + "_screen.txt")
+
+    # predicted curves: points x timesteps x (M from M, A from M, M from A, A from A)
+    np.save(inputs['o'] + "_screen.npy", np.stack((from_M.frac_M, from_M.frac_A, from_A.frac_M, from_A.frac_A), axis=2))
+
+main()
@@ -2,14 +2,19 @@
 ## Author: Aparna Rajpurkar
 
 import Input
-import Chromatin
+import Planner
+import Ensemble
 
 def main():
-    inputs = Input.get_input()
+    inputs = Input.get_input(ensemble=True)
+    Planner.plan_or_exit(inputs, Planner.ensemble_replicas(inputs))
 
-    for i in range(100):
-        print("On sim", i)
-        chromatin = Chromatin.Chromatin(inputs)
-        chromatin.timesim(inputs['n'], i)
+    # run replicas, either a fixed number or until statistics converge
+    result = Ensemble.run_ensemble(inputs)
+
+    print("Replicas run:", result.replicas)
+    print("Achieved precision: gap score", result.gap_precision, "percent off", result.off_precision)
+
+    Ensemble.write_summary(result, inputs['o'] + "_summary.txt")
 
 main()
@@ -0,0 +1,65 @@
+## MainSweep.py
+## Author: Aparna Rajpurkar
+
+# run a sweep through a work queue on a shared filesystem
+# usage: python3 MainSweep.py <create, work, merge, status> [OPTIONS]
+#   create: make tasks for every parameter point (--screen-* options) and
+#           batch of replicas (--replicas, --replica-batch)
+#   work:   run tasks until none are left, with --procs local workers.
+#           start it on as many hosts as you like
+#   merge:  fold finished tasks into ensemble summaries and compare replica i
+#           of neighbouring points (use --crn to couple their random numbers)
+#   status: show the state of the queue
+
+import multiprocessing
+import sys
+import Input
+import MeanField
+import Planner
+import WorkQueue
+
+COMMANDS = ("create", "work", "merge", "status")
+
+def main():
+    if len(sys.argv) < 2 or sys.argv[1] not in COMMANDS:
+        print("usage: python3 MainSweep.py <" + ", ".join(COMMANDS) + "> [OPTIONS]", file=sys.stderr)
+        sys.exit(2)
+
+    command = sys.argv[1]
+    inputs = Input.get_input(sys.argv[2:], ensemble=True)
+
+    queue_dir = inputs['data']['queue']
+    if queue_dir is None:
+        queue_dir = inputs['o'] + "_queue"
+
+    if command == "create":
+        # workers run with the settings of the plan
+        num_points = len(MeanField.make_grid(inputs)['f'])
+        Planner.plan_or_exit(inputs, num_points * inputs['data']['replicas'])
+        WorkQueue.create_sweep(queue_dir, inputs)
+
+    elif command == "work":
+        procs = inputs['data']['procs']
+        if procs == 1:
+            WorkQueue.run_worker(queue_dir, inputs['data']['lease_timeout'])
+        else:
+            workers = [ multiprocessing.Process(target=WorkQueue.run_worker, args=(queue_dir, inputs['data']['lease_timeout']))
+                    for p in range(procs) ]
+            for worker in workers:
+                worker.start()
+            for worker in workers:
+                worker.join()
+
+    elif command == "merge":
+        incomplete = WorkQueue.merge(queue_dir, inputs['o'])
+        if incomplete > 0:
+            print("Points with missing replicas:", incomplete)
+
+    else:
+        counts, ages = WorkQueue.status(queue_dir)
+        print("Todo:", counts['todo'], "leased:", counts['leased'], "done:", counts['done'])
+        for lease, age in ages.items():
+            print("\t" + lease, "last heartbeat", round(age), "s ago")
+
+if __name__ == "__main__":
+    main()
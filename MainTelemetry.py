@@ -0,0 +1,63 @@
+## MainTelemetry.py
+## Author: Aparna Rajpurkar
+
+# summarize telemetry streams written with --telemetry
+# usage: python3 MainTelemetry.py [-f] [--every SECONDS] FILE [FILE ...]
+#   prints one line per replica (running, steady, stalled or done) and the
+#   progress of every ensemble, over all runs writing to the files
+#   -f keeps following the files and prints the summary every SECONDS
+
+import getopt
+import sys
+import time
+import Telemetry
+
+# seconds between summaries with -f
+EVERY = 5
+
+def usage():
+    print("usage: python3 MainTelemetry.py [-f] [--every SECONDS] FILE [FILE ...]", file=sys.stderr)
+
+def main():
+    try:
+        opts, files = getopt.getopt(sys.argv[1:], "hf", ["help", "follow", "every="])
+        follow = False
+        every = EVERY
+        for opt, arg in opts:
+            if opt in ("-h", "--help"):
+                usage()
+                sys.exit(2)
+            elif opt in ("-f", "--follow"):
+                follow = True
+            elif opt == "--every":
+                every = float(arg)
+    except (getopt.GetoptError, ValueError) as err:
+        print(str(err), file=sys.stderr)
+        usage()
+        sys.exit(2)
+
+    if len(files) == 0:
+        usage()
+        sys.exit(2)
+
+    summary = Telemetry.Summary()
+    offsets = { filename:0 for filename in files }
+
+    while True:
+        for filename in files:
+            try:
+                lines, offsets[filename] = Telemetry.read_lines(filename, offsets[filename])
+            except FileNotFoundError:
+                # not created yet
+                continue
+            summary.add(lines)
+
+        print(summary.table())
+
+        if not follow:
+            break
+        print()
+        time.sleep(every)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,42 @@
+## MainView.py
+## Author: Aparna Rajpurkar
+
+# watch a simulation run with --live <NAME> while it runs
+# usage: python3 MainView.py [--fps FPS] [--divisions-num INT] NAME
+
+import getopt
+import sys
+import LiveView
+
+# frames drawn per second
+FPS = 20
+
+def usage():
+    print("usage: python3 MainView.py [--fps FPS] [--divisions-num INT] NAME", file=sys.stderr)
+
+def main():
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], "h", ["help", "fps=", "divisions-num="])
+        fps = FPS
+        div = 0
+        for opt, arg in opts:
+            if opt in ("-h", "--help"):
+                usage()
+                sys.exit(2)
+            elif opt == "--fps":
+                fps = float(arg)
+            elif opt == "--divisions-num":
+                div = int(arg)
+    except (getopt.GetoptError, ValueError) as err:
+        print(str(err), file=sys.stderr)
+        usage()
+        sys.exit(2)
+
+    if len(args) != 1:
+        usage()
+        sys.exit(2)
+
+    LiveView.view(args[0], fps, div)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,230 @@
+## MeanField.py
+## Author: Aparna Rajpurkar
+
+# deterministic mean-field screening
+# instead of simulating nucleosomes, integrate the expected occupancy of
+# M, U and A of every nucleosome under the rules of Chromatin.timesim:
+# random events with chance 1/(F+1), feedback through the kernel,
+# dilution at divisions and the recruitment window.
+# many parameter points are integrated at once as rows of (points, n) arrays
+#
+# approximations: the feedback field of a nucleosome is replaced by its
+# expectation, and the chance that a field is nonzero is computed as if
+# nucleosomes were independent. Conversions are immediate, as they are
+# with the default rates
+
+# imports
+import itertools
+import math
+import numpy as np
+import Constants
+import Kernel
+import Operators
+from Chromatin import expected_events
+from MyEnum import States, Divisions, Replace
+
+# final gap scores from all M and all A further apart than this
+# mean the parameter point is bistable
+BISTABLE_DIFF = 0.5
+
+# keep log(1 - p) finite
+P_MAX = 1 - 1e-6
+
+def expected_capped_poisson(lam, cap):
+    '''
+    expected_capped_poisson(poisson_mean, cap)
+    E[min(X, cap)] for X ~ poisson(lam)
+    uses E[min(X, cap)] = sum over k = 1..cap of P(X >= k)
+    '''
+    if lam <= 0 or cap <= 0:
+        return 0
+
+    k = np.arange(cap)
+    log_pmf = k * math.log(lam) - lam - np.array([ math.lgamma(x + 1) for x in k ])
+    return np.sum(np.clip(1 - np.cumsum(np.exp(log_pmf)), 0, 1))
+
+def make_grid(inputs):
+    '''
+    make_grid(inputs)
+    every combination of the screened F values, division intervals and
+    recruitment windows. Unscreened parameters take the value of the inputs
+    returns a dictionary of arrays, one entry per parameter point
+    '''
+    data = inputs['data']
+    axes = (
+            ('f', data['screen_fval'] or [inputs['f']]),
+            ('divisions', data['screen_divisions'] or [data['divisions']]),
+            ('recruit_time_init', data['screen_recruit_time_init'] or [data['recruit_time_init']]),
+            ('recruit_time', data['screen_recruit_time'] or [data['recruit_time']])
+            )
+
+    points = list(itertools.product(*[ values for name, values in axes ]))
+    grid = {}
+    for k, (name, values) in enumerate(axes):
+        grid[name] = np.array([ point[k] for point in points ])
+
+    return grid
+
+class MeanFieldResult:
+    '''
+    MeanFieldResult class
+    expected fraction of M and A nucleosomes of every point and timestep
+    '''
+
+    def __init__(self, grid, frac_M, frac_A):
+        '''
+        initialization function
+        '''
+        self.grid = grid
+        self.frac_M = frac_M
+        self.frac_A = frac_A
+
+    def gap(self):
+        '''
+        gap()
+        gap score of the expected totals, (M - A) / (M + A)
+        '''
+        total = self.frac_M + self.frac_A
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return np.where(total > 0, (self.frac_M - self.frac_A) / total, 0)
+
+def integrate(inputs, grid, initstate=None):
+    '''
+    integrate(inputs, grid, initial_state)
+    integrate the expected occupancies of all parameter points of the grid
+    for the number of timesteps of the inputs
+    returns a MeanFieldResult
+    '''
+    n = inputs['n']
+    tot_timesteps = inputs['t']
+    data = inputs['data']
+    num_points = len(grid['f'])
+    if initstate is None:
+        initstate = inputs['i']
+
+    # one dense kernel, shared by all points
+    limits = Kernel.domain_limits(inputs['adv']['domain'], n, data['domains'], data['domain_sizes'])
+    K = Kernel.BlockKernel(n, limits, inputs['adv']['domainbleed'], data['domainbleed']).to_dense()
+    # single precision is plenty for screening and twice as fast
+    KT = (K.T / n).astype(np.float32)
+    support = (K > 0).T.astype(np.float32)
+
+    # chance of a random and of a feedback event per nucleosome per timestep
+    # and the fraction of nucleosomes replaced at a division, per point
+    q_rand = np.zeros(shape=(num_points, 1), dtype=np.float32)
+    q_feedback = np.zeros(shape=(num_points, 1), dtype=np.float32)
+    replaced = np.zeros(shape=(num_points, 1), dtype=np.float32)
+    for p in range(num_points):
+        point_inputs = { 'd':inputs['d'], 't':tot_timesteps, 'data':{ 'divisions':int(grid['divisions'][p]) } }
+        tpc = Constants.get_timesteps_per_cellcycle(point_inputs)
+        events = int(Constants.get_max_events(tpc) * n)
+        rand_events, feedback_events = expected_events(events, 1/(grid['f'][p] + 1), n)
+        q_rand[p] = rand_events / n
+        q_feedback[p] = feedback_events / n
+        if inputs['adv']['division_replace'] == Replace.BINOMIAL:
+            replaced[p] = 0.5
+        else:
+            replaced[p] = expected_capped_poisson(n / 2, n) / n
+
+    q_rand_3 = q_rand / 3
+    has_events = np.any(q_rand > 0) or np.any(q_feedback > 0)
+
+    divides = inputs['d'] != Divisions.NONE
+    # recruitment sites and their schedules. Sites from --recruit-file keep
+    # their own windows, the others take the window of every point
+    recruiter = Operators.RecruitmentOperator(inputs, [ n ])
+    schedules = recruiter.schedules
+    if data['recruit_schedule'] is None:
+        schedules = [ Operators.Schedule(grid['recruit_time_init'], grid['recruit_time'], data['recruit_period']) ]
+    recruit_sites = list(zip(schedules, recruiter.sites)) if recruiter.enabled else []
+
+    # expected occupancy of every nucleosome of every point
+    # p[0] is the chance of M, p[1] the chance of A
+    p = np.zeros(shape=(2, num_points, n), dtype=np.float32)
+    if initstate == States.INIT_STATE:
+        p[:] = 1/3
+    else:
+        p[0] = initstate == States.M_STATE
+        p[1] = initstate == States.A_STATE
+
+    frac_M = np.zeros(shape=(num_points, tot_timesteps), dtype=np.float32)
+    frac_A = np.zeros(shape=(num_points, tot_timesteps), dtype=np.float32)
+
+    # work arrays of a timestep, reused: the integration is bound by
+    # elementwise passes over (2, points, n), not by the two matmuls
+    rand = np.empty_like(p)
+    field = np.empty_like(p)
+    absent = np.empty_like(p)
+    nonzero = np.empty_like(p)
+
+    for t in range(tot_timesteps):
+        # state at the start of timestep t, as the frames of timesim
+        frac = p.mean(axis=2)
+        frac_M[:, t] = frac[0]
+        frac_A[:, t] = frac[1]
+
+        # points that divide now only dilute M and A, they skip the rest of the timestep
+        dividing = np.zeros(shape=(0), dtype=np.intp)
+        if divides and t != 0:
+            dividing = np.flatnonzero(t % grid['divisions'] == 0)
+        diluted = p[:, dividing] * (1 - replaced[dividing])
+
+        # recruitment sets the recruitment sites to M
+        for schedule, sites in recruit_sites:
+            recruiting = np.broadcast_to(schedule.active_mask(t), (num_points,)).copy()
+            recruiting[dividing] = False
+            rows = np.ix_(np.flatnonzero(recruiting), sites)
+            p[0][rows] = 1
+            p[1][rows] = 0
+
+        if not has_events:
+            p[:, dividing] = diluted
+            continue
+
+        # random events: U goes to A or M, M and A go to U, each with 1/3 chance
+        pU = 1 - p[0] - p[1]
+        np.subtract(pU, p, out=rand)
+        rand *= q_rand_3
+        rand += p
+
+        # feedback fields, after the random events of this timestep
+        np.matmul(rand, KT, out=field)
+        field_M, field_A = field
+
+        # chance that a field is nonzero: some nucleosome it sums over is M (A)
+        np.minimum(rand, P_MAX, out=absent)
+        np.subtract(1, absent, out=absent)
+        np.log(absent, out=absent)
+        np.matmul(absent, support, out=nonzero)
+        np.exp(nonzero, out=nonzero)
+        np.subtract(1, nonzero, out=nonzero)
+
+        # feedback events: M and A go to U, U goes to A or M if both fields are nonzero
+        scaling = pU / np.maximum(field_A + field_M, 1)
+        rand[0] += q_feedback * (scaling * field_M * nonzero[1] - p[0] * np.minimum(field_A, 1))
+        rand[1] += q_feedback * (scaling * field_A * nonzero[0] - p[1] * np.minimum(field_M, 1))
+
+        rand[:, dividing] = diluted
+        p, rand = rand, p
+
+    return MeanFieldResult(grid, frac_M, frac_A)
+
+def write_screen(from_M, from_A, filename):
+    '''
+    write_screen(result_from_all_M, result_from_all_A, filename)
+    one line per parameter point with the final percentages and gap scores
+    from both initial states, and whether the point is bistable
+    '''
+    grid = from_M.grid
+    gap_M = from_M.gap()[:, -1]
+    gap_A = from_A.gap()[:, -1]
+
+    with open(filename, "w") as fp:
+        fp.write("Point\tFValue\tDivisions\tRecruitTimeInit\tRecruitTime\tPercMFromM\tPercAFromM\tGapFromM\tPercMFromA\tPercAFromA\tGapFromA\tBistable\n")
+        for p in range(len(grid['f'])):
+            fp.write("\t".join(str(x) for x in (
+                p, grid['f'][p], grid['divisions'][p], grid['recruit_time_init'][p], grid['recruit_time'][p],
+                from_M.frac_M[p, -1] * 100, from_M.frac_A[p, -1] * 100, gap_M[p],
+                from_A.frac_M[p, -1] * 100, from_A.frac_A[p, -1] * 100, gap_A[p],
+                int(abs(gap_M[p] - gap_A[p]) > BISTABLE_DIFF)
+                )) + "\n")
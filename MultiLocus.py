@@ -0,0 +1,307 @@
+## MultiLocus.py
+## Author: Aparna Rajpurkar
+
+# multi-locus mode: many independent strings of nucleosomes (loci) of
+# different lengths, simulated together in one state array
+# locus l is states[offsets[l]:offsets[l + 1]]. Loci of the same length share
+# one kernel. Every phase of a timestep runs once across all loci with
+# array operations, under the same rules as Chromatin.timesim.
+# conversions happen at once, as Constants.get_rate() returns 0
+
+# imports
+import numpy as np
+import Constants
+import Kernel
+import Operators
+import Telemetry
+import Trajectory
+from MyEnum import Phase, States
+
+class MultiLocus:
+    '''
+    MultiLocus class
+    simulate many loci in one set of arrays
+    has the same attributes as Chromatin that the writers and results use
+    '''
+
+    def __init__(self, input_dat, sim_num=0):
+        '''
+        initialization function
+        '''
+        self.dat = input_dat
+        self.timesteps_per_cellcycle = Constants.get_timesteps_per_cellcycle(input_dat)
+
+        # random number streams of this simulation only
+        self.crn, self.rng, self.np_rng = Constants.make_streams(input_dat['data'], sim_num)
+
+        self.lengths = np.array(input_dat['data']['loci'], dtype=np.intp)
+        self.names = input_dat['data']['loci_names']
+        self.num_loci = len(self.lengths)
+        self.offsets = np.r_[0, np.cumsum(self.lengths)]
+        self.n = int(self.offsets[-1])
+
+        # which locus each nucleosome belongs to, and its index in the locus
+        self.locus_of = np.repeat(np.arange(self.num_loci), self.lengths)
+        self.local = np.arange(self.n) - self.offsets[self.locus_of]
+
+        # one kernel per distinct locus length
+        self.kernels = {}
+        for length in np.unique(self.lengths):
+            limits = Kernel.domain_limits(input_dat['adv']['domain'], int(length), input_dat['data']['domains'], None)
+            self.kernels[int(length)] = Kernel.make_kernel(int(length), limits, input_dat['adv']['domainbleed'], input_dat['data']['domainbleed'], input_dat['adv'], input_dat['data']['kernel_tol'])
+
+        self.init_states(input_dat['i'])
+
+        # cell cycle operators act on every locus, see Operators.py
+        self.divider = Operators.DivisionOperator(input_dat, self.lengths)
+        self.recruiter = Operators.RecruitmentOperator(input_dat, self.lengths)
+
+        self.line = None
+        self.writer = None
+        self.stop_time = None
+        self.stop_reason = None
+
+    ## init functions ##
+    def init_states(self, initstate):
+        '''
+        init_states()
+        initialize states, state matricies and per locus totals
+        '''
+        if initstate == States.INIT_STATE:
+            self.states = self.np_rng.choice(
+                    [States.U_STATE, States.M_STATE, States.A_STATE], size=self.n
+                    ).astype(np.uint8)
+        else:
+            self.states = np.full(self.n, initstate, dtype=np.uint8)
+
+        self.M_mat = (self.states == States.M_STATE).astype(np.uint8)
+        self.A_mat = (self.states == States.A_STATE).astype(np.uint8)
+
+        # totals[locus, state]
+        self.locus_totals = np.zeros(shape=(self.num_loci, len(States.get_enums())), dtype=np.int64)
+        np.add.at(self.locus_totals, (self.locus_of, self.states), 1)
+
+    @property
+    def totals(self):
+        '''
+        totals over all loci, as in Chromatin
+        '''
+        sums = self.locus_totals.sum(axis=0)
+        return {
+                States.M_STATE:int(sums[States.M_STATE]),
+                States.A_STATE:int(sums[States.A_STATE]),
+                States.U_STATE:int(sums[States.U_STATE])
+                }
+
+    ## helper functions ##
+    def print_nucs(self, fp):
+        '''
+        print_nucs()
+        print out current state of all nucleosomes of all loci to a file
+        '''
+        if self.line is None:
+            self.line = Trajectory.TO_CHAR[self.states].tobytes().decode() + "\n"
+
+        fp.write(self.line)
+
+    def update_many(self, t, indicies, new):
+        '''
+        update_many()
+        convert many nucleosomes at once and update all datastructures
+        '''
+        new = np.broadcast_to(np.asarray(new, dtype=np.uint8), indicies.shape)
+        changed = self.states[indicies] != new
+        indicies = indicies[changed]
+        new = new[changed]
+
+        if len(indicies) == 0:
+            return
+
+        old = self.states[indicies]
+        locus = self.locus_of[indicies]
+        np.add.at(self.locus_totals, (locus, old), -1)
+        np.add.at(self.locus_totals, (locus, new), 1)
+
+        self.states[indicies] = new
+        self.M_mat[indicies] = new == States.M_STATE
+        self.A_mat[indicies] = new == States.A_STATE
+        self.line = None
+
+        if self.writer is not None and self.writer.wants_events:
+            self.writer.events(t + 1, indicies, new)
+
+    def recruit(self, t, sites):
+        '''
+        recruit()
+        convert recruitment sites to M; conversions are immediate
+        '''
+        self.update_many(t, sites, States.M_STATE)
+
+    def field(self, rows, vec):
+        '''
+        field()
+        feedback field of every nucleosome in rows, from its own locus only
+        '''
+        out = np.zeros(shape=(len(rows)))
+        locus = self.locus_of[rows]
+        row_lengths = self.lengths[locus]
+
+        for length, kernel in self.kernels.items():
+            sel = np.flatnonzero(row_lengths == length)
+            if len(sel) > 0:
+                out[sel] = kernel.field_gather(self.local[rows[sel]], vec, self.offsets[locus[sel]])
+
+        return out
+
+    ## Timestep simulation
+    def timesim(self, n_nucs, sim_num):
+        '''
+        timesim()
+        simulate all loci through time
+        writes the concatenated trajectory, an index of the loci and
+        the totals of every locus at every timestep
+        '''
+        TOT_TIMESTEPS = self.dat['t']
+
+        # events per timestep of each locus, as in Chromatin
+        max_events = Constants.get_max_events(self.timesteps_per_cellcycle)
+        self.events_per_timestep = np.array([ int(max_events * length) for length in self.lengths ])
+        print("Events_per_timestep:", int(self.events_per_timestep.sum()), "over", self.num_loci, "loci")
+
+        self.trace_M = np.zeros(shape=(TOT_TIMESTEPS), dtype=np.int32)
+        self.trace_A = np.zeros(shape=(TOT_TIMESTEPS), dtype=np.int32)
+        self.num_frames = 0
+
+        # outfiles
+        base = self.dat['o'] + "_" + str(sim_num)
+        self.write_index(base + ".loci.txt")
+        totals_out = np.lib.format.open_memmap(base + ".totals.npy", mode="w+", dtype=np.int32,
+                shape=(TOT_TIMESTEPS, self.num_loci, 3))
+
+        self.writer = Trajectory.open_writer(self.dat, sim_num)
+
+        telemetry = Telemetry.get_telemetry(self.dat)
+        if telemetry is not None:
+            telemetry.start(sim_num, TOT_TIMESTEPS)
+
+        for t in range(TOT_TIMESTEPS):
+            if telemetry is not None and t >= telemetry.next_check:
+                telemetry.check(t, self)
+
+            # write out the state at the start of timestep t
+            self.writer.frame(t, self)
+            totals_out[t, :, 0] = self.locus_totals[:, States.M_STATE]
+            totals_out[t, :, 1] = self.locus_totals[:, States.U_STATE]
+            totals_out[t, :, 2] = self.locus_totals[:, States.A_STATE]
+            totals = self.totals
+            self.trace_M[t] = totals[States.M_STATE]
+            self.trace_A[t] = totals[States.A_STATE]
+            self.num_frames = t + 1
+
+            self.step(t)
+
+        self.writer.close()
+        totals_out.flush()
+        del totals_out
+
+        if telemetry is not None:
+            telemetry.finish(TOT_TIMESTEPS, self)
+
+    def write_index(self, filename):
+        '''
+        write_index()
+        where every locus is in the concatenated trajectory
+        '''
+        with open(filename, "w") as fp:
+            fp.write("Locus\tName\tOffset\tLength\n")
+            for l in range(self.num_loci):
+                fp.write(str(l) + "\t" + self.names[l] + "\t" + str(self.offsets[l]) + "\t" + str(self.lengths[l]) + "\n")
+
+    def sync(self, t, phase):
+        '''
+        sync(timestep, phase)
+        with common random numbers, start the numbers of a phase of timestep t
+        '''
+        if self.crn is not None:
+            self.crn.sync(t, phase)
+
+    def step(self, t):
+        '''
+        step()
+        simulate a single timestep of all loci
+        '''
+        # handle divisions
+        # skip everything else for this timestep--just go to next one
+        if self.divider.is_due(t):
+            # replace nucleosomes of every locus with U-state nucleosomes
+            self.sync(t, Phase.DIVISION)
+            self.divider.apply(t, self)
+            return
+
+        # handle recruitment at the sites of every locus
+        if self.recruiter.is_active(t):
+            self.sync(t, Phase.RECRUIT)
+            self.recruiter.apply(t, self)
+
+        self.step_events(t)
+
+    def step_events(self, t):
+        '''
+        step_events()
+        random and feedback events of all loci
+        '''
+        # choose number of events and random events of every locus
+        self.sync(t, Phase.EVENTS)
+        num_events = np.minimum(self.np_rng.poisson(self.events_per_timestep), self.lengths)
+        a = 1/(self.dat['f'] + 1)
+        self.sync(t, Phase.RANDOM)
+        num_rand_events = np.minimum(self.np_rng.poisson(self.events_per_timestep * a), num_events)
+
+        # select indicies to have an event; the first ranks have a random event
+        self.sync(t, Phase.SELECT)
+        nucs_w_event, rank = Operators.sample_per_segment(self.locus_of, self.offsets, num_events, self.np_rng)
+        is_rand = rank < num_rand_events[self.locus_of[nucs_w_event]]
+        nucs_w_rand_event = nucs_w_event[is_rand]
+        nucs_w_feedback_event = nucs_w_event[~is_rand]
+
+        # handle all random events
+        old = self.states[nucs_w_rand_event]
+        self.sync(t, Phase.CONVERT)
+        r1 = self.np_rng.random(len(old))
+        r2 = self.np_rng.random(len(old))
+        is_U = old == States.U_STATE
+
+        # U goes to A or M with 2/3 chance, M and A go to U with 1/3 chance
+        to_A = is_U & (r1 < 2/3) & (r2 < 0.5)
+        to_M = is_U & (r1 < 2/3) & (r2 >= 0.5)
+        to_U = ~is_U & (r1 < 1/3)
+
+        self.update_many(t, nucs_w_rand_event[to_A], States.A_STATE)
+        self.update_many(t, nucs_w_rand_event[to_M], States.M_STATE)
+        self.update_many(t, nucs_w_rand_event[to_U], States.U_STATE)
+
+        # handle feedback events
+        # total probability of conversion for M and A, normalized by locus length
+        lengths = self.lengths[self.locus_of[nucs_w_feedback_event]]
+        tot_prob_M = self.field(nucs_w_feedback_event, self.M_mat) / lengths
+        tot_prob_A = self.field(nucs_w_feedback_event, self.A_mat) / lengths
+
+        curr = self.states[nucs_w_feedback_event]
+        self.sync(t, Phase.FEEDBACK)
+        r = self.np_rng.random(len(curr))
+
+        # M can only move towards A, A only towards M
+        M_to_U = (curr == States.M_STATE) & (r < tot_prob_A)
+        A_to_U = (curr == States.A_STATE) & (r < tot_prob_M)
+
+        # U moves towards M or A if both probabilities are nonzero
+        scaling = 1 / np.maximum(tot_prob_A + tot_prob_M, 1)
+        A_prob = tot_prob_A * scaling
+        M_prob = tot_prob_M * scaling
+        U_feedback = (curr == States.U_STATE) & (tot_prob_A != 0) & (tot_prob_M != 0)
+        U_to_A = U_feedback & (r > 1 - A_prob - M_prob) & (r <= 1 - M_prob)
+        U_to_M = U_feedback & (r > 1 - M_prob)
+
+        self.update_many(t, nucs_w_feedback_event[M_to_U | A_to_U], States.U_STATE)
+        self.update_many(t, nucs_w_feedback_event[U_to_A], States.A_STATE)
+        self.update_many(t, nucs_w_feedback_event[U_to_M], States.M_STATE)
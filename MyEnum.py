@@ -78,3 +78,64 @@ class ProbConv(MyEnum):
     EQUAL_DEFAULT, MOD = range(2)
     vals = ("equal", "mod")
     enum_list = (EQUAL_DEFAULT, MOD)
+
+# timestep options
+class TimeStep(MyEnum):
+    FIXED, ADAPTIVE = range(2)
+    vals = ("fixed", "adaptive")
+    enum_list = (FIXED, ADAPTIVE)
+
+# stopping rule options
+class Stop(MyEnum):
+    NONE, ABSORB, PLATEAU, PASSAGE = range(4)
+    vals = ("none", "absorb", "plateau", "passage")
+    enum_list = (NONE, ABSORB, PLATEAU, PASSAGE)
+
+# replica count options
+class Replicas(MyEnum):
+    FIXED, ADAPTIVE = range(2)
+    vals = ("fixed", "adaptive")
+    enum_list = (FIXED, ADAPTIVE)
+
+# trajectory output options
+class Output(MyEnum):
+    TEXT, EVENTS = range(2)
+    vals = ("text", "events")
+    enum_list = (TEXT, EVENTS)
+
+# what a simulation does when the output queue is full
+class Backpressure(MyEnum):
+    BLOCK, GROW = range(2)
+    vals = ("block", "grow")
+    enum_list = (BLOCK, GROW)
+
+# storage and accumulation precision of the feedback kernel
+class Precision(MyEnum):
+    FLOAT64, FLOAT32, FLOAT16, UINT16 = range(4)
+    vals = ("float64", "float32", "float16", "uint16")
+    enum_list = (FLOAT64, FLOAT32, FLOAT16, UINT16)
+
+# representation of the feedback kernel: stored blocks, rows computed when needed,
+# or hierarchical blocks with low-rank far field
+class KernelRep(MyEnum):
+    BLOCK, ROWS, HMATRIX = range(3)
+    vals = ("block", "rows", "hmatrix")
+    enum_list = (BLOCK, ROWS, HMATRIX)
+
+# planning before a run: skip, refuse runs that do not fit, or pick settings that fit
+class Plan(MyEnum):
+    NONE, CHECK, AUTO = range(3)
+    vals = ("none", "check", "auto")
+    enum_list = (NONE, CHECK, AUTO)
+
+# nucleosomes replaced at a division
+class Replace(MyEnum):
+    POISSON, BINOMIAL = range(2)
+    vals = ("poisson", "binomial")
+    enum_list = (POISSON, BINOMIAL)
+
+# phases of a timestep that draw their own common random numbers, see Constants.CommonStreams
+class Phase(MyEnum):
+    DIVISION, RECRUIT, EVENTS, RANDOM, SELECT, CONVERT, FEEDBACK, LEAP = range(8)
+    vals = ("division", "recruit", "events", "random", "select", "convert", "feedback", "leap")
+    enum_list = (DIVISION, RECRUIT, EVENTS, RANDOM, SELECT, CONVERT, FEEDBACK, LEAP)
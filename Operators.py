@@ -0,0 +1,284 @@
+## Operators.py
+## Author: Aparna Rajpurkar
+
+# cell cycle operators: division and recruitment act on the whole state
+# array at once. Both work on one or many loci (segments of the state array,
+# see MultiLocus.py); a single string is one segment.
+# an operator only chooses nucleosomes; the simulation converts them with
+# update_many(t, indicies, new), which updates totals, masks and the writer
+# in bulk.
+#
+# division replaces nucleosomes of the pool (nucleosomes without a pending
+# conversion) with U:
+#   poisson:  a poisson of half of the pool of every segment, chosen uniformly
+#   binomial: every nucleosome of the pool independently with chance 1/2
+# recruitment converts the sites of every active schedule to M. Sites are
+# (center, width, start, duration, period) in coordinates of a segment, with
+# the window [start, start + duration] repeating every period timesteps
+# (0: once). Their indicies are found once, when the operator is made
+
+# imports
+import numpy as np
+from MyEnum import Divisions, Recruit, Replace, States
+
+def sample_per_segment(segment_of, offsets, counts, np_rng):
+    '''
+    sample_per_segment(segment_of_each_element, segment_offsets, counts_per_segment, generator)
+    choose counts[s] elements uniformly without replacement from every segment s
+    at once. Returns the chosen indicies and their rank in the random order
+    of their segment, so the first ranks can be split off as a subset
+    '''
+    keys = np_rng.random(len(segment_of))
+    order = np.lexsort((keys, segment_of))
+    rank = np.arange(len(order)) - offsets[segment_of[order]]
+    chosen = rank < counts[segment_of[order]]
+
+    return order[chosen], rank[chosen]
+
+class Schedule:
+    '''
+    Schedule class
+    window [start, start + duration], repeating every period timesteps
+    '''
+
+    def __init__(self, start, duration, period=0):
+        '''
+        initialization function
+        '''
+        self.start = start
+        self.duration = duration
+        self.period = period
+
+    def active(self, t):
+        '''
+        active(timestep)
+        '''
+        if t < self.start:
+            return False
+        if self.period > 0:
+            return (t - self.start) % self.period <= self.duration
+        return t <= self.start + self.duration
+
+    def active_mask(self, times):
+        '''
+        active_mask(timesteps_array)
+        active() of many timesteps at once
+        '''
+        since = times - self.start
+        if self.period > 0:
+            return (since >= 0) & (since % self.period <= self.duration)
+        return (since >= 0) & (since <= self.duration)
+
+    def ends_after(self, t):
+        '''
+        ends_after(timestep)
+        True if the schedule is active at any timestep after t
+        '''
+        return self.period > 0 or t < self.start + self.duration
+
+    def next_start(self, t):
+        '''
+        next_start(timestep)
+        first timestep at or after t at which the schedule is active
+        '''
+        if self.active(t):
+            return t
+        if t < self.start:
+            return self.start
+        if self.period > 0:
+            return t + self.period - (t - self.start) % self.period
+        return None
+
+    def key(self):
+        return (self.start, self.duration, self.period)
+
+class DivisionOperator:
+    '''
+    DivisionOperator class
+    replace nucleosomes with U at every division
+    '''
+
+    def __init__(self, inputs, lengths):
+        '''
+        initialization function
+        lengths of the segments of the state array
+        '''
+        self.enabled = inputs['d'] != Divisions.NONE
+        self.interval = inputs['data']['divisions']
+        self.replace = inputs['adv']['division_replace']
+
+        self.lengths = np.asarray(lengths, dtype=np.intp)
+        self.offsets = np.r_[0, np.cumsum(self.lengths)]
+        self.segment_of = np.repeat(np.arange(len(self.lengths)), self.lengths)
+
+    def is_due(self, t):
+        '''
+        is_due(timestep)
+        check if we divide at timestep t
+        '''
+        return self.enabled and t != 0 and t % self.interval == 0
+
+    def next_due(self, t):
+        '''
+        next_due(timestep)
+        first division after timestep t, None without divisions
+        '''
+        if not self.enabled:
+            return None
+        return t + self.interval - t % self.interval
+
+    def select(self, np_rng, pool=None):
+        '''
+        select(generator, pool_mask)
+        indicies of the nucleosomes replaced at a division
+        pool is a boolean mask of the nucleosomes that can be replaced,
+        None for all of them
+        '''
+        if self.replace == Replace.BINOMIAL:
+            replaced = np_rng.random(len(self.segment_of)) < 0.5
+            if pool is not None:
+                replaced &= pool
+            return np.flatnonzero(replaced)
+
+        if len(self.lengths) == 1:
+            # a single string: one draw without replacement from the pool
+            members = np.arange(self.lengths[0]) if pool is None else np.flatnonzero(pool)
+            count = min(int(np_rng.poisson(len(members) / 2)), len(members))
+            return members[np_rng.choice(len(members), count, replace=False, shuffle=False)]
+
+        if pool is None:
+            # a poisson of half of each segment
+            counts = np.minimum(np_rng.poisson(self.lengths / 2), self.lengths)
+            return sample_per_segment(self.segment_of, self.offsets, counts, np_rng)[0]
+
+        members = np.flatnonzero(pool)
+        segment_of = self.segment_of[members]
+        sizes = np.bincount(segment_of, minlength=len(self.lengths))
+        counts = np.minimum(np_rng.poisson(sizes / 2), sizes)
+        chosen = sample_per_segment(segment_of, np.r_[0, np.cumsum(sizes)], counts, np_rng)[0]
+        return members[chosen]
+
+    def apply(self, t, sim, pool=None):
+        '''
+        apply(timestep, simulation, pool_mask)
+        replace the chosen nucleosomes of sim with U
+        '''
+        sim.update_many(t, self.select(sim.np_rng, pool), States.U_STATE)
+
+class RecruitmentOperator:
+    '''
+    RecruitmentOperator class
+    convert the recruitment sites of every active schedule to M
+    '''
+
+    def __init__(self, inputs, lengths):
+        '''
+        initialization function
+        lengths of the segments of the state array
+        '''
+        self.enabled = inputs['r'] != Recruit.NONE
+        lengths = np.asarray(lengths, dtype=np.intp)
+        offsets = np.r_[0, np.cumsum(lengths)]
+
+        # sites with the same schedule are converted together
+        groups = {}
+        for center, width, start, duration, period in get_sites(inputs):
+            schedule = Schedule(start, duration, period)
+            group = groups.setdefault(schedule.key(), (schedule, []))
+            for l in range(len(lengths)):
+                length = int(lengths[l])
+                first = int((length / 2 if center is None else center) - width / 2)
+                local = np.arange(max(first, 0), min(first + width, length))
+                group[1].append(offsets[l] + local)
+
+        self.schedules = []
+        self.sites = []
+        for schedule, indicies in groups.values():
+            self.schedules.append(schedule)
+            self.sites.append(np.unique(np.concatenate(indicies)).astype(np.intp))
+
+        # active sites of the last set of active schedules
+        self.cached = (None, np.zeros(shape=(0), dtype=np.intp))
+
+    def active_sites(self, t):
+        '''
+        active_sites(timestep)
+        indicies of all sites recruiting at timestep t
+        '''
+        if not self.enabled:
+            return self.cached[1][:0]
+
+        active = tuple(k for k, schedule in enumerate(self.schedules) if schedule.active(t))
+        if active != self.cached[0]:
+            if len(active) == 1:
+                sites = self.sites[active[0]]
+            else:
+                sites = np.unique(np.concatenate([ self.sites[k] for k in active ] + [ self.cached[1][:0] ]))
+            self.cached = (active, sites)
+
+        return self.cached[1]
+
+    def is_active(self, t):
+        '''
+        is_active(timestep)
+        check if any site recruits at timestep t
+        '''
+        return self.enabled and any(schedule.active(t) for schedule in self.schedules)
+
+    def next_start(self, t):
+        '''
+        next_start(timestep)
+        first timestep at or after t at which a site recruits, None if never
+        '''
+        if not self.enabled:
+            return None
+        starts = [ s for s in (schedule.next_start(t) for schedule in self.schedules) if s is not None ]
+        return min(starts) if len(starts) > 0 else None
+
+    def may_change(self, t, states):
+        '''
+        may_change(timestep, states)
+        True if a schedule active after t has sites that are not M
+        '''
+        if not self.enabled:
+            return False
+        for schedule, sites in zip(self.schedules, self.sites):
+            if schedule.ends_after(t) and np.any(states[sites] != States.M_STATE):
+                return True
+        return False
+
+    def mask(self, n):
+        '''
+        mask(N_nucs)
+        boolean mask of every site of every schedule
+        '''
+        mask = np.zeros(shape=(n), dtype=bool)
+        for sites in self.sites:
+            mask[sites] = True
+        return mask
+
+    def apply(self, t, sim, pool=None):
+        '''
+        apply(timestep, simulation, pool_mask)
+        recruit CR to the active sites of sim, if any
+        '''
+        sites = self.active_sites(t)
+        if len(sites) == 0:
+            return
+        if pool is not None:
+            sites = sites[pool[sites]]
+        sim.recruit(t, sites)
+
+def get_sites(inputs):
+    '''
+    get_sites(inputs)
+    (center, width, start, duration, period) of every recruitment site
+    a center of None is the middle of the string
+    '''
+    data = inputs['data']
+    if data['recruit_schedule'] is not None:
+        return [ tuple(site) for site in data['recruit_schedule'] ]
+
+    centers = data['recruit_centers'] or [ None ]
+    return [ (center, data['recruit_n'], data['recruit_time_init'], data['recruit_time'], data['recruit_period'])
+            for center in centers ]
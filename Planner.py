@@ -0,0 +1,548 @@
+## Planner.py
+## Author: Aparna Rajpurkar
+
+# planning of a run before anything is allocated
+# estimates peak memory, disk output and runtime from the inputs, with
+# calibration constants from quick micro-benchmarks on this host.
+# with --plan check, runs that do not fit the limits are refused with an
+# explanation; with --plan auto the kernel representation, the kernel
+# precision and the trajectory recording (format, keyframe stride and
+# compression) are chosen so the run fits
+#
+# kernel representations of this tree: one stored block per domain
+# (the whole string is one dense block without domains, a banded one with
+# domains), in float64, float32 or uint16, rows computed when needed,
+# or hierarchical blocks (float64, to the --kernel-tol tolerance)
+
+# imports
+import math
+import os
+import shutil
+import sys
+import time
+import numpy as np
+import Chromatin
+import Constants
+import Kernel
+import Trajectory
+from MyEnum import Output, Precision, KernelRep, Plan, TimeStep, Replicas, Backpressure, ProbSpread, DomainBleed
+
+MB = 1 << 20
+
+# python interpreter, numpy and module overhead
+BASE_MEMORY = 64 * MB
+
+# memory of one nucleosome in a Chromatin object (Nucleosome object, lists, arrays)
+NUC_BYTES = 220
+
+# float64 temporaries of calc_prob_block(), in blocks of its output
+BUILD_TEMPORARIES = 9
+
+# leave some memory to the rest of the host
+MEMORY_HEADROOM = 0.8
+
+# conservative gzip ratios of text trajectories and event logs
+COMPRESS_RATIO = { Output.TEXT:4, Output.EVENTS:1.5 }
+
+# keyframe strides tried by --plan auto, in multiples of the keyframe option
+KEYFRAME_STRIDES = (1, 10, 100)
+
+# size of the calibration runs
+CAL_N = 1000
+CAL_ROWS = 256
+CAL_EVENTS = 200
+CAL_STEPS = 20
+
+# calibration constants, measured once per process
+_calibration = None
+
+class PlanError(Exception):
+    '''
+    PlanError class
+    a run that does not fit the limits, with the reasons why
+    '''
+    def __init__(self, reasons, suggestion=None):
+        self.reasons = reasons
+        self.suggestion = suggestion
+
+def best_time(func, repeats=3):
+    '''
+    best_time(function, repeats)
+    fastest of a few calls, in seconds
+    '''
+    best = float("inf")
+    for r in range(repeats):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+def calibrate():
+    '''
+    calibrate()
+    micro-benchmarks of the parts of a timestep whose cost grows with the inputs
+    returns a dictionary of seconds per:
+        'mac'   multiply-add of a field, per kernel precision
+        'entry' kernel entry computed by calc_prob_block() for a few rows
+        'build' kernel entry of a whole block, which is slower per entry
+        'hm_build' stored entry of a hierarchical kernel, built
+        'hm_field' stored entry of a hierarchical kernel, in a field of every row
+        'event' event of step_events()
+        'step'  timestep without events
+        'byte'  byte of a text frame
+    '''
+    global _calibration
+    if _calibration is not None:
+        return _calibration
+
+    cal = {}
+
+    # field sums of CAL_ROWS rows of a CAL_N wide block
+    block = Kernel.calc_prob_block(range(CAL_ROWS), range(CAL_N), 0, CAL_N, 0, CAL_N, 0)
+    vec = (np.arange(CAL_N) % 3 == 0).astype(np.uint8)
+    rows = np.arange(CAL_ROWS)
+    cal['mac'] = {}
+    for storage in (Precision.FLOAT64, Precision.FLOAT32, Precision.FLOAT16, Precision.UINT16):
+        stored, scale = Kernel.quantize(block, storage)
+        cal['mac'][storage] = best_time(lambda: (stored[rows].astype(np.float64) @ vec.astype(np.float64)) * scale) / block.size
+
+    cal['entry'] = best_time(lambda: Kernel.calc_prob_block(rows, range(CAL_N), 0, CAL_N, 0, CAL_N, 0)) / block.size
+    cal['build'] = best_time(lambda: Kernel.calc_prob_block(range(CAL_N), range(CAL_N), 0, CAL_N, 0, CAL_N, 0), 1) / CAL_N**2
+
+    # a hierarchical kernel of the same block
+    hmatrix = Kernel.HMatrixKernel(CAL_N, [(0, CAL_N)], DomainBleed.NONE, 0)
+    cal['hm_build'] = best_time(lambda: Kernel.HMatrixKernel(CAL_N, [(0, CAL_N)], DomainBleed.NONE, 0), 1) / hmatrix.entries
+    cal['hm_field'] = best_time(lambda: hmatrix.field(np.arange(CAL_N), vec)) / hmatrix.entries
+
+    # timesteps of a small string with and without events
+    inputs = calibration_inputs()
+    chromatin = Chromatin.Chromatin(inputs)
+    chromatin.init_timesim(CAL_N)
+
+    def steps(events):
+        chromatin.EVENTS_PER_TIMESTEP = events
+        for t in range(CAL_STEPS):
+            chromatin.step_events()
+
+    cal['step'] = best_time(lambda: steps(0)) / CAL_STEPS
+    cal['event'] = max(best_time(lambda: steps(CAL_EVENTS)) / CAL_STEPS - cal['step'], 0) / CAL_EVENTS
+
+    states = chromatin.states
+    cal['byte'] = best_time(lambda: Trajectory.TO_CHAR[states].tobytes().decode()) / CAL_N
+
+    _calibration = cal
+    return cal
+
+def calibration_inputs():
+    '''
+    calibration_inputs()
+    inputs of the calibration string: default options, CAL_N nucleosomes
+    '''
+    # imported here, Input imports nothing of the planner
+    import Input
+    inputs = Input.default_inputs()
+    inputs['n'] = CAL_N
+    inputs['o'] = os.devnull
+    Input.check_domains(inputs)
+    return inputs
+
+def available_memory():
+    '''
+    available_memory()
+    bytes of memory available on this host, or None if unknown
+    '''
+    try:
+        with open("/proc/meminfo", "r") as fp:
+            for line in fp:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+
+    try:
+        return os.sysconf("SC_AVPHYS_PAGES") * os.sysconf("SC_PAGE_SIZE")
+    except (ValueError, OSError, AttributeError):
+        return None
+
+def free_disk(outfile):
+    '''
+    free_disk(outfile)
+    bytes free on the filesystem of the outfile
+    '''
+    directory = os.path.dirname(os.path.abspath(outfile))
+    return shutil.disk_usage(directory).free
+
+def get_limits(inputs):
+    '''
+    get_limits(inputs)
+    (memory bytes, disk bytes, seconds) a run may use; None is no limit
+    '''
+    data = inputs['data']
+
+    if data['max_memory'] is not None:
+        memory = data['max_memory'] * MB
+    else:
+        memory = available_memory()
+        if memory is not None:
+            memory *= MEMORY_HEADROOM
+
+    if data['max_disk'] is not None:
+        disk = data['max_disk'] * MB
+    else:
+        disk = free_disk(inputs['o'])
+
+    seconds = None
+    if data['max_hours'] is not None:
+        seconds = data['max_hours'] * 3600
+
+    return memory, disk, seconds
+
+def strings(inputs):
+    '''
+    strings(inputs)
+    (length, kernel limits) of every distinct string length of a run
+    '''
+    adv = inputs['adv']
+    data = inputs['data']
+    if data['loci'] is None:
+        lengths = [ inputs['n'] ]
+        sizes = data['domain_sizes']
+    else:
+        lengths = sorted(set(data['loci']))
+        sizes = None
+    return [ (n, Kernel.domain_limits(adv['domain'], n, data['domains'], sizes)) for n in lengths ]
+
+def ensemble_replicas(inputs):
+    '''
+    ensemble_replicas(inputs)
+    most replicas an ensemble of the inputs runs
+    '''
+    if inputs['adv']['replicas'] == Replicas.FIXED:
+        return inputs['data']['replicas']
+    return inputs['data']['replicas_max']
+
+def lineage_cells(inputs):
+    '''
+    lineage_cells(inputs)
+    (cell timesteps, cells) simulated in lineage mode
+    '''
+    data = inputs['data']
+    div = data['divisions']
+    cell_steps = 0
+    cells = 1
+    total_cells = 0
+    first = 0
+    while first < inputs['t'] and cells > 0:
+        last = (first // div + 1) * div
+        cell_steps += cells * (min(last, inputs['t'] - 1) - first + 1)
+        total_cells += cells
+        cells = min(data['lineage_max'], int(math.ceil(2 * cells * data['lineage_sample'])))
+        first = last + 1
+    return cell_steps, total_cells
+
+class RunPlan:
+    '''
+    RunPlan class
+    settings of a run and the estimates of what it needs
+    '''
+
+    def __init__(self, inputs, replicas, kernel, precision, output, keyframe, compress):
+        '''
+        initialization function
+        '''
+        self.kernel = kernel
+        self.precision = precision
+        self.output = output
+        self.keyframe = keyframe
+        self.compress = compress
+        self.replicas = replicas
+
+        self.memory = self.estimate_memory(inputs)
+        self.disk = self.estimate_disk(inputs)
+        self.runtime = None
+
+    def kernel_bytes(self, inputs):
+        '''
+        kernel_bytes(inputs)
+        (stored bytes, largest block of a string, widest window) of the kernels
+        '''
+        stored = 0
+        largest = 0
+        window = 0
+        itemsize = np.dtype(Kernel.DTYPES[self.precision]).itemsize
+        for n, limits in strings(inputs):
+            for rows, cols in Kernel.block_shapes(n, limits, inputs['adv']['domainbleed']):
+                if self.kernel == KernelRep.BLOCK:
+                    stored += rows * cols * itemsize
+                elif self.kernel == KernelRep.HMATRIX:
+                    stored += Kernel.hmatrix_entries(rows, cols) * Kernel.HM_ENTRY_BYTES
+                largest = max(largest, rows * cols)
+                window = max(window, cols)
+        return stored, largest, window
+
+    def estimate_memory(self, inputs):
+        '''
+        estimate_memory(inputs)
+        peak bytes of all processes of the run
+        '''
+        n = inputs['n']
+        t = inputs['t']
+        data = inputs['data']
+        adv = inputs['adv']
+
+        stored, largest, window = self.kernel_bytes(inputs)
+
+        # building the kernel: the blocks so far and the temporaries of the largest one
+        build = 0
+        if self.kernel == KernelRep.BLOCK:
+            build = stored + largest * 8 * BUILD_TEMPORARIES
+        elif self.kernel == KernelRep.HMATRIX:
+            # the factors and their packed copies
+            build = 2 * stored
+
+        # field rows of a timestep: every nucleosome with adaptive timesteps
+        events = int(Constants.get_max_events(Constants.get_timesteps_per_cellcycle(inputs)) * n)
+        rows = n if adv['timestep'] == TimeStep.ADAPTIVE else min(events, n)
+        if self.kernel == KernelRep.BLOCK:
+            itemsize = np.dtype(Kernel.DTYPES[self.precision]).itemsize
+            step = stored + rows * window * (itemsize + np.dtype(Kernel.DTYPES[adv['accumulate']]).itemsize)
+        elif self.kernel == KernelRep.HMATRIX:
+            # gathered entries of a field are at most the stored ones
+            step = 2 * stored
+        else:
+            step = rows * window * 8 * BUILD_TEMPORARIES
+
+        # one simulation: nucleosomes, traces, output queue
+        sim = n * NUC_BYTES + 2 * 4 * t
+        if adv['backpressure'] == Backpressure.BLOCK:
+            sim += (data['write_queue'] + 1) * Trajectory.WRITE_BLOCK
+
+        # statistics of a batch of replicas
+        if adv['lineage']:
+            # states of a generation and its daughters, one simulation per process
+            sim = data['lineage_max'] * 3 * n + data['procs'] * sim
+        else:
+            sim += 2 * 8 * t * (data['replica_batch'] + 3)
+
+        return BASE_MEMORY + max(build, step) + sim
+
+    def estimate_disk(self, inputs):
+        '''
+        estimate_disk(inputs)
+        bytes written by all replicas
+        '''
+        n = inputs['n']
+        t = inputs['t']
+
+        if inputs['adv']['lineage']:
+            # one line per cell, no trajectories
+            cell_steps, total_cells = lineage_cells(inputs)
+            return self.replicas * total_cells * (n + 64)
+
+        if self.output == Output.TEXT:
+            size = (n + 1) * t
+        else:
+            # every event counted as a conversion is an upper bound
+            events = int(Constants.get_max_events(Constants.get_timesteps_per_cellcycle(inputs)) * n)
+            keyframes = int(math.ceil(t / self.keyframe))
+            size = Trajectory.HEADER.size + keyframes * (Trajectory.KEYFRAME.size + n + Trajectory.INDEX_ENTRY.itemsize) + \
+                    t * (Trajectory.EVENTS.size + 4 * events) + Trajectory.TRAILER.size
+
+        if self.compress:
+            size /= COMPRESS_RATIO[self.output]
+
+        if inputs['data']['loci'] is not None:
+            # totals of every locus at every timestep
+            size += t * len(inputs['data']['loci']) * 3 * 4
+
+        return self.replicas * size
+
+    def estimate_runtime(self, inputs, cal):
+        '''
+        estimate_runtime(inputs, calibration)
+        seconds of all replicas, from the calibration constants
+        '''
+        n = inputs['n']
+        t = inputs['t']
+        data = inputs['data']
+
+        stored, largest, window = self.kernel_bytes(inputs)
+
+        events = int(Constants.get_max_events(Constants.get_timesteps_per_cellcycle(inputs)) * n)
+        rand_events, feedback_events = Chromatin.expected_events(events, 1/(inputs['f'] + 1), n)
+
+        if self.kernel == KernelRep.BLOCK:
+            # M and A fields
+            field = 2 * feedback_events * window * cal['mac'][self.precision]
+            build = stored / np.dtype(Kernel.DTYPES[self.precision]).itemsize * cal['build']
+        elif self.kernel == KernelRep.HMATRIX:
+            # a field touches every far field factor, and at most all entries
+            entries = stored / Kernel.HM_ENTRY_BYTES
+            field = 2 * entries * cal['hm_field'] if feedback_events > 0 else 0
+            build = entries * cal['hm_build']
+        else:
+            # rows are computed once and used for both fields
+            field = feedback_events * window * (cal['entry'] + 2 * cal['mac'][Precision.FLOAT64])
+            build = 0
+
+        if inputs['adv']['prob_spread'] == ProbSpread.POWERLAW:
+            # targeted spreading draws partners instead of summing fields
+            field = 0
+
+        step = cal['step'] + events * cal['event'] + field
+        # adaptive timesteps are estimated as fixed ones: leaps only make them faster
+
+        if inputs['adv']['lineage']:
+            cell_steps, total_cells = lineage_cells(inputs)
+            return self.replicas * (build + cell_steps * step / data['procs'])
+
+        frame = 0
+        if self.output == Output.TEXT:
+            frame = (n + 1) * cal['byte']
+
+        return self.replicas * (build + t * (step + frame))
+
+    def fits(self, limits):
+        '''
+        fits(limits)
+        reasons the plan does not fit the limits, empty if it fits
+        '''
+        memory, disk, seconds = limits
+        reasons = []
+        if memory is not None and self.memory > memory:
+            reasons.append("peak memory " + format_bytes(self.memory) + " > limit " + format_bytes(memory))
+        if disk is not None and self.disk > disk:
+            reasons.append("output " + format_bytes(self.disk) + " > limit " + format_bytes(disk))
+        if seconds is not None and self.runtime is not None and self.runtime > seconds:
+            reasons.append("runtime " + format_hours(self.runtime) + " > limit " + format_hours(seconds))
+        return reasons
+
+    def apply(self, inputs):
+        '''
+        apply(inputs)
+        set the chosen settings in the inputs
+        '''
+        inputs['adv']['kernel'] = self.kernel
+        inputs['adv']['kernel_precision'] = self.precision
+        inputs['adv']['output'] = self.output
+        inputs['data']['keyframe'] = self.keyframe
+        inputs['adv']['compress'] = self.compress
+
+    def options(self):
+        '''
+        options()
+        the settings as command line options
+        '''
+        opts = [ "--kernel " + KernelRep.enum_to_string(self.kernel) ]
+        if self.kernel == KernelRep.BLOCK:
+            opts.append("--kernel-precision " + Precision.enum_to_string(self.precision))
+        opts.append("--output " + Output.enum_to_string(self.output))
+        if self.output == Output.EVENTS:
+            opts.append("--keyframe " + str(self.keyframe))
+        if self.compress:
+            opts.append("--compress")
+        return " ".join(opts)
+
+def format_bytes(size):
+    '''
+    format_bytes(bytes)
+    '''
+    for unit in ("B", "KB", "MB", "GB", "TB"):
+        if size < 1024 or unit == "TB":
+            return str(round(size, 1)) + " " + unit
+        size /= 1024
+
+def format_hours(seconds):
+    '''
+    format_hours(seconds)
+    '''
+    if seconds < 60:
+        return str(round(seconds, 1)) + " s"
+    if seconds < 3600:
+        return str(round(seconds / 60, 1)) + " min"
+    return str(round(seconds / 3600, 1)) + " h"
+
+def candidates(inputs, replicas):
+    '''
+    candidates(inputs, replicas)
+    plans --plan auto may choose from, cheapest changes first:
+    smaller kernel precisions before computing kernel rows, then
+    hierarchical kernels, and
+    event logs with longer keyframe strides and compression before
+    giving up on a trajectory
+    '''
+    adv = inputs['adv']
+    keyframe = inputs['data']['keyframe']
+    t = inputs['t']
+
+    kernels = [ (adv['kernel'], adv['kernel_precision']) ]
+    if adv['kernel'] == KernelRep.BLOCK:
+        for precision in (Precision.FLOAT32, Precision.UINT16):
+            if np.dtype(Kernel.DTYPES[precision]).itemsize < np.dtype(Kernel.DTYPES[adv['kernel_precision']]).itemsize:
+                kernels.append((KernelRep.BLOCK, precision))
+        kernels.append((KernelRep.ROWS, Precision.FLOAT64))
+    if adv['kernel'] != KernelRep.HMATRIX:
+        kernels.append((KernelRep.HMATRIX, Precision.FLOAT64))
+
+    outputs = [ (adv['output'], keyframe, adv['compress']) ]
+    for stride in KEYFRAME_STRIDES:
+        for compress in (adv['compress'], True):
+            outputs.append((Output.EVENTS, min(keyframe * stride, t), compress))
+
+    plans = []
+    for output, keyframe, compress in outputs:
+        for kernel, precision in kernels:
+            plans.append(RunPlan(inputs, replicas, kernel, precision, output, keyframe, compress))
+    return plans
+
+def plan(inputs, replicas=1):
+    '''
+    plan(inputs, number_of_replicas)
+    estimate the needs of a run of the inputs. With --plan auto, pick the
+    first plan that fits the limits
+    returns a RunPlan, or raises PlanError if the run does not fit
+    '''
+    limits = get_limits(inputs)
+    cal = calibrate()
+
+    requested = RunPlan(inputs, replicas, inputs['adv']['kernel'], inputs['adv']['kernel_precision'],
+            inputs['adv']['output'], inputs['data']['keyframe'], inputs['adv']['compress'])
+    requested.runtime = requested.estimate_runtime(inputs, cal)
+
+    reasons = requested.fits(limits)
+    if not reasons:
+        return requested
+
+    for choice in candidates(inputs, replicas):
+        choice.runtime = choice.estimate_runtime(inputs, cal)
+        if not choice.fits(limits):
+            if inputs['adv']['plan'] == Plan.AUTO:
+                return choice
+            raise PlanError(reasons, choice.options())
+
+    raise PlanError(reasons)
+
+def plan_or_exit(inputs, replicas=1):
+    '''
+    plan_or_exit(inputs, number_of_replicas)
+    plan a run from the command line: print the plan and set its
+    settings in the inputs, or explain why the run is refused and exit
+    '''
+    if inputs['adv']['plan'] == Plan.NONE:
+        return
+
+    try:
+        run_plan = plan(inputs, replicas)
+    except PlanError as e:
+        print("PlanError: the run does not fit:", "; ".join(e.reasons), file=sys.stderr)
+        if e.suggestion is not None:
+            print("\tit would fit with:", e.suggestion, "(or --plan auto)", file=sys.stderr)
+        else:
+            print("\tno kernel representation, precision or trajectory output fits; reduce -n, -t or the replicas", file=sys.stderr)
+        sys.exit(2)
+
+    run_plan.apply(inputs)
+
+    print("Plan:", run_plan.options())
+    print("\tpeak memory:", format_bytes(run_plan.memory), "output:", format_bytes(run_plan.disk),
+            "runtime:", format_hours(run_plan.runtime), "for", replicas, "replicas" if replicas != 1 else "replica")
@@ -0,0 +1,306 @@
+## Render.py
+## Author: Aparna Rajpurkar
+
+# small multiples video of an ensemble
+# K replica trajectories are drawn as a grid of nucleosome panels above a
+# dashboard of the A and M percentages of the ensemble (mean +- SD band),
+# and every frame is piped to ffmpeg as raw RGB in a single pass.
+# matplotlib draws the static layout (titles, axes, labels, division lines)
+# once; each frame is then colored with numpy lookups into a copy of that
+# background:
+#   panels:    one precomputed index from every panel pixel to a nucleosome
+#              of the concatenated states of all replicas, then a color table
+#   dashboard: the new pixel columns of the band and mean lines
+# text trajectories are memory-mapped, event logs and gzipped files are
+# streamed with their readers
+
+# imports
+import io
+import math
+import os
+import subprocess
+import numpy as np
+import matplotlib.image as mpimg
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+import Constants
+import Trajectory
+from MyEnum import States
+
+# frames per second of the video, as in Animate.py
+FPS = 200
+
+# length of the video in seconds when no frame stride is given: long
+# trajectories keep every k-th frame so the video stays watchable
+VIDEO_SECONDS = 60
+
+# width of the video in pixels and dots per inch of the layout
+WIDTH = 1280
+DPI = 100
+
+# share of the height taken by the dashboard
+DASHBOARD_SHARE = 0.3
+
+# opacity of the SD band and thickness of the mean lines in pixels
+BAND_ALPHA = 0.3
+LINE_WIDTH = 2
+
+# colors of every state enum, then of the background of the panels
+BACKGROUND = len(States.get_enums())
+COLOR_LUT = np.array([ Constants.state_to_color(s) or Constants.GRAY for s in States.get_enums() ] + [ (1, 1, 1) ])
+COLOR_LUT = np.rint(COLOR_LUT * 255).astype(np.uint8)
+
+# colors of the percentages in the dashboard, as in Animate.py
+TRACE_COLORS = { States.A_STATE:(1, 0, 0), States.M_STATE:(0, 0, 1) }
+
+def open_frames(filename):
+    '''
+    open_frames(filename)
+    (number of frames, iterator of frames, reader) of a trajectory
+    uncompressed text trajectories are memory-mapped
+    '''
+    traj = Trajectory.open_trajectory(filename)
+
+    if isinstance(traj, Trajectory.TextReader) and not isinstance(traj.fp, io.BytesIO):
+        raw = np.memmap(filename, dtype=np.uint8, mode="r", shape=(traj.num_frames, traj.n + 1))
+        frames = (Trajectory.FROM_CHAR[raw[t, :traj.n]] for t in range(traj.num_frames))
+        return traj.num_frames, frames, traj
+
+    return traj.num_frames, traj.iter_frames(), traj
+
+def grid_shape(count):
+    '''
+    grid_shape(count)
+    (rows, columns) of a near square grid of count cells
+    '''
+    cols = math.ceil(math.sqrt(count))
+    return math.ceil(count / cols), cols
+
+def pixel_box(ax, height):
+    '''
+    pixel_box(axes, canvas_height)
+    (top, bottom, left, right) of the inside of an axes, in array coordinates
+    '''
+    x0, y0, x1, y1 = ax.get_window_extent().extents
+    return (int(math.ceil(height - y1)) + 1, int(height - y0) - 1, int(math.ceil(x0)) + 1, int(x1) - 1)
+
+def panel_index(box, width, n, offset, sentinel):
+    '''
+    panel_index(pixel_box, canvas_width, N_nucs, first_state, background_state)
+    flat canvas positions of the pixels of a panel and the position of the
+    state each pixel shows. Nucleosomes fill the panel in reading order,
+    in square cells as large as fit
+    '''
+    top, bottom, left, right = box
+    h = max(bottom - top, 1)
+    w = max(right - left, 1)
+
+    rows, cols = grid_shape(n)
+    size = min(w / cols, h / rows)
+    # center the grid in the panel
+    pad_y = (h - rows * size) / 2
+    pad_x = (w - cols * size) / 2
+
+    py, px = np.indices((h, w))
+    r = np.floor((py - pad_y) / size).astype(np.intp)
+    c = np.floor((px - pad_x) / size).astype(np.intp)
+    k = r * cols + c
+    inside = (r >= 0) & (r < rows) & (c >= 0) & (c < cols) & (k < n)
+
+    pixels = (top + py) * width + left + px
+    return pixels.ravel(), np.where(inside, offset + k, sentinel).ravel()
+
+class EnsembleRenderer:
+    '''
+    EnsembleRenderer class
+    layout and per frame drawing of K replicas of n nucleosomes
+    '''
+
+    def __init__(self, names, n, num_frames, div_count=0, width=WIDTH):
+        '''
+        initialization function
+        names of the replicas, frames of the shortest one
+        '''
+        self.k = len(names)
+        self.n = n
+        self.num_frames = num_frames
+
+        rows, cols = grid_shape(self.k)
+        panel = width / cols
+        height = rows * panel / (1 - DASHBOARD_SHARE)
+
+        # figure sizes in whole, even pixels, as yuv420p needs
+        self.fig = Figure(figsize=(2 * (width // 2) / DPI, 2 * int(height // 2) / DPI), dpi=DPI)
+        canvas = FigureCanvasAgg(self.fig)
+        grid = self.fig.add_gridspec(rows + 1, cols, height_ratios=[1] * rows + [rows * DASHBOARD_SHARE / (1 - DASHBOARD_SHARE)])
+
+        panels = []
+        for r in range(self.k):
+            ax = self.fig.add_subplot(grid[r // cols, r % cols])
+            ax.set_xticks([])
+            ax.set_yticks([])
+            ax.set_title(names[r], fontsize=6, pad=2)
+            panels.append(ax)
+
+        # dashboard of the ensemble
+        self.ax = self.fig.add_subplot(grid[rows, :])
+        self.ax.set_ylim([-5, 105])
+        self.ax.set_xlim(0, max(num_frames - 1, 1))
+        self.ax.set_xlabel("Timesteps")
+        self.ax.set_ylabel("% Nucleosomes")
+        self.ax.set_title("N = " + str(n) + ", " + str(self.k) + " replicas, mean +- SD", fontsize=8)
+        if div_count != 0:
+            for t in range(div_count, num_frames, div_count):
+                self.ax.axvline(t, lw=1, ls="dotted", color="black")
+        for state, color in TRACE_COLORS.items():
+            self.ax.plot([], [], lw=2, color=color, label=States.enum_to_string(state))
+        self.ax.legend(loc="upper right", fontsize=6)
+
+        self.fig.subplots_adjust(left=0.06, right=0.98, top=0.97, bottom=0.05, hspace=0.3, wspace=0.05)
+        canvas.draw()
+        self.background = np.asarray(canvas.buffer_rgba())[:, :, :3].copy()
+        self.height, self.width = self.background.shape[:2]
+        self.canvas = self.background.copy()
+
+        # panel pixels and the states they show
+        self.states = np.full(shape=(self.k * n + 1), fill_value=BACKGROUND, dtype=np.uint8)
+        pixels = []
+        sources = []
+        for r, ax in enumerate(panels):
+            p, s = panel_index(pixel_box(ax, self.height), self.width, n, r * n, self.k * n)
+            pixels.append(p)
+            sources.append(s)
+        self.pixels = np.concatenate(pixels)
+        self.sources = np.concatenate(sources)
+
+        # dashboard pixels: columns of every frame and rows of percentages
+        self.dash = pixel_box(self.ax, self.height)
+        to_pixels = self.ax.transData.transform
+        x = to_pixels(np.c_[np.arange(num_frames), np.zeros(shape=(num_frames))])[:, 0]
+        self.columns = np.clip(np.rint(x).astype(np.intp), self.dash[2], self.dash[3] - 1)
+        (x0, y0), (x1, y100) = to_pixels([(0, 0), (0, 100)])
+        self.y0 = self.height - y0
+        self.y_scale = (y100 - y0) / 100
+        self.last_column = self.dash[2] - 1
+
+    def percent_rows(self, percent):
+        '''
+        percent_rows(percentages)
+        array rows of percentages in the dashboard
+        '''
+        return np.clip(np.rint(self.y0 - np.asarray(percent) * self.y_scale).astype(np.intp), self.dash[0], self.dash[1] - 1)
+
+    def update(self, t, frames):
+        '''
+        update(frame_number, list_of_K_frames)
+        take frame t of every replica and draw its dashboard column, if new
+        '''
+        n = self.n
+        for r, frame in enumerate(frames):
+            self.states[r * n:(r + 1) * n] = frame
+
+        # new columns of the dashboard: drawn on the background, then kept
+        column = self.columns[t]
+        if column <= self.last_column:
+            return
+        top, bottom = self.dash[0], self.dash[1]
+        pixels = self.background[top:bottom, column].astype(float)
+        rows = np.arange(top, bottom)
+
+        states = self.states[:self.k * n].reshape(self.k, n)
+        lines = []
+        for state, color in TRACE_COLORS.items():
+            percent = (states == state).mean(axis=1) * 100
+            mean = percent.mean()
+            sd = percent.std()
+            high, low = self.percent_rows([mean + sd, mean - sd])
+            band = (rows >= high) & (rows <= low)
+            pixels[band] = pixels[band] * (1 - BAND_ALPHA) + np.array(color) * 255 * BAND_ALPHA
+            lines.append((self.percent_rows(mean), color))
+
+        for row, color in lines:
+            line = (rows >= row - LINE_WIDTH // 2) & (rows < row - LINE_WIDTH // 2 + LINE_WIDTH)
+            pixels[line] = np.array(color) * 255
+
+        self.canvas[top:bottom, self.last_column + 1:column + 1] = np.rint(pixels).astype(np.uint8)[:, None]
+        self.last_column = column
+
+    def draw(self):
+        '''
+        draw()
+        color the panels with the current states, returns the canvas
+        '''
+        self.canvas.reshape(-1, 3)[self.pixels] = COLOR_LUT[self.states[self.sources]]
+        return self.canvas
+
+def start_ffmpeg(outfile, width, height, fps=FPS, ffmpeg="ffmpeg"):
+    '''
+    start_ffmpeg(outfile, width, height, frames_per_second, ffmpeg_binary)
+    ffmpeg process encoding raw RGB frames from its standard input
+    '''
+    command = [ ffmpeg, "-y", "-loglevel", "error",
+            "-f", "rawvideo", "-pix_fmt", "rgb24", "-s", str(width) + "x" + str(height), "-r", str(fps), "-i", "-",
+            "-an", "-vcodec", "libx264", "-pix_fmt", "yuv420p", outfile ]
+    try:
+        return subprocess.Popen(command, stdin=subprocess.PIPE)
+    except FileNotFoundError:
+        raise FileNotFoundError("ffmpeg not found: install it or give its path with --ffmpeg")
+
+def frame_stride(num_frames, fps=FPS, seconds=VIDEO_SECONDS):
+    '''
+    frame_stride(num_frames, frames_per_second, video_seconds)
+    smallest stride k such that every k-th frame fits in a video of the given length
+    '''
+    return max(1, math.ceil(num_frames / (fps * seconds)))
+
+def render(filenames, outfile, every=None, div_count=0, fps=FPS, ffmpeg="ffmpeg", width=WIDTH, seconds=VIDEO_SECONDS):
+    '''
+    render(trajectory_filenames, basefilename, frame_stride, timesteps_per_division, frames_per_second, ffmpeg_binary, width, video_seconds)
+    render every frame (or every k-th) of all replicas to outfile.mp4 in one pass,
+    and the last frame to outfile_dashboard.png. Without a stride, the
+    stride keeps the video within video_seconds
+    returns the number of frames rendered
+    '''
+    opened = [ open_frames(filename) for filename in filenames ]
+    n = opened[0][2].n
+    for filename, (num_frames, frames, traj) in zip(filenames, opened):
+        if traj.n != n:
+            raise ValueError(filename + " has " + str(traj.n) + " nucleosomes, not " + str(n))
+
+    # replicas stop at the shortest one
+    num_frames = min(entry[0] for entry in opened)
+    if every is None:
+        every = frame_stride(num_frames, fps, seconds)
+    names = [ os.path.basename(filename).split(".")[0] for filename in filenames ]
+    renderer = EnsembleRenderer(names, n, num_frames, div_count, width)
+
+    proc = start_ffmpeg(outfile + ".mp4", renderer.width, renderer.height, fps, ffmpeg)
+    count = 0
+    broken = False
+    try:
+        for t, frames in enumerate(zip(*[ entry[1] for entry in opened ])):
+            if t >= num_frames:
+                break
+            renderer.update(t, frames)
+            if t % every == 0:
+                try:
+                    proc.stdin.write(renderer.draw().data)
+                except (BrokenPipeError, OSError):
+                    # ffmpeg quit early; its exit code tells why
+                    broken = True
+                    break
+                count += 1
+    finally:
+        try:
+            proc.stdin.close()
+        except (BrokenPipeError, OSError):
+            broken = True
+        proc.wait()
+        for entry in opened:
+            entry[2].close()
+
+    if broken or proc.returncode != 0:
+        raise RuntimeError("ffmpeg exited with code " + str(proc.returncode) + " after " + str(count) + " frames")
+
+    mpimg.imsave(outfile + "_dashboard.png", renderer.draw())
+    return count
@@ -0,0 +1,162 @@
+## Simulation.py
+## Author: Aparna Rajpurkar
+
+# library interface to the simulation
+# lets other python code (pool workers, parameter sweeps) run simulations
+# without going through sys.argv. Plotting modules are only imported
+# if an animation is requested.
+
+# imports
+import copy
+import getopt
+import Input
+import Bank
+import Chromatin
+import Lineage
+import MultiLocus
+import Trajectory
+from MyEnum import Divisions
+
+class SimConfig:
+    '''
+    SimConfig class
+    typed configuration for a single simulation
+    keywords are the long command line options with "-" written as "_",
+    e.g. SimConfig(nucleosomes=100, Fval=2, divisions_num=50)
+    flags take True, lists take python lists
+    all values are checked exactly like the command line input
+    '''
+
+    def __init__(self, inputs=None, **options):
+        '''
+        initialization function
+        '''
+        if inputs is not None:
+            # start from an existing input dictionary
+            inputs = copy.deepcopy(inputs)
+
+        self.inputs = Input.parse_input(self.to_opts(options), inputs)
+
+        if self.inputs['o'] == "":
+            self.inputs['o'] = "sim"
+
+    @staticmethod
+    def to_opts(options):
+        '''
+        to_opts(option_dictionary)
+        convert keyword options to a getopt style list of (opt, arg)
+        '''
+        opts = []
+        for key, value in options.items():
+            opt = "--" + key.replace("_", "-")
+
+            if opt[2:] in Input.LONG_OPTS:
+                # option is a flag
+                if value:
+                    opts.append((opt, ""))
+            elif opt[2:] + "=" in Input.LONG_OPTS:
+                if isinstance(value, (list, tuple)):
+                    value = ",".join(str(x) for x in value)
+                opts.append((opt, str(value)))
+            else:
+                raise Input.InputError(opt, value, "unrecognized opt!")
+
+        return opts
+
+    @classmethod
+    def from_argv(cls, argv):
+        '''
+        from_argv(argument_list)
+        build a config from command line style arguments
+        '''
+        opts, args = getopt.getopt(argv, Input.SHORT_OPTS, Input.LONG_OPTS)
+        return cls(Input.parse_input(opts))
+
+    # typed accessors for the most used options
+    @property
+    def n(self):
+        return self.inputs['n']
+
+    @property
+    def timesteps(self):
+        return self.inputs['t']
+
+    @property
+    def fval(self):
+        return self.inputs['f']
+
+    @property
+    def outfile(self):
+        return self.inputs['o']
+
+class SimResult:
+    '''
+    SimResult class
+    what is left after a simulation has run
+    '''
+
+    def __init__(self, inputs, sim_num, chromatin, outfile):
+        '''
+        initialization function
+        '''
+        self.inputs = inputs
+        self.sim_num = sim_num
+        self.outfile = outfile
+
+        # final state of the string of nucleosomes
+        self.totals = dict(chromatin.totals)
+        self.states = chromatin.states.copy()
+
+        # totals of M and A of every frame written
+        self.trace_M = chromatin.trace_M[:chromatin.num_frames]
+        self.trace_A = chromatin.trace_A[:chromatin.num_frames]
+
+        # early termination, None if the simulation ran to the end
+        self.stop_time = chromatin.stop_time
+        self.stop_reason = chromatin.stop_reason
+
+def run_simulation(config, sim_num=0, animate=False):
+    '''
+    run_simulation(config, sim_num, animate)
+    run a single simulation and return a SimResult
+    config may be a SimConfig or an input dictionary from Input.get_input()
+    '''
+    if isinstance(config, SimConfig):
+        inputs = config.inputs
+    else:
+        inputs = config
+
+    # initialize Chromatin object and run simulation
+    # many loci are simulated together in one MultiLocus object
+    # lineage mode follows a population of cells in a Lineage object
+    if inputs['data']['loci'] is not None:
+        chromatin = MultiLocus.MultiLocus(inputs, sim_num)
+    elif inputs['adv']['lineage']:
+        chromatin = Lineage.Lineage(inputs, sim_num)
+    else:
+        chromatin = Chromatin.Chromatin(inputs, sim_num)
+        if inputs['data']['bank'] is not None:
+            # start from the end of a stored burn-in
+            chromatin.snapshot = Bank.get_snapshot(inputs, sim_num)
+    chromatin.timesim(inputs['n'], sim_num)
+
+    if inputs['adv']['lineage']:
+        # lineage mode only writes a record of every cell
+        outfile = Lineage.get_filename(inputs, sim_num)
+        animate = False
+    else:
+        outfile = Trajectory.get_filename(inputs, sim_num)
+
+    if animate:
+        # matplotlib is slow to import, only import it when animating
+        from Animate import animate_from_file
+
+        # get number of divisions
+        div = 0
+        if inputs['d'] != Divisions.NONE:
+            div = inputs['data']['divisions']
+
+        # animate plot using output file from simulation
+        animate_from_file(outfile, inputs['n'], inputs['f'], inputs['t'], inputs['o'], div)
+
+    return SimResult(inputs, sim_num, chromatin, outfile)
@@ -0,0 +1,156 @@
+## Spreading.py
+## Author: Aparna Rajpurkar
+
+# targeted spreading (--prob-spread powerlaw)
+# a modified nucleosome with a feedback event picks a partner at a power law
+# distance inside its domain and converts it, instead of summing a field.
+# distances come from alias tables, which draw in O(1) per sample.
+# a table covers 1..L for the longest one-sided distance L of a domain;
+# shorter limits are drawn from the same table by rejection, which keeps
+# the truncated distribution exact. Acceptance is at least 1 / zeta(power),
+# e.g. 0.61 for power 2, so few rounds are needed. Tables are cached per
+# (L, power) and shared by all simulations of a process
+
+# imports
+import numpy as np
+
+# rounds of rejection before the remaining draws use a table of their own limit
+MAX_REJECTIONS = 8
+
+# alias tables by (length, power)
+_tables = {}
+
+class AliasTable:
+    '''
+    AliasTable class
+    Vose's alias method: draw index k with probability weights[k] / sum(weights)
+    '''
+
+    def __init__(self, weights):
+        '''
+        initialization function
+        '''
+        weights = np.asarray(weights, dtype=np.float64)
+        size = len(weights)
+        scaled = weights * size / weights.sum()
+
+        self.size = size
+        self.prob = np.ones(shape=(size))
+        self.alias = np.arange(size)
+
+        small = [ k for k in range(size) if scaled[k] < 1 ]
+        large = [ k for k in range(size) if scaled[k] >= 1 ]
+        while small and large:
+            s = small.pop()
+            l = large.pop()
+            self.prob[s] = scaled[s]
+            self.alias[s] = l
+            scaled[l] -= 1 - scaled[s]
+            if scaled[l] < 1:
+                small.append(l)
+            else:
+                large.append(l)
+
+        # whatever is left has probability 1 up to rounding
+
+    def draw(self, count, np_rng):
+        '''
+        draw(count, generator)
+        count indicies in one vectorized batch
+        '''
+        col = np_rng.integers(self.size, size=count)
+        return np.where(np_rng.random(count) < self.prob[col], col, self.alias[col])
+
+def power_law_table(length, power):
+    '''
+    power_law_table(length, power_constant)
+    cached alias table of distances 1..length with weights 1 / d ** power
+    index k of the table is distance k + 1
+    '''
+    key = (length, power)
+    if key not in _tables:
+        _tables[key] = AliasTable(1 / np.arange(1, length + 1, dtype=float) ** power)
+    return _tables[key]
+
+def truncated_distances(limits, length, power, np_rng):
+    '''
+    truncated_distances(limits, length, power_constant, generator)
+    one distance in 1..limits[k] for every k, from the table of 1..length
+    every limit must be between 1 and length
+    '''
+    limits = np.asarray(limits, dtype=np.intp)
+    dist = np.zeros(shape=(len(limits)), dtype=np.intp)
+    todo = np.arange(len(limits))
+    table = power_law_table(length, power)
+
+    for r in range(MAX_REJECTIONS):
+        if len(todo) == 0:
+            return dist
+        draws = table.draw(len(todo), np_rng) + 1
+        ok = draws <= limits[todo]
+        dist[todo[ok]] = draws[ok]
+        todo = todo[~ok]
+
+    # limits much shorter than the table: draw from their own tables
+    for k in todo:
+        dist[k] = power_law_table(int(limits[k]), power).draw(1, np_rng)[0] + 1
+
+    return dist
+
+def truncated_offsets(limit_neg, limit_pos, power, np_rng, length=None):
+    '''
+    truncated_offsets(negative_limits, positive_limits, power_constant, generator, table_length)
+    signed power law offsets, as Constants.truncated_power_law():
+    negative with probability limit_neg / (limit_neg + limit_pos), then a distance
+    from the power law truncated at the limit of that direction
+    offsets are 0 where both limits are 0
+    '''
+    limit_neg = np.asarray(limit_neg, dtype=np.intp)
+    limit_pos = np.asarray(limit_pos, dtype=np.intp)
+    total = limit_neg + limit_pos
+    if length is None:
+        length = int(max(limit_neg.max(initial=0), limit_pos.max(initial=0)))
+
+    offsets = np.zeros(shape=(len(total)), dtype=np.intp)
+    has = np.flatnonzero(total > 0)
+    if len(has) == 0:
+        return offsets
+
+    neg = np_rng.random(len(has)) * total[has] < limit_neg[has]
+    limits = np.where(neg, limit_neg[has], limit_pos[has])
+    dist = truncated_distances(limits, length, power, np_rng)
+    offsets[has] = np.where(neg, -dist, dist)
+
+    return offsets
+
+class PartnerSampler:
+    '''
+    PartnerSampler class
+    draws spreading partners for a string of nucleosomes with domains
+    '''
+
+    def __init__(self, n, limits, power):
+        '''
+        initialization function
+        limits follow the convention of Kernel.domain_limits()
+        '''
+        self.power = power
+        self.limit_neg = np.zeros(shape=(n), dtype=np.intp)
+        self.limit_pos = np.zeros(shape=(n), dtype=np.intp)
+
+        for left, right in limits:
+            idx = np.arange(left, min(right, n - 1) + 1)
+            self.limit_neg[idx] = idx - left
+            self.limit_pos[idx] = min(right, n - 1) - idx
+
+        # one table for the longest distance of any domain
+        self.length = int(max(self.limit_neg.max(initial=0), self.limit_pos.max(initial=0)))
+
+    def draw(self, sources, np_rng):
+        '''
+        draw(nucleosome_indicies, generator)
+        one partner per source, -1 if the domain of a source has no other nucleosome
+        '''
+        sources = np.asarray(sources, dtype=np.intp)
+        offsets = truncated_offsets(self.limit_neg[sources], self.limit_pos[sources], self.power, np_rng, self.length)
+        return np.where(offsets != 0, sources + offsets, -1)
@@ -0,0 +1,95 @@
+## Stopping.py
+## Author: Aparna Rajpurkar
+
+# stopping rules for early termination of a simulation
+# checked once per timestep on the totals of each state; the absorb rule
+# asks the simulation whether its state can still change
+
+# imports
+import numpy as np
+from MyEnum import States, Stop
+
+def gap_score(m, a):
+    '''
+    gap_score(M_count, A_count)
+    (M - A) / (M + A), same as process_sims.pl. 0 if there is no M or A
+    '''
+    if m + a == 0:
+        return 0
+    return (m - a) / (m + a)
+
+class StopRules:
+    '''
+    StopRules class
+    decide when a simulation can stop early
+    '''
+
+    def __init__(self, inputs):
+        '''
+        initialization function
+        '''
+        self.rules = inputs['adv']['stop']
+        self.n = inputs['n']
+
+        self.window = inputs['data']['stop_window']
+        self.tol = inputs['data']['stop_tol']
+        self.thresh = inputs['data']['stop_thresh']
+
+        # ring buffer of the last two windows of gap scores
+        self.gaps = np.zeros(shape=(2 * self.window))
+        self.sum_old = 0
+        self.sum_new = 0
+        self.count = 0
+
+        # M and A totals of the first check; the plateau windows start
+        # once the string leaves them
+        self.initial = None
+
+    def check(self, totals, is_absorbing):
+        '''
+        check(totals, is_absorbing_function)
+        check all rules for the current timestep
+        is_absorbing() is only called by the absorb rule, as it is not cheap
+        returns the reason to stop or None
+        '''
+        m = totals[States.M_STATE]
+        a = totals[States.A_STATE]
+
+        if Stop.ABSORB in self.rules:
+            # no event can change the state any more
+            if is_absorbing():
+                return Stop.enum_to_string(Stop.ABSORB)
+
+        if Stop.PASSAGE in self.rules:
+            # first passage through the M threshold used to call a gene off
+            if m / self.n >= self.thresh:
+                return Stop.enum_to_string(Stop.PASSAGE)
+
+        if Stop.PLATEAU in self.rules:
+            # the initial state is flat until the first conversions
+            if self.initial is None:
+                self.initial = (m, a)
+            if self.count == 0 and (m, a) == self.initial:
+                return None
+
+            # compare the mean gap score of the last window to the one before
+            w = self.window
+            i = self.count % (2 * w)
+            gap = gap_score(m, a)
+
+            # the value leaving the new window enters the old window
+            if self.count >= w:
+                moving = self.gaps[(i - w) % (2 * w)]
+                self.sum_new -= moving
+                self.sum_old += moving
+            if self.count >= 2 * w:
+                self.sum_old -= self.gaps[i]
+
+            self.gaps[i] = gap
+            self.sum_new += gap
+            self.count += 1
+
+            if self.count >= 2 * w and abs(self.sum_new - self.sum_old) / w < self.tol:
+                return Stop.enum_to_string(Stop.PLATEAU)
+
+        return None
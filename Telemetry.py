@@ -0,0 +1,340 @@
+## Telemetry.py
+## Author: Aparna Rajpurkar
+
+# live telemetry of running simulations (--telemetry <FILE>)
+# JSON lines, at most one per replica every --telemetry-interval seconds:
+#   {"kind": "replica", "run": host-pid, "sim": 3, "t": 1200, "T": 10000,
+#    "steps_per_s": 850.2, "totals": {"M": 40, "U": 12, "A": 8},
+#    "lim": 60, "timers": 0, "rss_mb": 81.3, "eta_s": 10.4, "time": ...,
+#    "interval": 10, "ensemble": {"done": 2, "total": 100, "eta_s": 1500.0}}
+# "ensemble" lines follow finished replicas, "lineage" lines generations,
+# and a "done" line ends every replica.
+# the simulation loop only compares the timestep with next_check; the clock
+# is read when the timestep reaches it, and next_check is set from the step
+# rate so that happens about once per interval.
+# lines are appended with single os.write() calls, so many runs can share a file
+# MainTelemetry.py tails and summarizes the stream
+
+# imports
+import json
+import os
+import resource
+import socket
+import time
+from MyEnum import States
+
+# seconds between lines of a replica
+INTERVAL = 10
+
+# telemetry of this process, see get_telemetry()
+_telemetry = None
+
+def rss_mb():
+    '''
+    rss_mb()
+    resident memory of this process in MB
+    '''
+    try:
+        with open("/proc/self/statm", "r") as fp:
+            return int(fp.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / (1 << 20)
+    except (OSError, ValueError):
+        # peak instead of current, in KB on linux
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+def totals_dict(totals):
+    '''
+    totals_dict(totals)
+    state totals keyed by letter
+    '''
+    return { States.enum_to_string(state):int(count) for state, count in totals.items() }
+
+class Telemetry:
+    '''
+    Telemetry class
+    rate limited JSON lines of the progress of a process
+    '''
+
+    def __init__(self, filename, interval=INTERVAL):
+        '''
+        initialization function
+        '''
+        self.filename = filename
+        self.interval = interval
+        self.run = socket.gethostname() + "-" + str(os.getpid())
+        self.fd = os.open(filename, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+
+        # the replica being simulated
+        self.sim = None
+        self.tot_timesteps = 0
+        self.next_check = 0
+        self.last_time = 0
+        self.last_t = 0
+        self.start_time = 0
+
+        # ensemble progress
+        self.replicas_total = None
+        self.replicas_done = 0
+        self.replica_seconds = 0
+        self.next_ensemble = 0
+
+    def write(self, line):
+        '''
+        write(dictionary)
+        append one JSON line
+        '''
+        line['run'] = self.run
+        line['time'] = round(time.time(), 3)
+        line['interval'] = self.interval
+        os.write(self.fd, (json.dumps(line) + "\n").encode())
+
+    def ensemble_progress(self):
+        '''
+        ensemble_progress()
+        replicas done and expected seconds until the ensemble is done
+        '''
+        if self.replicas_total is None:
+            return None
+
+        eta = None
+        if self.replicas_done > 0:
+            eta = round(self.replica_seconds / self.replicas_done * (self.replicas_total - self.replicas_done), 1)
+        return { 'done':self.replicas_done, 'total':self.replicas_total, 'eta_s':eta }
+
+    def start(self, sim_num, tot_timesteps):
+        '''
+        start(sim_num, total_timesteps)
+        a replica starts; its first line is written at its first check
+        '''
+        self.sim = sim_num
+        self.tot_timesteps = tot_timesteps
+        self.start_time = time.monotonic()
+        self.last_time = self.start_time
+        self.last_t = 0
+        # check after the first timestep, to measure the step rate
+        self.next_check = 1
+
+    def check(self, t, chromatin):
+        '''
+        check(timestep, chromatin)
+        called when t reaches next_check: write a line if the interval
+        has passed, and set the next check from the step rate
+        '''
+        now = time.monotonic()
+        elapsed = now - self.last_time
+        rate = (t - self.last_t) / elapsed if elapsed > 0 else 0
+
+        if elapsed >= self.interval or self.last_t == 0:
+            self.replica_line("replica", t, chromatin, rate)
+            self.last_time = now
+            self.last_t = t
+
+        # timesteps until the interval is up, at the current rate
+        steps_left = (self.interval - (now - self.last_time)) * rate if rate > 0 else 1
+        self.next_check = t + max(1, int(steps_left))
+
+    def replica_line(self, kind, t, chromatin, rate):
+        '''
+        replica_line(kind, timestep, chromatin, steps_per_second)
+        '''
+        eta = None
+        if rate > 0:
+            eta = round((self.tot_timesteps - t) / rate, 1)
+
+        timers = getattr(chromatin, 'timers', None)
+        self.write({
+            'kind':kind,
+            'sim':self.sim,
+            't':t,
+            'T':self.tot_timesteps,
+            'steps_per_s':round(rate, 2),
+            'totals':totals_dict(chromatin.totals),
+            'lim':getattr(chromatin, 'lim', None),
+            'timers':len(timers) if timers is not None else None,
+            'rss_mb':round(rss_mb(), 1),
+            'eta_s':eta,
+            'ensemble':self.ensemble_progress()
+            })
+
+    def finish(self, t, chromatin):
+        '''
+        finish(last_timestep, chromatin)
+        a replica is done
+        '''
+        seconds = time.monotonic() - self.start_time
+        rate = t / seconds if seconds > 0 else 0
+        self.replica_line("done", t, chromatin, rate)
+        self.next_check = float("inf")
+
+    def generation(self, t, generation, cells, totals):
+        '''
+        generation(first_timestep, generation, cells, mean_totals)
+        a generation of a lineage starts
+        '''
+        now = time.monotonic()
+        if now - self.last_time < self.interval and generation > 0:
+            return
+        self.last_time = now
+
+        seconds = now - self.start_time
+        self.write({
+            'kind':"lineage",
+            'sim':self.sim,
+            't':t,
+            'T':self.tot_timesteps,
+            'generation':generation,
+            'cells':cells,
+            'steps_per_s':round(t / seconds, 2) if seconds > 0 else 0,
+            'totals':totals_dict(totals),
+            'rss_mb':round(rss_mb(), 1),
+            'eta_s':round(seconds / t * (self.tot_timesteps - t), 1) if t > 0 else None
+            })
+
+    def start_ensemble(self, max_replicas):
+        '''
+        start_ensemble(max_replicas)
+        '''
+        self.replicas_total = max_replicas
+        self.replicas_done = 0
+        self.replica_seconds = 0
+
+    def replica_done(self, seconds):
+        '''
+        replica_done(seconds_of_the_replica)
+        count a finished replica; writes an ensemble line at most once per interval
+        '''
+        self.replicas_done += 1
+        self.replica_seconds += seconds
+
+        now = time.monotonic()
+        if now < self.next_ensemble and self.replicas_done != self.replicas_total:
+            return
+        self.next_ensemble = now + self.interval
+
+        line = { 'kind':"ensemble", 'rss_mb':round(rss_mb(), 1) }
+        line.update(self.ensemble_progress() or { 'done':self.replicas_done })
+        self.write(line)
+
+    def close(self):
+        os.close(self.fd)
+
+def get_telemetry(inputs):
+    '''
+    get_telemetry(inputs)
+    the telemetry of this process, or None without --telemetry
+    shared by all replicas a process runs
+    '''
+    global _telemetry
+    filename = inputs['data']['telemetry']
+    if filename is None:
+        return None
+
+    interval = inputs['data']['telemetry_interval']
+    if _telemetry is None or (_telemetry.filename, _telemetry.interval) != (filename, interval) or \
+            _telemetry.run != socket.gethostname() + "-" + str(os.getpid()):
+        # new settings, or a forked worker
+        if _telemetry is not None and _telemetry.run == socket.gethostname() + "-" + str(os.getpid()):
+            _telemetry.close()
+        _telemetry = Telemetry(filename, interval)
+    return _telemetry
+
+## reading the stream ##
+
+# a run whose last line is older than this many intervals is stalled
+STALL_INTERVALS = 3
+
+# a replica whose M and A fractions moved less than this over its
+# last STEADY_LINES lines is at steady state
+STEADY_TOL = 0.01
+STEADY_LINES = 5
+
+def read_lines(filename, offset=0):
+    '''
+    read_lines(filename, offset)
+    parse the complete lines after offset
+    returns (lines, new offset)
+    '''
+    lines = []
+    with open(filename, "rb") as fp:
+        fp.seek(offset)
+        data = fp.read()
+
+    end = data.rfind(b"\n") + 1
+    for raw in data[:end].splitlines():
+        try:
+            lines.append(json.loads(raw))
+        except ValueError:
+            # a line cut by a crashed writer
+            continue
+
+    return lines, offset + end
+
+class Summary:
+    '''
+    Summary class
+    latest state of every replica and ensemble in a telemetry stream
+    '''
+
+    def __init__(self):
+        '''
+        initialization function
+        '''
+        # (run, sim) -> list of recent replica lines
+        self.replicas = {}
+        # run -> latest ensemble line
+        self.ensembles = {}
+
+    def add(self, lines):
+        '''
+        add(lines)
+        '''
+        for line in lines:
+            if line.get('kind') == "ensemble":
+                self.ensembles[line['run']] = line
+                continue
+            key = (line['run'], line.get('sim'))
+            recent = self.replicas.setdefault(key, [])
+            recent.append(line)
+            del recent[:-STEADY_LINES]
+
+    def status(self, recent, now):
+        '''
+        status(recent_lines, now)
+        done, stalled, steady or running
+        '''
+        last = recent[-1]
+        if last['kind'] == "done":
+            return "done"
+        if now - last['time'] > STALL_INTERVALS * last.get('interval', INTERVAL):
+            return "stalled"
+        if len(recent) == STEADY_LINES:
+            n = sum(recent[0]['totals'].values())
+            for state in ("M", "A"):
+                fracs = [ line['totals'][state] / n for line in recent ]
+                if max(fracs) - min(fracs) >= STEADY_TOL:
+                    return "running"
+            return "steady"
+        return "running"
+
+    def table(self, now=None):
+        '''
+        table(now)
+        one line per replica, then one per ensemble
+        '''
+        if now is None:
+            now = time.time()
+
+        rows = [ "\t".join(("Run", "Sim", "Status", "Timestep", "Steps/s", "M", "U", "A", "RSS_MB", "ETA_s", "Age_s")) ]
+        for (run, sim), recent in sorted(self.replicas.items(), key=lambda x: (x[0][0], str(x[0][1]))):
+            last = recent[-1]
+            totals = last['totals']
+            rows.append("\t".join(str(x) for x in (
+                run, sim, self.status(recent, now), str(last['t']) + "/" + str(last['T']),
+                last['steps_per_s'], totals['M'], totals['U'], totals['A'],
+                last['rss_mb'], last['eta_s'], round(now - last['time'])
+                )))
+
+        for run, line in sorted(self.ensembles.items()):
+            rows.append("ensemble " + run + ": " + str(line['done']) + "/" + str(line.get('total')) +
+                    " replicas, ETA " + str(line.get('eta_s')) + " s")
+
+        return "\n".join(rows)
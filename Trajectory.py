@@ -0,0 +1,640 @@
+## Trajectory.py
+## Author: Aparna Rajpurkar
+
+# reading and writing simulation trajectories
+# two formats:
+#   text:   one line per timestep, one letter per nucleosome (the original format)
+#   events: binary event log. Only conversions (timestep, index, new state)
+#           are stored, with a full keyframe every K timesteps and a seek
+#           index at the end of the file
+#
+# event log layout (little endian):
+#   header:   magic "HSEVLOG1", n (uint32), keyframe interval (uint32)
+#   blocks:   "K" timestep (uint32) then n states (uint8)
+#             "E" timestep (uint32) count (uint32) then count events (uint32),
+#             each event is nucleosome index << 2 | new state
+#   index:    count (uint32) then count (timestep uint32, offset uint64)
+#   trailer:  index offset (uint64), number of frames (uint32), magic "HSEVEND1"
+# an event with timestep t is first visible in frame t
+#
+# writers hand their bytes to an OutputFile, which collects them in blocks
+# and writes (and optionally gzip compresses) the blocks in a background
+# thread, so the simulation does not wait on the disk
+
+# imports
+import bisect
+import gzip
+import io
+import queue
+import struct
+import threading
+import time
+import zlib
+import numpy as np
+from MyEnum import States, Output, Backpressure
+
+MAGIC = b"HSEVLOG1"
+END_MAGIC = b"HSEVEND1"
+HEADER = struct.Struct("<8sII")
+KEYFRAME = struct.Struct("<cI")
+EVENTS = struct.Struct("<cII")
+TRAILER = struct.Struct("<QI8s")
+INDEX_ENTRY = np.dtype([('t', '<u4'), ('offset', '<u8')])
+EVENT = np.dtype([('t', '<u4'), ('i', '<u4'), ('s', 'u1')])
+STATE_BITS = 2
+STATE_MASK = (1 << STATE_BITS) - 1
+
+# number of events buffered before they are written
+EVENT_BUFFER = 4096
+
+# bytes collected before a block is handed to the writer thread
+WRITE_BLOCK = 1 << 20
+GZIP_MAGIC = b"\x1f\x8b"
+
+# conversion between letters and state enums
+TO_CHAR = np.zeros(shape=(256), dtype=np.uint8)
+FROM_CHAR = np.zeros(shape=(256), dtype=np.uint8)
+for state in States.get_enums():
+    TO_CHAR[state] = ord(States.enum_to_string(state))
+    FROM_CHAR[ord(States.enum_to_string(state))] = state
+
+def get_filename(inputs, sim_num):
+    '''
+    get_filename(inputs, sim_num)
+    name of the trajectory file written by a simulation
+    '''
+    if inputs['adv']['output'] == Output.EVENTS:
+        filename = inputs['o'] + "_" + str(sim_num) + ".evl"
+    else:
+        filename = inputs['o'] + "_" + str(sim_num) + ".txt"
+
+    if inputs['adv']['compress']:
+        filename += ".gz"
+    return filename
+
+def open_output(filename, inputs):
+    '''
+    open_output(filename, inputs)
+    open an output file with the queue and compression chosen in the inputs
+    '''
+    return OutputFile(filename, inputs['data']['write_queue'],
+            inputs['adv']['backpressure'], inputs['adv']['compress'])
+
+def open_writer(inputs, sim_num):
+    '''
+    open_writer(inputs, sim_num)
+    open the trajectory writer chosen in the inputs
+    '''
+    filename = get_filename(inputs, sim_num)
+    fp = open_output(filename, inputs)
+    if inputs['adv']['output'] == Output.EVENTS:
+        return EventLogWriter(fp, inputs['n'], inputs['data']['keyframe'])
+    return TextWriter(fp)
+
+def open_input(filename):
+    '''
+    open_input(filename)
+    open a trajectory file for reading as a seekable binary file
+    gzip files are decompressed into memory, as random access into
+    a gzip stream means decompressing it from the start
+    '''
+    fp = open(filename, "rb")
+    if fp.read(len(GZIP_MAGIC)) == GZIP_MAGIC:
+        fp.seek(0)
+        with gzip.GzipFile(fileobj=fp) as gz:
+            data = gz.read()
+        fp.close()
+        return io.BytesIO(data)
+
+    fp.seek(0)
+    return fp
+
+def open_trajectory(filename):
+    '''
+    open_trajectory(filename)
+    open a trajectory for reading, text or event log
+    '''
+    with open_input(filename) as fp:
+        magic = fp.read(len(MAGIC))
+
+    if magic == MAGIC:
+        return EventLogReader(filename)
+    return TextReader(filename)
+
+def read_totals(filename):
+    '''
+    read_totals(filename)
+    M and A totals of every frame of a trajectory, in one streaming pass
+    '''
+    traj = open_trajectory(filename)
+    trace_M = []
+    trace_A = []
+    for frame in traj.iter_frames():
+        counts = np.bincount(frame, minlength=len(States.get_enums()))
+        trace_M.append(counts[States.M_STATE])
+        trace_A.append(counts[States.A_STATE])
+    traj.close()
+
+    return np.array(trace_M, dtype=np.int32), np.array(trace_A, dtype=np.int32)
+
+## output files ##
+
+class OutputFile:
+    '''
+    OutputFile class
+    write only binary file. Writes are collected into blocks of WRITE_BLOCK
+    bytes that a background thread compresses and writes to disk
+    with queue_size blocks the simulation waits when the queue is full
+    (Backpressure.BLOCK) or keeps going and lets the queue grow
+    (Backpressure.GROW). queue_size 0 writes in the calling thread
+    errors of the writer thread are raised by close()
+    '''
+
+    def __init__(self, filename, queue_size=0, backpressure=Backpressure.BLOCK, compress=False):
+        '''
+        initialization function
+        '''
+        self.filename = filename
+        self.fp = open(filename, "wb")
+
+        # gzip container, so the file can also be read with zcat
+        self.compressor = None
+        if compress:
+            self.compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+        self.pieces = []
+        self.buffered = 0
+        self.position = 0
+
+        # time the simulation spent waiting on output
+        self.wait_time = 0.0
+        self.error = None
+
+        self.queue = None
+        self.thread = None
+        if queue_size > 0:
+            if backpressure == Backpressure.BLOCK:
+                self.queue = queue.Queue(maxsize=queue_size)
+            else:
+                self.queue = queue.Queue()
+            self.thread = threading.Thread(target=self.run, name="writer " + filename, daemon=True)
+            self.thread.start()
+
+    def write(self, data):
+        '''
+        write(bytes or str)
+        '''
+        if isinstance(data, str):
+            data = data.encode()
+
+        self.pieces.append(data)
+        self.buffered += len(data)
+        self.position += len(data)
+
+        if self.buffered >= WRITE_BLOCK:
+            self.hand_off()
+
+    def tell(self):
+        '''
+        tell()
+        number of bytes written so far, before compression
+        '''
+        return self.position
+
+    def hand_off(self):
+        '''
+        hand_off()
+        pass the collected bytes on as one block
+        '''
+        if self.buffered == 0:
+            return
+
+        block = b"".join(self.pieces)
+        self.pieces = []
+        self.buffered = 0
+
+        if self.thread is None:
+            start = time.perf_counter()
+            self.write_block(block)
+            self.wait_time += time.perf_counter() - start
+        elif self.error is None:
+            # the writer thread died, nothing more will be written
+            start = time.perf_counter()
+            self.queue.put(block)
+            self.wait_time += time.perf_counter() - start
+
+    def write_block(self, block):
+        '''
+        write_block(bytes)
+        compress and write a block to disk
+        '''
+        if self.compressor is not None:
+            block = self.compressor.compress(block)
+        self.fp.write(block)
+
+    def run(self):
+        '''
+        run()
+        writer thread: write blocks until close() sends None
+        after an error, keep emptying the queue so the simulation never blocks
+        '''
+        while True:
+            block = self.queue.get()
+            if block is None:
+                return
+            if self.error is not None:
+                continue
+            try:
+                self.write_block(block)
+            except Exception as e:
+                self.error = e
+
+    def close(self):
+        '''
+        close()
+        write everything left, wait for the writer thread and close the file
+        raises the first error of the writer thread
+        '''
+        self.hand_off()
+
+        if self.thread is not None:
+            start = time.perf_counter()
+            self.queue.put(None)
+            self.thread.join()
+            self.wait_time += time.perf_counter() - start
+
+        try:
+            if self.error is None and self.compressor is not None:
+                self.fp.write(self.compressor.flush())
+        except Exception as e:
+            self.error = e
+        finally:
+            self.fp.close()
+
+        if self.error is not None:
+            raise IOError("writing " + self.filename + " failed: " + str(self.error)) from self.error
+
+## writers ##
+
+class TextWriter:
+    '''
+    TextWriter class
+    writes every frame as a line of letters
+    '''
+    # text files do not need conversion events
+    wants_events = False
+
+    def __init__(self, fp):
+        '''
+        initialization function
+        fp is an OutputFile
+        '''
+        self.filename = fp.filename
+        self.fp = fp
+
+    def frame(self, t, chromatin):
+        '''
+        frame(timestep, chromatin)
+        write the current state
+        '''
+        chromatin.print_nucs(self.fp)
+
+    def event(self, t, index, new):
+        pass
+
+    def events(self, t, indicies, new):
+        pass
+
+    def close(self):
+        self.fp.close()
+
+class EventLogWriter:
+    '''
+    EventLogWriter class
+    writes conversion events and a keyframe every K frames
+    '''
+    wants_events = True
+
+    def __init__(self, fp, n, keyframe_every):
+        '''
+        initialization function
+        fp is an OutputFile
+        '''
+        self.filename = fp.filename
+        self.n = n
+        self.keyframe_every = keyframe_every
+
+        self.fp = fp
+        self.fp.write(HEADER.pack(MAGIC, n, keyframe_every))
+
+        self.index = []
+        self.event_t = np.zeros(shape=(EVENT_BUFFER), dtype=np.uint32)
+        self.event_code = np.zeros(shape=(EVENT_BUFFER), dtype=np.uint32)
+        self.num_events = 0
+        self.num_frames = 0
+
+    def frame(self, t, chromatin):
+        '''
+        frame(timestep, chromatin)
+        only every K-th frame is written, as a keyframe
+        '''
+        if t % self.keyframe_every == 0:
+            # keep the file in time order
+            self.flush()
+            self.index.append((t, self.fp.tell()))
+            self.fp.write(KEYFRAME.pack(b"K", t))
+            self.fp.write(chromatin.states.tobytes())
+
+        self.num_frames = t + 1
+
+    def event(self, t, index, new):
+        '''
+        event(timestep, nucleosome_index, new_state)
+        record a conversion that is first visible in frame t
+        '''
+        self.event_t[self.num_events] = t
+        self.event_code[self.num_events] = (index << STATE_BITS) | new
+        self.num_events += 1
+
+        if self.num_events == EVENT_BUFFER:
+            self.flush()
+
+    def events(self, t, indicies, new):
+        '''
+        events(timestep, nucleosome_indicies, new_states)
+        record many conversions that are first visible in frame t
+        '''
+        indicies = np.asarray(indicies, dtype=np.uint32)
+        new = np.asarray(new, dtype=np.uint32)
+
+        if self.num_events + len(indicies) > len(self.event_t):
+            self.flush()
+        if len(indicies) > len(self.event_t):
+            # bigger than the buffer, write straight away
+            self.fp.write(EVENTS.pack(b"E", t, len(indicies)))
+            self.fp.write(((indicies << STATE_BITS) | new).astype(np.uint32).tobytes())
+            return
+
+        end = self.num_events + len(indicies)
+        self.event_t[self.num_events:end] = t
+        self.event_code[self.num_events:end] = (indicies << STATE_BITS) | new
+        self.num_events = end
+
+        # event() expects room for one more
+        if self.num_events == len(self.event_t):
+            self.flush()
+
+    def flush(self):
+        '''
+        flush()
+        write buffered events, one block per timestep
+        '''
+        if self.num_events == 0:
+            return
+
+        times = self.event_t[:self.num_events]
+        starts = np.flatnonzero(np.r_[True, times[1:] != times[:-1]])
+        ends = np.r_[starts[1:], self.num_events]
+
+        for s, e in zip(starts, ends):
+            self.fp.write(EVENTS.pack(b"E", int(times[s]), int(e - s)))
+            self.fp.write(self.event_code[s:e].tobytes())
+
+        self.num_events = 0
+
+    def close(self):
+        '''
+        close()
+        write remaining events, the seek index and the trailer
+        '''
+        self.flush()
+
+        index_offset = self.fp.tell()
+        self.fp.write(struct.pack("<I", len(self.index)))
+        self.fp.write(np.array(self.index, dtype=INDEX_ENTRY).tobytes())
+        self.fp.write(TRAILER.pack(index_offset, self.num_frames, END_MAGIC))
+
+        self.fp.close()
+
+## readers ##
+# all readers give frames as uint8 arrays of state enums
+
+class TextReader:
+    '''
+    TextReader class
+    read a text trajectory
+    '''
+
+    def __init__(self, filename):
+        '''
+        initialization function
+        '''
+        self.filename = filename
+        self.fp = open_input(filename)
+
+        first = self.fp.readline()
+        self.n = len(first.rstrip())
+
+        # every line has the same length, so the file is its own index
+        self.fp.seek(0, 2)
+        self.num_frames = self.fp.tell() // (self.n + 1)
+
+    def iter_frames(self, t0=0, t1=None):
+        '''
+        iter_frames(first_frame, last_frame + 1)
+        stream frames one by one
+        '''
+        if t1 is None or t1 > self.num_frames:
+            t1 = self.num_frames
+
+        self.fp.seek(t0 * (self.n + 1))
+        for t in range(t0, t1):
+            line = self.fp.read(self.n + 1)
+            yield FROM_CHAR[np.frombuffer(line[:self.n], dtype=np.uint8)]
+
+    def window(self, t0, t1):
+        '''
+        window(first_frame, last_frame + 1)
+        all frames of a time window as a (frames, n) array
+        '''
+        t1 = min(t1, self.num_frames)
+        self.fp.seek(t0 * (self.n + 1))
+        raw = np.frombuffer(self.fp.read((t1 - t0) * (self.n + 1)), dtype=np.uint8)
+        return FROM_CHAR[raw.reshape(t1 - t0, self.n + 1)[:, :self.n]]
+
+    def frame(self, t):
+        '''
+        frame(timestep)
+        a single frame
+        '''
+        return self.window(t, t + 1)[0]
+
+    def close(self):
+        self.fp.close()
+
+class EventLogReader:
+    '''
+    EventLogReader class
+    read an event log, jumping to the nearest keyframe and replaying events
+    '''
+
+    def __init__(self, filename):
+        '''
+        initialization function
+        '''
+        self.filename = filename
+        self.fp = open_input(filename)
+
+        magic, self.n, self.keyframe_every = HEADER.unpack(self.fp.read(HEADER.size))
+
+        # read the trailer and seek index
+        self.fp.seek(0, 2)
+        size = self.fp.tell()
+        trailer = None
+        if size >= HEADER.size + TRAILER.size:
+            self.fp.seek(size - TRAILER.size)
+            trailer = TRAILER.unpack(self.fp.read(TRAILER.size))
+
+        if trailer is not None and trailer[2] == END_MAGIC:
+            index_offset, self.num_frames, end = trailer
+            self.end = index_offset
+            self.fp.seek(index_offset)
+            count = struct.unpack("<I", self.fp.read(4))[0]
+            index = np.frombuffer(self.fp.read(count * INDEX_ENTRY.itemsize), dtype=INDEX_ENTRY)
+        else:
+            # unfinished file, e.g. the simulation was killed. Rebuild the index
+            self.end = size
+            index, self.num_frames = self.scan()
+
+        self.index_t = [ int(x) for x in index['t'] ]
+        self.index_offset = [ int(x) for x in index['offset'] ]
+
+    def blocks(self, offset):
+        '''
+        blocks(file_offset)
+        yield ('K', timestep, states) and ('E', timestep, events) blocks from offset on
+        stops quietly at a cut off block
+        '''
+        self.fp.seek(offset)
+        while self.fp.tell() < self.end:
+            tag = self.fp.read(1)
+
+            if tag == b"K":
+                head = self.fp.read(KEYFRAME.size - 1)
+                states = np.frombuffer(self.fp.read(self.n), dtype=np.uint8)
+                if len(head) < KEYFRAME.size - 1 or len(states) < self.n:
+                    return
+                yield 'K', struct.unpack("<I", head)[0], states
+            elif tag == b"E":
+                head = self.fp.read(EVENTS.size - 1)
+                if len(head) < EVENTS.size - 1:
+                    return
+                t, count = struct.unpack("<II", head)
+                raw = self.fp.read(count * 4)
+                if len(raw) < count * 4:
+                    return
+                codes = np.frombuffer(raw, dtype=np.uint32)
+
+                events = np.zeros(shape=(count), dtype=EVENT)
+                events['t'] = t
+                events['i'] = codes >> STATE_BITS
+                events['s'] = codes & STATE_MASK
+                yield 'E', t, events
+            else:
+                return
+
+    def scan(self):
+        '''
+        scan()
+        walk through all blocks to rebuild the seek index
+        '''
+        index = []
+        num_frames = 0
+        offset = HEADER.size
+        for tag, value, data in self.blocks(offset):
+            if tag == 'K':
+                index.append((value, offset))
+                num_frames = max(num_frames, value + 1)
+            else:
+                num_frames = max(num_frames, value + 1)
+            offset = self.fp.tell()
+
+        return np.array(index, dtype=INDEX_ENTRY), num_frames
+
+    def keyframe_before(self, t):
+        '''
+        keyframe_before(timestep)
+        position in the index of the last keyframe at or before t
+        '''
+        k = bisect.bisect_right(self.index_t, t) - 1
+        if k < 0:
+            raise ValueError("no keyframe before frame " + str(t))
+        return k
+
+    def iter_frames(self, t0=0, t1=None):
+        '''
+        iter_frames(first_frame, last_frame + 1)
+        stream frames one by one
+        the same array is updated in place and yielded every time;
+        copy it if you keep it
+        '''
+        if t1 is None or t1 > self.num_frames:
+            t1 = self.num_frames
+        if t0 >= t1:
+            return
+
+        k = self.keyframe_before(t0)
+        current = None
+        t = self.index_t[k]
+        pending = np.zeros(shape=(0), dtype=EVENT)
+
+        blocks = self.blocks(self.index_offset[k])
+
+        while t < t1:
+            # make sure every event of frame t is loaded
+            while len(pending) == 0 or pending['t'][-1] <= t:
+                block = next(blocks, None)
+                if block is None:
+                    break
+                tag, value, data = block
+                if tag == 'K':
+                    if current is None:
+                        current = data.copy()
+                else:
+                    pending = np.concatenate((pending, data[data['t'] > self.index_t[k]]))
+
+            # apply the events of frame t
+            # a nucleosome can convert twice in a timestep; the last one counts
+            upto = np.searchsorted(pending['t'], t, side='right')
+            if upto > 0:
+                index = pending['i'][:upto][::-1]
+                state = pending['s'][:upto][::-1]
+                index, last = np.unique(index, return_index=True)
+                current[index] = state[last]
+                pending = pending[upto:]
+
+            if t >= t0:
+                yield current
+            t += 1
+
+    def window(self, t0, t1):
+        '''
+        window(first_frame, last_frame + 1)
+        all frames of a time window as a (frames, n) array
+        '''
+        t1 = min(t1, self.num_frames)
+        frames = np.zeros(shape=(max(t1 - t0, 0), self.n), dtype=np.uint8)
+        for t, frame in enumerate(self.iter_frames(t0, t1)):
+            frames[t] = frame
+        return frames
+
+    def frame(self, t):
+        '''
+        frame(timestep)
+        a single frame
+        '''
+        for frame in self.iter_frames(t, t + 1):
+            return frame.copy()
+
+    def close(self):
+        self.fp.close()
@@ -0,0 +1,410 @@
+## WorkQueue.py
+## Author: Aparna Rajpurkar
+
+# file-based work queue for sweeps over many machines
+# a sweep is a directory on a shared filesystem; no other service is needed
+#
+#   sweep.json          base inputs, parameter grid, replicas and batch size
+#   todo/<task>.json    tasks nobody works on
+#   leased/<task>@<worker>.json
+#                       tasks a worker claimed. The worker touches the file
+#                       every HEARTBEAT seconds; leases older than the lease
+#                       timeout belong to dead workers and go back to todo/
+#   done/<task>.json    finished tasks, next to their results
+#   done/<task>.npz     running statistics of the replicas of the task
+#   runs/               trajectories of the replicas
+#
+# a task is one batch of replicas of one parameter point. Tasks are claimed
+# and released with os.rename(), which is atomic on one filesystem.
+# every replica has its own random stream (stream = point, sim number), so
+# a task gives the same result whichever worker runs it, and running a task
+# twice after an expired lease is harmless
+# with --crn replica i draws the same numbers at every point (common random
+# numbers, see Constants.CommonStreams). The merge compares replica i of
+# neighbouring points either way and reports how much pairing reduces the
+# variance of their difference (<outfile>_paired.txt)
+
+# imports
+import copy
+import json
+import os
+import socket
+import threading
+import time
+import numpy as np
+import Ensemble
+import MeanField
+
+# seconds between touches of a lease
+HEARTBEAT = 30
+
+# seconds between looks at the queue while other workers finish
+POLL = 5
+
+SUBDIRS = ("todo", "leased", "done", "runs")
+
+def task_name(point, first_sim):
+    '''
+    task_name(point, first_sim)
+    '''
+    return "p" + str(point) + "_s" + str(first_sim)
+
+def point_inputs(sweep, point):
+    '''
+    point_inputs(sweep, point)
+    inputs of one parameter point of a sweep
+    '''
+    inputs = copy.deepcopy(sweep['inputs'])
+    grid = sweep['grid']
+
+    inputs['f'] = grid['f'][point]
+    inputs['data']['divisions'] = grid['divisions'][point]
+    inputs['data']['recruit_time_init'] = grid['recruit_time_init'][point]
+    inputs['data']['recruit_time'] = grid['recruit_time'][point]
+
+    # independent random numbers (unless --crn) and outfiles for every point
+    inputs['data']['stream'] = point
+    inputs['o'] = os.path.join(sweep['dir'], "runs", "point" + str(point))
+
+    return inputs
+
+def fs_now(queue_dir):
+    '''
+    fs_now(queue_dir)
+    current time of the shared filesystem, so leases written by hosts
+    with different clocks can be compared
+    '''
+    clock = os.path.join(queue_dir, ".clock")
+    with open(clock, "a"):
+        os.utime(clock)
+    return os.stat(clock).st_mtime
+
+def create_sweep(queue_dir, inputs):
+    '''
+    create_sweep(queue_dir, inputs)
+    create a sweep over the screened parameters of the inputs
+    (see MeanField.make_grid()) with a fixed number of replicas per point
+    '''
+    for sub in SUBDIRS:
+        os.makedirs(os.path.join(queue_dir, sub), exist_ok=True)
+
+    grid = MeanField.make_grid(inputs)
+    num_points = len(grid['f'])
+    replicas = inputs['data']['replicas']
+    batch = inputs['data']['replica_batch']
+
+    sweep = {
+            'dir' : queue_dir,
+            'inputs' : inputs,
+            'grid' : { name:values.tolist() for name, values in grid.items() },
+            'replicas' : replicas,
+            'batch' : batch
+            }
+
+    with open(os.path.join(queue_dir, "sweep.json"), "w") as fp:
+        json.dump(sweep, fp)
+
+    num_tasks = 0
+    for point in range(num_points):
+        for first_sim in range(0, replicas, batch):
+            task = { 'point':point, 'first_sim':first_sim, 'count':min(batch, replicas - first_sim) }
+            name = task_name(point, first_sim)
+
+            # write, then rename, so workers never see half a task
+            tmp = os.path.join(queue_dir, "todo", "." + name + ".tmp")
+            with open(tmp, "w") as fp:
+                json.dump(task, fp)
+            os.rename(tmp, os.path.join(queue_dir, "todo", name + ".json"))
+            num_tasks += 1
+
+    print("Sweep:", num_points, "points,", num_tasks, "tasks")
+
+def load_sweep(queue_dir):
+    '''
+    load_sweep(queue_dir)
+    '''
+    with open(os.path.join(queue_dir, "sweep.json"), "r") as fp:
+        sweep = json.load(fp)
+
+    # the directory may be mounted somewhere else on this host
+    sweep['dir'] = queue_dir
+    return sweep
+
+def list_tasks(queue_dir, sub):
+    '''
+    list_tasks(queue_dir, subdirectory)
+    file names of the tasks in todo/, leased/ or done/
+    '''
+    return sorted(x for x in os.listdir(os.path.join(queue_dir, sub)) if x.endswith(".json"))
+
+def expire_leases(queue_dir, timeout):
+    '''
+    expire_leases(queue_dir, lease_timeout)
+    put the tasks of dead workers back into todo/
+    '''
+    now = fs_now(queue_dir)
+    for lease in list_tasks(queue_dir, "leased"):
+        path = os.path.join(queue_dir, "leased", lease)
+        try:
+            if now - os.stat(path).st_mtime <= timeout:
+                continue
+            name = lease.split("@")[0]
+            os.rename(path, os.path.join(queue_dir, "todo", name + ".json"))
+            print("Expired lease:", lease)
+        except FileNotFoundError:
+            # finished or expired by someone else in the meantime
+            pass
+
+def claim(queue_dir, worker):
+    '''
+    claim(queue_dir, worker_id)
+    lease the next task. Returns (name, task, lease path) or None
+    '''
+    for todo in list_tasks(queue_dir, "todo"):
+        name = todo[:-len(".json")]
+        lease = os.path.join(queue_dir, "leased", name + "@" + worker + ".json")
+        path = os.path.join(queue_dir, "todo", todo)
+        try:
+            # the heartbeat starts from the claim, not from when the task was
+            # written: touch before the rename, so expire_leases() never sees
+            # the lease with an old time
+            os.utime(path)
+            os.rename(path, lease)
+        except FileNotFoundError:
+            # another worker was faster
+            continue
+
+        if os.path.exists(os.path.join(queue_dir, "done", name + ".npz")):
+            # finished by a worker whose lease had expired
+            os.remove(lease)
+            continue
+
+        with open(lease, "r") as fp:
+            return name, json.load(fp), lease
+
+    return None
+
+class Heartbeat:
+    '''
+    Heartbeat class
+    touch a lease every HEARTBEAT seconds from a background thread
+    '''
+
+    def __init__(self, lease):
+        '''
+        initialization function
+        '''
+        self.lease = lease
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def run(self):
+        while not self.stopped.wait(HEARTBEAT):
+            try:
+                os.utime(self.lease)
+            except FileNotFoundError:
+                # the lease expired and was taken back
+                return
+
+    def stop(self):
+        self.stopped.set()
+        self.thread.join()
+
+def run_task(sweep, name, task):
+    '''
+    run_task(sweep, name, task)
+    run the replicas of a task and write their statistics to done/<name>.npz
+    '''
+    inputs = point_inputs(sweep, task['point'])
+    gaps, offs = Ensemble.run_batch(inputs, task['first_sim'], task['count'])
+
+    gap = Ensemble.RunningStats(inputs['t'])
+    off = Ensemble.RunningStats(inputs['t'])
+    gap.add_batch(gaps)
+    off.add_batch(offs)
+
+    # write, then rename, so the merge never reads half a result
+    done = os.path.join(sweep['dir'], "done")
+    tmp = os.path.join(done, "." + name + "." + socket.gethostname() + "-" + str(os.getpid()) + ".npz")
+    # time averages of every replica, for paired differences between points
+    sims = np.arange(task['first_sim'], task['first_sim'] + task['count'])
+    with np.errstate(invalid='ignore'):
+        replica_gap = np.nanmean(gaps, axis=1)
+        replica_off = np.nanmean(offs, axis=1)
+
+    np.savez(tmp, point=task['point'], replicas=task['count'],
+            gap_count=gap.count, gap_mean=gap.mean, gap_M2=gap.M2,
+            off_count=off.count, off_mean=off.mean, off_M2=off.M2,
+            sims=sims, replica_gap=replica_gap, replica_off=replica_off)
+    os.rename(tmp, os.path.join(done, name + ".npz"))
+
+def run_worker(queue_dir, lease_timeout, worker=None):
+    '''
+    run_worker(queue_dir, lease_timeout, worker_id)
+    claim and run tasks until every task is done
+    returns the number of tasks this worker ran
+    '''
+    if worker is None:
+        worker = socket.gethostname() + "-" + str(os.getpid())
+
+    sweep = load_sweep(queue_dir)
+    num_tasks = 0
+
+    while True:
+        expire_leases(queue_dir, lease_timeout)
+        claimed = claim(queue_dir, worker)
+
+        if claimed is None:
+            if len(list_tasks(queue_dir, "leased")) == 0 and len(list_tasks(queue_dir, "todo")) == 0:
+                return num_tasks
+            # wait for the other workers, or for their leases to expire
+            time.sleep(POLL)
+            continue
+
+        name, task, lease = claimed
+        print("Worker", worker, "task", name)
+
+        heartbeat = Heartbeat(lease)
+        try:
+            run_task(sweep, name, task)
+        finally:
+            heartbeat.stop()
+
+        try:
+            os.rename(lease, os.path.join(queue_dir, "done", name + ".json"))
+        except FileNotFoundError:
+            # our lease expired; the result is written anyway
+            pass
+        num_tasks += 1
+
+def merge(queue_dir, outfile):
+    '''
+    merge(queue_dir, outfile)
+    fold the results of all finished tasks into one ensemble summary per point
+    (<outfile>_point<p>_summary.txt), an overview (<outfile>_sweep.txt)
+    and the paired differences of neighbouring points (<outfile>_paired.txt)
+    returns the number of points with missing tasks
+    '''
+    sweep = load_sweep(queue_dir)
+    num_points = len(sweep['grid']['f'])
+    tot_timesteps = sweep['inputs']['t']
+
+    gap = [ Ensemble.RunningStats(tot_timesteps) for p in range(num_points) ]
+    off = [ Ensemble.RunningStats(tot_timesteps) for p in range(num_points) ]
+    replicas = np.zeros(shape=(num_points), dtype=int)
+    # time averaged gap score and off fraction of every replica of every point
+    averages = [ {} for p in range(num_points) ]
+
+    done = os.path.join(queue_dir, "done")
+    for result in sorted(x for x in os.listdir(done) if x.endswith(".npz") and not x.startswith(".")):
+        with np.load(os.path.join(done, result)) as r:
+            p = int(r['point'])
+            gap[p].merge(r['gap_count'], r['gap_mean'], r['gap_M2'])
+            off[p].merge(r['off_count'], r['off_mean'], r['off_M2'])
+            replicas[p] += int(r['replicas'])
+            for sim, g, o in zip(r['sims'], r['replica_gap'], r['replica_off']):
+                averages[p][int(sim)] = (g, o)
+
+    incomplete = 0
+    with open(outfile + "_sweep.txt", "w") as fp:
+        fp.write("Point\tFValue\tDivisions\tRecruitTimeInit\tRecruitTime\tReplicas\tGapPrecision\tOffPrecision\n")
+        for p in range(num_points):
+            inputs = point_inputs(sweep, p)
+            result = Ensemble.EnsembleResult(inputs, gap[p], off[p], int(replicas[p]))
+            Ensemble.write_summary(result, outfile + "_point" + str(p) + "_summary.txt")
+
+            if replicas[p] < sweep['replicas']:
+                incomplete += 1
+
+            fp.write("\t".join(str(x) for x in (
+                p, inputs['f'], inputs['data']['divisions'], inputs['data']['recruit_time_init'],
+                inputs['data']['recruit_time'], replicas[p], result.gap_precision, result.off_precision
+                )) + "\n")
+
+    rows = paired_differences(sweep['grid'], averages)
+    write_paired(rows, outfile + "_paired.txt")
+    reductions = [ row[-1] for row in rows if np.isfinite(row[-1]) ]
+    if len(reductions) > 0:
+        print("Variance reduction of paired differences: median", round(float(np.median(reductions)), 2),
+                "over", len(reductions), "comparisons")
+
+    return incomplete
+
+def neighbours(grid):
+    '''
+    neighbours(grid)
+    pairs (p, q, parameter) of points that only differ in one parameter,
+    with q at the next screened value of that parameter
+    '''
+    num_points = len(grid['f'])
+    pairs = []
+    for name in grid:
+        values = sorted(set(grid[name]))
+        others = [ other for other in grid if other != name ]
+        for p in range(num_points):
+            k = values.index(grid[name][p])
+            if k + 1 == len(values):
+                continue
+            for q in range(num_points):
+                if grid[name][q] == values[k + 1] and all(grid[other][p] == grid[other][q] for other in others):
+                    pairs.append((p, q, name))
+    return pairs
+
+def paired_differences(grid, averages):
+    '''
+    paired_differences(grid, replica_averages)
+    difference of the time averages of the same replica at neighbouring points
+    rows of (p, q, parameter, value at p, value at q, metric, replicas, mean difference, paired sd,
+    independent sd, variance reduction). The independent sd is that of the
+    difference of unrelated replicas, var(p) + var(q); the reduction is the
+    ratio of the variances, the factor of replicas that pairing saves
+    '''
+    rows = []
+    for p, q, name in neighbours(grid):
+        sims = sorted(set(averages[p]) & set(averages[q]))
+        if len(sims) < 2:
+            continue
+        for m, metric in enumerate(("gap", "off")):
+            x = np.array([ averages[p][sim][m] for sim in sims ])
+            y = np.array([ averages[q][sim][m] for sim in sims ])
+            valid = ~np.isnan(x) & ~np.isnan(y)
+            if np.count_nonzero(valid) < 2:
+                continue
+            x = x[valid]
+            y = y[valid]
+
+            paired = np.var(y - x, ddof=1)
+            independent = np.var(x, ddof=1) + np.var(y, ddof=1)
+            if paired > 0:
+                reduction = independent / paired
+            else:
+                reduction = np.inf if independent > 0 else np.nan
+            rows.append((p, q, name, grid[name][p], grid[name][q], metric, len(x), float(np.mean(y - x)),
+                float(np.sqrt(paired)), float(np.sqrt(independent)), float(reduction)))
+    return rows
+
+def write_paired(rows, filename):
+    '''
+    write_paired(rows, filename)
+    '''
+    with open(filename, "w") as fp:
+        fp.write("PointA\tPointB\tParameter\tFrom\tTo\tMetric\tReplicas\tMeanDifference\tPairedSD\tIndependentSD\tVarianceReduction\n")
+        for row in rows:
+            fp.write("\t".join(str(x) for x in row) + "\n")
+
+def status(queue_dir):
+    '''
+    status(queue_dir)
+    number of tasks in todo/, leased/ and done/, and the age of every lease
+    '''
+    now = fs_now(queue_dir)
+    counts = { sub:len(list_tasks(queue_dir, sub)) for sub in ("todo", "leased", "done") }
+    ages = {}
+    for lease in list_tasks(queue_dir, "leased"):
+        try:
+            ages[lease] = now - os.stat(os.path.join(queue_dir, "leased", lease)).st_mtime
+        except FileNotFoundError:
+            pass
+
+    return counts, ages
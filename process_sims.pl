@@ -52,7 +52,7 @@ foreach my $file (@files) {
         my $gap = ($m - $a) / ($m + $a) ;
 
         my $off = 0;
-        if ($m / 60 >= $PERCENT_M_THRESH) {
+        if ($m / length($line) >= $PERCENT_M_THRESH) {
             $off = 1
         }
 
@@ -95,13 +95,15 @@ foreach my $tot_time (keys %data) {
             warn "calculating timestep $timestep\n";
             my $gap = 0;
             my $off = 0;
+            my $num_sims = 0;
 
             foreach my $sim (keys %{$data{$tot_time}{$f_val}[$timestep]}) {
                 $gap += $data{$tot_time}{$f_val}[$timestep]{$sim}{gap};
                 $off += $data{$tot_time}{$f_val}[$timestep]{$sim}{off};
+                $num_sims++;
             }
-            my $avg_gap = $gap / 100;
-            my $perc_off = $off / 100;
+            my $avg_gap = $gap / $num_sims;
+            my $perc_off = $off / $num_sims;
             my $sd = sd($avg_gap, $data{$tot_time}{$f_val}[$timestep]);
             print OUT ($tot_time - 60000) . "\t$f_val\t$timestep\t$avg_gap\t$sd\t$perc_off\n";
         }